@@ -0,0 +1,137 @@
+"""
+Детерминированные синтетические ответы WB API для бенчмарков.
+
+Форма записей повторяет реальные ответы fullstats v3, sales-funnel v3,
+/adv/v1/upd и content/v2/get/cards/list; одинаковый seed даёт одинаковые данные.
+"""
+import random
+from datetime import date, timedelta
+
+APP_TYPES = (1, 32, 64)
+
+
+def _metrics(rng):
+    views = rng.randint(0, 50_000)
+    clicks = rng.randint(0, max(1, views // 20))
+    orders = rng.randint(0, max(1, clicks // 10))
+    total = round(rng.uniform(0, 20_000), 2)
+    return {
+        'views': views,
+        'clicks': clicks,
+        'ctr': round(clicks / views * 100, 2) if views else 0,
+        'cpc': round(total / clicks, 2) if clicks else 0,
+        'sum': total,
+        'atbs': rng.randint(0, clicks),
+        'orders': orders,
+        'cr': round(orders / clicks * 100, 2) if clicks else 0,
+        'shks': orders,
+        'sum_price': round(orders * rng.uniform(300, 5000), 2),
+        'canceled': rng.randint(0, orders),
+    }
+
+
+def fullstats(n, seed=0, day='2025-01-01'):
+    """n кампаний в формате ответа /adv/v3/fullstats."""
+    rng = random.Random(seed)
+    campaigns = []
+    for i in range(n):
+        nm_id = 100_000_000 + rng.randint(0, 5_000_000)
+        apps = []
+        for app_type in APP_TYPES:
+            app = _metrics(rng)
+            app['appType'] = app_type
+            app['nms'] = [dict(_metrics(rng), nmId=nm_id, name=f"Товар {nm_id}")]
+            apps.append(app)
+        campaign = _metrics(rng)
+        campaign.update({
+            'advertId': 10_000_000 + i,
+            'dates': [day],
+            'days': [dict(_metrics(rng), date=f"{day}T00:00:00Z", apps=apps)],
+        })
+        # У части кампаний (не АРК) boosterStats нет
+        if rng.random() < 0.5:
+            campaign['boosterStats'] = [{'date': f"{day}T00:00:00Z", 'nm': nm_id, 'avg_position': rng.randint(1, 300)}]
+        campaigns.append(campaign)
+    return campaigns
+
+
+def funnel_products(n, seed=0, day='2025-01-01'):
+    """n товаров в формате data.products ответа sales-funnel v3."""
+    rng = random.Random(seed)
+    products = []
+    for i in range(n):
+        open_count = rng.randint(0, 10_000)
+        cart_count = rng.randint(0, max(1, open_count // 5))
+        order_count = rng.randint(0, max(1, cart_count // 2))
+        products.append({
+            'product': {
+                'nmId': 100_000_000 + i,
+                'vendorCode': f"wild{rng.randint(1, 9999)}_{i}",
+                'title': f"Товар {i}",
+                'subjectId': rng.randint(1, 500),
+                'subjectName': f"Предмет {rng.randint(1, 500)}",
+                'brandName': 'Бренд',
+                'productRating': round(rng.uniform(1, 5), 1),
+                'feedbackRating': round(rng.uniform(1, 5), 1),
+                'stocks': {'wb': rng.randint(0, 1000), 'mp': rng.randint(0, 100), 'balanceSum': rng.randint(0, 10**6)},
+            },
+            'statistic': {
+                'selected': {
+                    'period': {'start': day, 'end': day},
+                    'openCount': open_count,
+                    'cartCount': cart_count,
+                    'orderCount': order_count,
+                    'orderSum': order_count * rng.randint(300, 5000),
+                    'buyoutCount': rng.randint(0, order_count),
+                    'buyoutSum': rng.randint(0, 10**6),
+                    'cancelCount': rng.randint(0, order_count),
+                    'cancelSum': rng.randint(0, 10**5),
+                    'avgPrice': rng.randint(300, 5000),
+                    'avgOrdersCountPerDay': round(rng.uniform(0, 50), 2),
+                    'shareOrderPercent': round(rng.uniform(0, 100), 2),
+                    'addToWishlist': rng.randint(0, 500),
+                    'timeToReady': {'days': rng.randint(0, 3), 'hours': rng.randint(0, 23), 'mins': rng.randint(0, 59)},
+                    'localizationPercent': rng.randint(0, 100),
+                },
+            },
+        })
+    return products
+
+
+def adv_spend(n, seed=0, day='2025-01-01'):
+    """n списаний в формате ответа /adv/v1/upd."""
+    rng = random.Random(seed)
+    return [{
+        'updNum': rng.randint(0, 10**6),
+        'updTime': f"{day}T{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:00+03:00",
+        'updSum': rng.randint(1, 50_000),
+        'advertId': 10_000_000 + rng.randint(0, n),
+        'campName': f"wild{rng.randint(10000, 99999)} кампания {i}",
+        'advertType': 9,
+        'paymentType': rng.choice(('Баланс', 'Счет', 'Бонусы')),
+        'advertStatus': rng.choice((9, 11)),
+    } for i in range(n)]
+
+
+def content_cards(n, seed=0):
+    """n карточек в формате cards ответа content/v2/get/cards/list."""
+    rng = random.Random(seed)
+    start = date(2024, 1, 1)
+    cards = []
+    for i in range(n):
+        photos_count = rng.choice((0, 1, 3, 8))
+        cards.append({
+            'nmID': 100_000_000 + i,
+            'imtID': 50_000_000 + i,
+            'subjectID': rng.randint(1, 500),
+            'subjectName': f"Предмет {rng.randint(1, 500)}",
+            'vendorCode': f"wild{rng.randint(1, 9999)}_{i}",
+            'brand': 'Бренд',
+            'title': f"Товар {i}",
+            'photos': [{
+                'big': f"https://basket-01.wbbasket.ru/vol{i}/part{i}/{i}/images/big/{k}.webp",
+                'tm': f"https://basket-01.wbbasket.ru/vol{i}/part{i}/{i}/images/tm/{k}.webp",
+            } for k in range(1, photos_count + 1)],
+            'updatedAt': (start + timedelta(days=rng.randint(0, 365))).isoformat() + 'T00:00:00Z',
+        })
+    return cards
@@ -0,0 +1,235 @@
+"""
+Бенчмарки функций преобразования на синтетических данных.
+
+    python benchmarks/run.py                          # 1k, 100k, 1M записей
+    python benchmarks/run.py --sizes 1000,100000 --only advert,funnel
+    python benchmarks/run.py --save-baseline          # записать benchmarks/baseline.json
+    python benchmarks/run.py --compare                # сравнить с baseline.json
+
+Данные генерируются порциями того же размера, что отдаёт API (100 кампаний
+fullstats, страница воронки на 1000 товаров), время генерации в замер не входит.
+Пик памяти (tracemalloc) меряется отдельным прогоном всего размера, чтобы
+накладные расходы tracemalloc не искажали пропускную способность. В нём
+результаты порций копятся, как в пайплайне, поэтому пик растёт с размером.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+import contextlib
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCH_DIR), 'src'))
+
+import generators  # noqa: E402
+
+DAY = '2025-01-01'
+DEFAULT_SIZES = (1_000, 100_000, 1_000_000)
+BASELINE_PATH = os.path.join(BENCH_DIR, 'baseline.json')
+# Допустимое ухудшение относительно baseline: 20% по скорости и по памяти
+TOLERANCE = 0.2
+
+
+def _advert_input(count, seed):
+    return json.dumps(generators.fullstats(count, seed, DAY)).encode('utf-8')
+
+
+def _advert_run(raw):
+    from advert.utils_advert import parse_fullstats_batch
+    return parse_fullstats_batch(raw, 'bench', DAY)
+
+
+def _funnel_input(count, seed):
+    return json.dumps({'data': {'products': generators.funnel_products(count, seed, DAY)}}).encode('utf-8')
+
+
+def _funnel_run(raw):
+    from funnel.utils_funnel import parse_funnel_page
+    return parse_funnel_page(raw, 'bench')
+
+
+class _StreamedBody:
+    """Тело ответа в виде aiohttp-потока: отдаётся кусками, как из сети."""
+
+    def __init__(self, raw):
+        self._raw = raw
+
+    async def iter_chunked(self, size):
+        for start in range(0, len(self._raw), size):
+            yield self._raw[start:start + size]
+
+
+class _StreamedResponse:
+    def __init__(self, raw):
+        self.content = _StreamedBody(raw)
+
+
+def _advert_stream_run(raw):
+    import asyncio
+    from advert.utils_advert import read_fullstats_stream
+    return asyncio.run(read_fullstats_stream(_StreamedResponse(raw), 'bench', DAY))
+
+
+def _funnel_stream_run(raw):
+    import asyncio
+    from funnel.utils_funnel import read_funnel_stream
+    return asyncio.run(read_funnel_stream(_StreamedResponse(raw), 'bench'))
+
+
+def _content_input(count, seed):
+    import pandas as pd
+    return pd.DataFrame(generators.content_cards(count, seed))
+
+
+def _content_run(df):
+    from content.utils_content import extract_first_photo
+    return df['photos'].apply(extract_first_photo).astype(str)
+
+
+def _spend_input(count, seed):
+    import pandas as pd
+    df = pd.DataFrame(generators.adv_spend(count, seed, DAY))
+    df['account'] = 'bench'
+    return df
+
+
+def _spend_run(df):
+    from advert_spend.utils_adv_spend import postprocess_adv_spend
+    return postprocess_adv_spend(df, DAY)
+
+
+# имя: (размер порции, подготовка входа, замеряемая функция)
+BENCHMARKS = {
+    'advert': (100, _advert_input, _advert_run),
+    'funnel': (1000, _funnel_input, _funnel_run),
+    # Потоковый разбор тех же ответов (WB_STREAM_JSON=1)
+    'advert_stream': (100, _advert_input, _advert_stream_run),
+    'funnel_stream': (1000, _funnel_input, _funnel_stream_run),
+    'content': (100_000, _content_input, _content_run),
+    'advert_spend': (100_000, _spend_input, _spend_run),
+}
+
+
+@contextlib.contextmanager
+def _quiet():
+    """Диагностические print в горячем цикле уходят в /dev/null: их стоимость остаётся в замере, а вывод не засоряется."""
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def _chunks(size, chunk):
+    for start in range(0, size, chunk):
+        yield start // chunk, min(chunk, size - start)
+
+
+def peak_memory(make_input, run, size, chunk, seed):
+    """
+    Пик памяти (байт) при обработке size записей порциями по chunk.
+
+    Результаты порций держатся до конца прогона; генерация входа в пик не
+    попадает, в нём только текущая порция входа.
+    """
+    tracemalloc.start()
+    try:
+        results, peak = [], 0
+        for index, count in _chunks(size, chunk):
+            data = make_input(count, seed + index)
+            tracemalloc.reset_peak()
+            with _quiet():
+                results.append(run(data))
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            del data
+        return peak
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmark(name, size, seed=0, memory=True):
+    chunk, make_input, run = BENCHMARKS[name]
+    # Прогрев: импорты и первые вызовы не должны попадать в замер
+    with _quiet():
+        run(make_input(min(chunk, size), seed))
+
+    elapsed = 0.0
+    for index, count in _chunks(size, chunk):
+        data = make_input(count, seed + index)
+        with _quiet():
+            started = time.perf_counter()
+            run(data)
+            elapsed += time.perf_counter() - started
+
+    result = {
+        'records': size,
+        'seconds': round(elapsed, 4),
+        'records_per_sec': round(size / elapsed) if elapsed else None,
+    }
+    if memory:
+        result['peak_mib'] = round(peak_memory(make_input, run, size, chunk, seed) / 1024 / 1024, 2)
+    return result
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """Список регрессий относительно baseline: медленнее или прожорливее больше чем на tolerance."""
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        if base.get('records_per_sec') and result['records_per_sec'] < base['records_per_sec'] * (1 - tolerance):
+            regressions.append(f"{key}: {result['records_per_sec']} зап/с против {base['records_per_sec']} в baseline")
+        if base.get('peak_mib') and result.get('peak_mib') is not None and result['peak_mib'] > base['peak_mib'] * (1 + tolerance):
+            regressions.append(f"{key}: пик {result['peak_mib']} MiB против {base['peak_mib']} MiB в baseline")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки функций преобразования на синтетических данных")
+    parser.add_argument('--sizes', default=','.join(str(size) for size in DEFAULT_SIZES), help="размеры через запятую")
+    parser.add_argument('--only', help=f"бенчмарки через запятую: {', '.join(BENCHMARKS)}")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', action='store_true', help="не мерить пик памяти")
+    parser.add_argument('--save-baseline', nargs='?', const=BASELINE_PATH, metavar='PATH', help="сохранить результаты как baseline")
+    parser.add_argument('--compare', nargs='?', const=BASELINE_PATH, metavar='PATH', help="сравнить с baseline; код выхода 1 при регрессии")
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help="допустимое ухудшение, доля (по умолчанию 0.2)")
+    args = parser.parse_args(argv)
+
+    names = args.only.split(',') if args.only else list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"Неизвестные бенчмарки: {', '.join(unknown)}")
+    sizes = [int(size) for size in args.sizes.split(',')]
+    if args.compare and not os.path.isfile(args.compare):
+        # baseline зависит от машины и в репозиторий не входит
+        print(f"❌ Нет baseline {args.compare}: сначала запишите его на эталонной машине (--save-baseline)")
+        return 2
+
+    results = {}
+    print(f"{'Бенчмарк':<28}{'записей':>10}{'время, с':>10}{'зап/с':>12}{'пик, MiB':>10}")
+    for name in names:
+        for size in sizes:
+            result = run_benchmark(name, size, args.seed, memory=not args.no_memory)
+            results[f"{name}@{size}"] = result
+            peak = result.get('peak_mib', '-')
+            print(f"{name:<28}{size:>10}{result['seconds']:>10.2f}{result['records_per_sec'] or 0:>12}{peak:>10}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"💾 Baseline сохранён: {args.save_baseline}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print("🐢 Регрессии:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("✅ Регрессий нет")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
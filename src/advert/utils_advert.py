@@ -1,151 +1,31 @@
 import os
-import aiohttp
 import asyncio
-from datetime import datetime, timedelta
-import gspread
-from time import time
-import logging
-from dotenv import load_dotenv
+from datetime import timedelta
 import json
-import pandas as pd
-import requests
+import logging
 import itertools
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from advert.utils_pruning import load_history, save_history, plan_requests, record_activity
+from facts.utils_rolling import update_rolling_store
+from wb_core.config import load_api_tokens, SPREADSHEET_TITLE
+from wb_core.sheets import safe_open_spreadsheet, send_df_to_google, refresh_df_in_google
+from wb_core.planner import fullstats_unit, estimate, fit_deadline, format_duration
+from wb_core.profiling import stage, profile_inline
+from wb_core.http import get_session, get_sync_session, close_sessions, pause
+from wb_core.cassette import now
+from wb_core.identity import remember
+from wb_core.logs import count, flush_counters, in_worker, merge_counters, sample
+from wb_core.raw_store import ResponseRecorder, new_fetch_id, save_response
+from wb_core.jsonstream import STREAM_ENABLED, iter_array
+from wb_core.utils import batchify, records_to_columns, columns_to_frame
 
-load_dotenv()
-
-def load_api_tokens():
-    # Проверяем наличие файла tokens.json во всех директориях проекта
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-
-    while True:
-        tokens_path = os.path.join(current_dir, 'tokens.json')
-        if os.path.isfile(tokens_path):
-            try:
-                with open(tokens_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                print(f"Ошибка декодирования JSON в файле: {tokens_path}")
-                return None
-
-        # Поднимаемся на уровень выше
-        parent_dir = os.path.dirname(current_dir)
-        if parent_dir == current_dir:
-            # Достигли корня диска
-            break
-        current_dir = parent_dir
-
-    print("Файл tokens.json не найден ни в одной из директорий")
-    return None
-
-def safe_open_spreadsheet(title, retries=5, delay=5):
-    """
-    Пытается открыть таблицу с повторными попытками при APIError 503.
-    """
-    gc = gspread.service_account(filename=os.path.join(os.path.dirname(__file__), 'creds.json'))
-    
-    for attempt in range(1, retries + 1):
-        logging.info(f"[Попытка {attempt}] открыть доступ к таблице '{title}'")
-        
-        try:
-            spreadsheet = gc.open(title)
-            logging.info(f"✅ Таблица '{title}' успешно открыта")
-            return spreadsheet
-            
-        except gspread.APIError as e:
-            error_code = e.response.status_code if hasattr(e, 'response') else None
-            logging.info(f"⚠️ [Попытка {attempt}/{retries}] APIError {error_code}: {e}")
-            
-            if error_code == 503:
-                if attempt < retries:
-                    logging.info(f"⏳ Ожидание {delay} секунд перед повторной попыткой...")
-                    time.sleep(delay)
-                    # Увеличиваем задержку для следующей попытки (exponential backoff)
-                    delay *= 2
-                else:
-                    logging.error("❌ Все попытки исчерпаны")
-                    raise
-            else:
-                # Другие ошибки API (403, 404 и т.д.) - не повторяем
-                raise
-                
-        except gspread.SpreadsheetNotFound:
-            logging.info(f"❌ Таблица '{title}' не найдена")
-            raise
-            
-        except Exception as e:
-            logging.error(f"⚠️ [Попытка {attempt}/{retries}] Неожиданная ошибка: {e}")
-            if attempt < retries:
-                logging.error(f"⏳ Ожидание {delay} секунд...")
-                time.sleep(delay)
-                delay *= 2
-            else:
-                raise RuntimeError(f"Не удалось открыть таблицу '{title}' после {retries} попыток.")
-            
-def send_df_to_google(df, sheet):
-    """
-    Отправляет DataFrame на указанный лист Google Таблицы.
-
-    Параметры:
-    df (DataFrame): DataFrame, который нужно отправить.
-    sheet (gspread.models.Worksheet): Объект листа, на который будут добавлены данные.
-
-    Возвращаемое значение:
-    None
-    """
-    try:
-        # Данные, которые нужно добавить
-        df_data_to_append = [df.columns.values.tolist()] + df.values.tolist()
-        
-        # Проверка существующих данных на листе
-        existing_data = sheet.get_all_values()
-        
-        if len(existing_data) <= 1:  # Если данных нет
-            print("Добавляем заголовки и данные")
-            sheet.append_rows(df_data_to_append, value_input_option='USER_ENTERED')
-             # Получаем текущую дату и время
-            now = datetime.now()
-            formatted_time = now.strftime("%Y-%m-%d %H:%M:%S")
-            
-            # Получаем количество колонок на листе
-            max_columns = sheet.col_count
-            
-            # Записываем дату и время в первую строку последней колонки
-            sheet.update_cell(1, max_columns, formatted_time)
-            print(f"Дата и время последнего обновления: {formatted_time}")
-        else:
-            print("Добавляем только данные")
-            sheet.append_rows(df_data_to_append[1:], value_input_option='USER_ENTERED')
-            now = datetime.now()
-            formatted_time = now.strftime("%Y-%m-%d %H:%M:%S")
-            
-            # Получаем количество колонок на листе
-            max_columns = sheet.col_count
-            
-            # Записываем дату и время в первую строку последней колонки
-            sheet.update_cell(1, max_columns, formatted_time)
-            print(f"Дата и время последнего обновления: {formatted_time}")
-            
-    except Exception as e:
-        print(f"An error occurred: {e}")
-
-# === Для ежедневной воронки
-def batchify(data, batch_size):
-    """
-    Splits data into batches of a specified size.
-
-    Parameters:
-    - data: The list of items to be batched.
-    - batch_size: The size of each batch.
-
-    Returns:
-    - A generator yielding batches of data.
-    """
-    for i in range(0, len(data), batch_size):
-        yield data[i:i + batch_size]    
+log = logging.getLogger('wb.advert')
 
 
 semaphore = asyncio.Semaphore(10)
-async def adv_stat_async(campaign_ids: list, date_from: str, date_to: str, api_token: str, account: str):
+
+async def adv_stat_async(campaign_ids: list, date_from: str, date_to: str, api_token: str, account: str, parser_pool=None, session=None, stream=None):
     """
     Получение статистики по списку ID кампаний за указанный период.
 
@@ -154,55 +34,79 @@ async def adv_stat_async(campaign_ids: list, date_from: str, date_to: str, api_t
     :param date_to: дата окончания периода в формате YYYY-MM-DD
     :param api_token: токен для API WB
     :param account: название аккаунта
+    :param parser_pool: пул процессов для разбора ответов (None — разбор в текущем процессе)
+    :param session: aiohttp-сессия (None — общий пул соединений к хосту WB)
+    :param stream: разбирать ответ потоково по мере чтения (None — по WB_STREAM_JSON)
+    :return: список колоночных батчей {колонка: [значения]}
     """
+    import aiohttp
+
     url = "https://advert-api.wildberries.ru/adv/v3/fullstats"
     headers = {"Authorization": api_token}
     batches = list(batchify(campaign_ids, 100))
     data = []
+    fetch_id = new_fetch_id()
+    if stream is None:
+        stream = STREAM_ENABLED
     async with semaphore:
-        async with aiohttp.ClientSession(headers=headers) as session:
-            for batch in batches:
-                ids_str = ",".join(str(c) for c in batch)
-                params = {"ids": ids_str, "beginDate": date_from, "endDate": date_to}
-
-                print(f"Запрос для {account}: {params}")
-
-                retry_count = 0
-                while retry_count < 5:
-                    try:
-                        async with session.get(url, params=params) as response:
-                            print(f"HTTP статус: {response.status}")
-
-                            if response.status == 400:
-                                err = await response.json()
-                                print(f"Ошибка 400 {account}: {err.get('message') or err}")
-                                # retry_count += 1
-                                # await asyncio.sleep(60)
-                                continue
-
-                            if response.status == 429:
-                                print("429 Too Many Requests — ждём минуту")
-                                retry_count += 1
-                                await asyncio.sleep(60)
-                                continue
-
-                            response.raise_for_status()
-                            batch_data = await response.json()
-
-                            # добавляем поле account в каждый элемент
-                            for item in batch_data or []:
-                                item["account"] = account
-                                item["date"] = date_from
-                            data.extend(batch_data or [])
+        if session is None:
+            session = get_session(url)
+        for batch in batches:
+            ids_str = ",".join(str(c) for c in batch)
+            params = {"ids": ids_str, "beginDate": date_from, "endDate": date_to}
+
+            # Полный список ID в лог не пишем: сотни номеров на запрос делали лог нечитаемым
+            log.debug(f"Запрос fullstats для {account} за {date_from}: {len(batch)} кампаний")
+
+            retry_count = 0
+            while retry_count < 5:
+                try:
+                    async with session.get(url, params=params, headers=headers) as response:
+                        count(f"fullstats HTTP {response.status}")
+                        if response.status == 200 and (seen := sample('advert.fullstats.ok')):
+                            log.info(f"fullstats {account} за {date_from}: HTTP 200 (ответ №{seen})")
+
+                        if response.status == 400:
+                            err = await response.json()
+                            log.warning(f"Ошибка 400 {account}: {err.get('message') or err}")
+                            # retry_count += 1
+                            # await asyncio.sleep(60)
+                            continue
+
+                        if response.status == 429:
+                            log.warning(f"429 Too Many Requests для {account} — ждём минуту")
+                            retry_count += 1
+                            await pause(60)
+                            continue
+
+                        response.raise_for_status()
+                        if stream:
+                            recorder = ResponseRecorder('advert', date_from, account, fetch_id, ids=ids_str, date_to=date_to)
+                            columns = await read_fullstats_stream(response, account, date_from, recorder)
+                            # Сырой ответ пишем только дочитанным: оборванный уйдёт на повтор
+                            recorder.close()
+                            data.append(columns)
                             break
+                        raw = await response.read()
+                        # Сырой ответ — в локальное хранилище для офлайн-пересборки (wb reprocess)
+                        await asyncio.to_thread(save_response, 'advert', date_from, account, fetch_id, raw, ids=ids_str, date_to=date_to)
+                        # Декодирование и разворот JSON нагружают CPU — отдаём их в пул процессов,
+                        # чтобы не блокировать event loop с остальными запросами
+                        if parser_pool is not None:
+                            loop = asyncio.get_running_loop()
+                            columns = merge_counters(await loop.run_in_executor(parser_pool, in_worker, parse_fullstats_batch, raw, account, date_from))
+                        else:
+                            columns = parse_fullstats_batch(raw, account, date_from)
+                        data.append(columns)
+                        break
 
-                    except aiohttp.ClientError as e:
-                        print(f"Сетевая ошибка для {account}: {e}")
-                        retry_count += 1
-                        await asyncio.sleep(30)
+                except aiohttp.ClientError as e:
+                    log.warning(f"Сетевая ошибка для {account}: {e}")
+                    retry_count += 1
+                    await asyncio.sleep(30)
 
-                # WB ограничивает 1 запрос/мин → ждём после каждого батча
-                await asyncio.sleep(60)
+            # WB ограничивает 1 запрос/мин → ждём после каждого батча
+            await pause(60)
 
         return data
     
@@ -219,11 +123,11 @@ def camp_list(api_token: str, account: str):
                 }
         payload = []
         try:
-            res = requests.post(url, headers=headers, params=params, json=payload)
+            res = get_sync_session(url).post(url, headers=headers, params=params, json=payload)
             res.raise_for_status()
             data = res.json()
         except Exception as e:
-            print(e)
+            log.warning(f"Список РК {account} (статус {status_id}): {e}")
             data = []
 
         if data:
@@ -233,7 +137,6 @@ def camp_list(api_token: str, account: str):
                 camps.append(data)
     return camps
 
-
 def camp_list_manual(api_token: str, account: str):
     url = 'https://advert-api.wildberries.ru/adv/v0/auction/adverts'
     camps = []
@@ -244,11 +147,11 @@ def camp_list_manual(api_token: str, account: str):
         'status': status_id
                 }
         try:
-            res = requests.get(url, headers=headers, params=params)
+            res = get_sync_session(url).get(url, headers=headers, params=params)
             res.raise_for_status()
             data = res.json()
         except Exception as e:
-            print(e)
+            log.warning(f"Список ручных РК {account} (статус {status_id}): {e}")
             data = []
 
         if data:
@@ -258,35 +161,74 @@ def camp_list_manual(api_token: str, account: str):
                 camps.append(data['adverts'])
     return camps    
 
-async def get_all_adv_data(days_count=1):
-    """ Получаем по ручной и единой РК"""
+def get_campaigns(api_token: str, account: str):
+    """
+    Активные и приостановленные РК кабинета (единая и ручная ставка).
+
+    Возвращает {advertId: {'status': статус, 'changeTime': время последнего изменения}};
+    для ручных РК время изменения — timestamps.updated.
+    """
+    campaigns = {}
+    # Получаем информацию об РК с единой ставкой
+    for c in itertools.chain(*camp_list(api_token, account)):
+        campaigns[c['advertId']] = {'status': c.get('status'), 'changeTime': c.get('changeTime')}
+    # Получаем информацию об РК с ручной ставкой
+    for c in itertools.chain(*camp_list_manual(api_token, account)):
+        if c['status'] in (9, 11):
+            campaigns[c['id']] = {'status': c['status'], 'changeTime': (c.get('timestamps') or {}).get('updated')}
+    return campaigns
+
+async def get_all_adv_data(days_count=1, prune=True, deadline=None):
+    """
+    Получаем по ручной и единой РК. Возвращает колоночные батчи, см. columns_to_frame.
+
+    prune=True — до запроса fullstats отсеиваем кампании, у которых за день
+    доказанно не было активности (см. advert.utils_pruning).
+    deadline — сколько секунд готовы ждать: план урезается до самых свежих
+    дней, которые успеют выгрузиться по модели лимитов (см. wb_core.planner).
+    """
     all_adv_data = []
     tasks = []
+    history = load_history() if prune else {}
     for account, api_token in load_api_tokens().items():
-        # Получаем информацию об РК с единой ставкой
-        camps_list = camp_list(api_token, account)
-        # Преобразуем список списков в один список
-        campaigns = list(itertools.chain(*camps_list))
-        campaign_ids = [c['advertId'] for c in campaigns]
-        # Получаем информацию об РК с ручной ставкой
-        camps_list_2 = camp_list_manual(api_token, account)
-        # Преобразуем список списков в один список
-        campaigns_2 = list(itertools.chain(*camps_list_2))
-        campaign_ids_2 = [c['id'] for c in campaigns_2 if c['status'] in (9, 11)]
-        # Объединяем списки РК в единый
-        campaign_ids.extend(campaign_ids_2)
-        # Убираем дубликаты
-        campaign_ids = list(set(campaign_ids))
-        for day in range(1, days_count+1):
-            yesterday = datetime.now() - timedelta(days=day)
-            date_from = date_to = yesterday.strftime("%Y-%m-%d")
-            print(f"Получаем данные за {date_from} по ЛК {account}")
+        with stage('advert.campaigns'):
+            campaigns = get_campaigns(api_token, account)
+            checked_at = now().timestamp()
+        days = [(now() - timedelta(days=day)).strftime("%Y-%m-%d") for day in range(1, days_count+1)]
+        with stage('advert.prune'):
+            plan = plan_requests(account, api_token, campaigns, checked_at, days, history) if prune else {day: list(campaigns) for day in days}
+        for date_from in days:
+            date_to = date_from
+            log.debug(f"Получаем данные за {date_from} по ЛК {account}")
             # date_range = [date_from]
-            tasks.append(adv_stat_async(campaign_ids, date_from, date_to, api_token, account))
-    # Получаем статистику по кампаниям
-    stats = await asyncio.gather(*tasks)
-    for stat in stats:
+            tasks.append((plan[date_from], date_from, date_to, api_token, account))
+    units = [fullstats_unit(task[4], task[1], task[0]) for task in tasks]
+    if deadline:
+        units, dropped = fit_deadline(units, deadline)
+        kept = {(unit['account'], unit['day']) for unit in units}
+        # Свежие дни — первыми, чтобы при обрыве по времени потерять самые старые
+        tasks = sorted((task for task in tasks if (task[4], task[1]) in kept), key=lambda task: task[1], reverse=True)
+        if dropped:
+            log.info(f"✂️ Под дедлайн {format_duration(deadline)} не влезли дни: {', '.join(sorted(dropped))}")
+    for requests_count, seconds in estimate(units).values():
+        log.info(f"⏱ fullstats: {requests_count} запросов, ~{format_duration(seconds)}")
+    # Получаем статистику по кампаниям, ответы разбираются параллельно на всех ядрах
+    # (при профилировании — в текущем процессе, чтобы этапы разбора попали в отчёт)
+    with nullcontext() if profile_inline() else ProcessPoolExecutor(max_workers=os.cpu_count()) as parser_pool:
+        try:
+            with stage('advert.fetch'):
+                stats = await asyncio.gather(*(adv_stat_async(*task, parser_pool=parser_pool) for task in tasks))
+        finally:
+            await close_sessions()
+    for (campaign_ids, date_from, _, _, account), stat in zip(tasks, stats):
+        # Нули запоминаем только по полностью полученным дням: пропавший батч — не доказательство
+        if prune and len(stat) == -(-len(campaign_ids) // 100):
+            record_activity(history, account, date_from, campaign_ids, stat)
         all_adv_data.extend(stat)
+    if prune:
+        save_history(history, accounts={task[4] for task in tasks})
+    # Статусы ответов и кампании без boosterStats — одной строкой за выгрузку
+    flush_counters(log)
     return all_adv_data
 
 def processed_adv_data(adv_data):
@@ -297,6 +239,8 @@ def processed_adv_data(adv_data):
             camp['avg_position'] = camp['boosterStats'][0]['avg_position']
         except (KeyError, IndexError):
             camp['avg_position'] = None
+            # Обычное дело для кампаний без АРК: считаем, а не пишем строку на кампанию
+            count('кампаний без boosterStats')
         # Получаем данные по всем платформам ios, PC, android
         try:
             platforms = camp['days'][0]['apps']
@@ -338,17 +282,81 @@ def processed_adv_data(adv_data):
                     camp['views_ios'] = platform['views']
                     camp['article_id'] = platform['nms'][0]['nmId']
         except KeyError:
-            print('no days key')
-        
+            count('кампаний без days')
+
         # Удаляем ненужные ключи, перед созданием датафрейма
-        try:
-            del camp['boosterStats']
-        except KeyError:
-            print("Нет ключа boosterStats")
-        # 
-        try:
-            del camp['days']
-        except KeyError:
-            print("Нет ключа boosterStats")
+        camp.pop('boosterStats', None)
+        camp.pop('days', None)
         processed_data.append(camp)
-    return processed_data
\ No newline at end of file
+    return processed_data
+
+def flatten_fullstats(items, account: str, date: str):
+    """Плоские строки кампаний из элементов ответа fullstats."""
+    # добавляем поле account в каждый элемент
+    for item in items:
+        item["account"] = account
+        item["date"] = date
+    return processed_adv_data(items)
+
+def parse_fullstats_batch(raw: bytes, account: str, date: str):
+    """
+    Декодирует ответ fullstats и разворачивает его в колоночный батч.
+
+    Выполняется в процессе пула: в event loop возвращаются только
+    плоские списки значений, которые дёшево передать между процессами.
+    """
+    with stage('advert.decode'):
+        batch_data = json.loads(raw) or []
+    with stage('advert.flatten'):
+        return records_to_columns(flatten_fullstats(batch_data, account, date))
+
+async def read_fullstats_stream(response, account: str, date: str, recorder=None):
+    """
+    Потоковый разбор ответа fullstats: кампании разворачиваются по мере
+    прихода байтов, дерево всего ответа в памяти не собирается.
+    """
+    rows = []
+    async for items in iter_array(response, recorder=recorder):
+        rows.extend(flatten_fullstats(items, account, date))
+    return records_to_columns(rows)
+
+def prepare_adv_frame(df):
+    """Добавляет CPM и оставляет колонки листа БД_Рекламная_статистика."""
+    import numpy as np
+
+    # Добавляем данные о cpm рекламной кампании
+    df['cpm'] = (df['sum'] / df['views'].replace(0, np.nan) * 1000).round(2)
+    # Выбираем нужные для отображения в гугл-таблице колонки
+    using_cols = ['date', 'avg_position', 'cr', 'atbs', 'article_id', 'advertId', 'views', 'clicks', 'sum', 'orders', 'sum_price', 'canceled', 'ctr', 'cpc', 'cpm', 'account']
+    # Создаем из них датафрейм
+    df_short = df[using_cols]
+    df_short = df_short.fillna(0)
+    df_short.loc[:, 'date'] = df_short['date'].astype(str)
+    return df_short.drop_duplicates()
+
+
+def main_advert(days_count=1, refresh=False, prune=True, deadline=None):
+    """
+    refresh=True — перезапрашиваем последние days_count дней и пишем
+    на лист только изменившиеся ячейки вместо дописывания дублей.
+    prune=False — запрашиваем fullstats по всем кампаниям без отсева.
+    deadline — лимит времени выгрузки в секундах, см. get_all_adv_data.
+    """
+    adv_data = asyncio.run(get_all_adv_data(days_count, prune, deadline))
+    with stage('advert.frame'):
+        df = columns_to_frame(adv_data)
+        # CPM и колонки для гугл-таблицы
+        df_short = prepare_adv_frame(df)
+    with stage('advert.upload'):
+        table = safe_open_spreadsheet(SPREADSHEET_TITLE)
+        sheet = table.worksheet("БД_Рекламная_статистика")
+        if refresh:
+            refresh_df_in_google(df_short, sheet, key_cols=['date', 'account', 'advertId'])
+        else:
+            send_df_to_google(df_short, sheet)
+    # Доливаем день в скользящие окна 7/14/30 дней
+    with stage('advert.rolling'):
+        update_rolling_store(adv_df=df_short)
+    # Привязки кампаний к артикулам — в индекс идентификаторов
+    with stage('advert.identity'):
+        remember(campaigns=df_short)
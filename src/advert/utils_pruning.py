@@ -0,0 +1,168 @@
+import os
+import json
+import time
+import logging
+import threading
+from datetime import date, datetime, timedelta, timezone
+
+from wb_core.utils import state_lock
+
+# Отсев кампаний без активности до запроса fullstats: каждый батч из 100 ID
+# стоит минуту лимита, а приостановленные кампании статистики не дают.
+# Кампания отсеивается только если отсутствие активности за день доказано:
+#   - статус 11 (пауза) и последнее изменение кампании раньше начала дня,
+#     а список кампаний получен после конца дня (или только что);
+#   - статус 11 без времени изменения — если все ZERO_DAYS предыдущих дней
+#     fullstats по ней были нулевыми.
+# Списание по кампании в /adv/v1/upd за день всегда оставляет её в запросе.
+PAUSED_STATUS = 11
+ZERO_DAYS = 7
+# Сколько секунд список кампаний считается свежим для текущего дня
+FRESH_SECONDS = 10 * 60
+# Сколько дней истории нулевых дней хранить по кампании
+HISTORY_DAYS = 30
+MSK = timezone(timedelta(hours=3))
+
+HISTORY_PATH = os.path.join(os.getenv('WB_STATE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'state')), 'campaign_activity.json')
+
+
+def parse_change_time(value):
+    """Время изменения кампании из ответа API (ISO 8601, без зоны — МСК) или None."""
+    if not value:
+        return None
+    try:
+        moment = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return moment if moment.tzinfo else moment.replace(tzinfo=MSK)
+
+
+def _day_bounds(day):
+    start = datetime.combine(date.fromisoformat(day), datetime.min.time(), tzinfo=MSK)
+    return start, start + timedelta(days=1)
+
+
+def load_history(path=HISTORY_PATH):
+    if not os.path.isfile(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_history(history, path=HISTORY_PATH, accounts=None):
+    """
+    Сохраняет историю нулевых дней.
+
+    accounts — кабинеты, которые выгрузил этот процесс: в файле заменяются только
+    их ключи, остальные берутся с диска (их пишут другие воркеры очереди), и
+    history обновляется до сохранённого состояния. None — файл пишется целиком.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with state_lock(path):
+        if accounts is not None:
+            accounts = set(accounts)
+            merged = {key: dates for key, dates in load_history(path).items() if _history_account(key) not in accounts}
+            merged.update((key, dates) for key, dates in history.items() if _history_account(key) in accounts)
+            history.clear()
+            history.update(merged)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(history, f)
+        os.replace(tmp_path, path)
+    return history
+
+
+def _history_key(account, advert_id):
+    return f"{account}|{advert_id}"
+
+
+def _history_account(key):
+    return key.rsplit('|', 1)[0]
+
+
+def _zero_streak(history, account, advert_id, day):
+    zero_dates = set(history.get(_history_key(account, advert_id), ()))
+    first = date.fromisoformat(day)
+    return all((first - timedelta(days=i)).isoformat() in zero_dates for i in range(1, ZERO_DAYS + 1))
+
+
+def prune_campaigns(campaigns, account, day, checked_at, spend_ids=(), history=None):
+    """
+    Делит кампании на те, что стоит запрашивать за day, и доказанно неактивные.
+
+    campaigns — {advertId: {'status': int, 'changeTime': str | None}},
+    checked_at — unix-время получения списка кампаний,
+    spend_ids — advertId со списаниями за день из /adv/v1/upd.
+    Возвращает (ID для запроса, отсеянные ID).
+    """
+    history = history or {}
+    day_start, day_end = _day_bounds(day)
+    # Статус в списке доказывает паузу только до момента его получения
+    status_covers_day = checked_at >= day_end.timestamp() or time.time() - checked_at <= FRESH_SECONDS
+    spend_ids = set(spend_ids)
+
+    keep, pruned = [], []
+    for advert_id, info in campaigns.items():
+        inactive = False
+        if advert_id not in spend_ids and info.get('status') == PAUSED_STATUS and status_covers_day:
+            changed = parse_change_time(info.get('changeTime'))
+            if changed is not None:
+                inactive = changed < day_start
+            else:
+                inactive = _zero_streak(history, account, advert_id, day)
+        (pruned if inactive else keep).append(advert_id)
+    return keep, pruned
+
+
+def spend_advert_ids(account, api_token, day):
+    """advertId кампаний со списаниями за день по /adv/v1/upd (один дешёвый запрос)."""
+    from advert_spend.utils_adv_spend import get_adv_spend
+
+    spend = get_adv_spend(account, day, day, {"Authorization": api_token})
+    if spend is None or not len(spend) or 'advertId' not in spend:
+        return set()
+    return set(spend.loc[spend['updTime'] == day, 'advertId'].astype(int))
+
+
+def record_activity(history, account, day, requested_ids, batches):
+    """
+    Запоминает кампании, по которым fullstats за день вернул нули или ничего.
+
+    batches — колоночные батчи parse_fullstats_batch за этот день.
+    """
+    active = set()
+    for batch in batches:
+        for advert_id, views, spend in zip(batch.get('advertId', ()), batch.get('views', ()), batch.get('sum', ())):
+            if views or spend:
+                active.add(advert_id)
+    cutoff = (date.fromisoformat(day) - timedelta(days=HISTORY_DAYS)).isoformat()
+    for advert_id in requested_ids:
+        key = _history_key(account, advert_id)
+        zero_dates = {d for d in history.get(key, ()) if d > cutoff}
+        if advert_id in active:
+            zero_dates.discard(day)
+        else:
+            zero_dates.add(day)
+        if zero_dates:
+            history[key] = sorted(zero_dates)
+        else:
+            history.pop(key, None)
+    return history
+
+
+def plan_requests(account, api_token, campaigns, checked_at, days, history=None):
+    """
+    ID кампаний к запросу по каждому дню: {день: [advertId]}.
+
+    Список /adv/v1/upd запрашивается только если есть кандидаты на отсев.
+    """
+    plan = {}
+    for day in days:
+        candidates = [advert_id for advert_id, info in campaigns.items() if info.get('status') == PAUSED_STATUS]
+        spend_ids = spend_advert_ids(account, api_token, day) if candidates else set()
+        keep, pruned = prune_campaigns(campaigns, account, day, checked_at, spend_ids, history)
+        if pruned:
+            logging.info(f"✂️ {account} {day}: отсеяно {len(pruned)} из {len(campaigns)} кампаний без активности, "
+                         f"батчей fullstats {-(-len(campaigns) // 100)} -> {-(-len(keep) // 100)}")
+        plan[day] = keep
+    return plan
@@ -1,5 +1,7 @@
 from utils_adv_spend import main_adv_spend
+from wb_core.logs import setup_logging
 
 if __name__== "__main__":
+    setup_logging()
     days_count = 1
     main_adv_spend(days_count)
\ No newline at end of file
@@ -0,0 +1,16 @@
+import os
+import asyncio
+import argparse
+from utils_daemon import DEFAULT_SCHEDULE, parse_schedule, run_daemon
+from wb_core.logs import setup_logging
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    # Например: advert=60,funnel=60,advert_spend=180,content=1440 (минуты)
+    parser.add_argument('--schedule', default=os.getenv('WB_DAEMON_SCHEDULE', DEFAULT_SCHEDULE))
+    parser.add_argument('--port', type=int, default=int(os.getenv('WB_DAEMON_PORT', 8765)))
+    # Сколько прошедших дней обновлять вместе с текущим
+    parser.add_argument('--days-back', type=int, default=1)
+    args = parser.parse_args()
+    setup_logging()
+    asyncio.run(run_daemon(parse_schedule(args.schedule), port=args.port, days_back=args.days_back))
@@ -0,0 +1,325 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import defaultdict
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor
+
+from advert import utils_advert
+from advert.utils_pruning import load_history, save_history, plan_requests, record_activity
+from advert_spend import utils_adv_spend
+from content import utils_content
+from funnel import utils_funnel
+from facts.utils_rolling import update_rolling_store
+from wb_core.config import SPREADSHEET_TITLE, load_api_tokens
+from wb_core.cassette import now
+from wb_core.http import close_sessions
+from wb_core.identity import remember
+from wb_core.profiling import profile_inline
+from wb_core.retention import HOT_DAYS, RETENTION_SHEETS, apply_retention
+from wb_core.sheets import safe_open_spreadsheet, refresh_df_in_google
+from wb_core.snapshots import take_snapshot
+from wb_core.utils import columns_to_frame
+
+# Интервалы запуска датасетов в минутах
+DEFAULT_SCHEDULE = "advert=60,funnel=60,advert_spend=180,content=1440"
+# Как долго считаем список кампаний кабинета актуальным
+CAMPAIGNS_TTL = 6 * 60 * 60
+
+
+def parse_schedule(value):
+    """Разбирает строку вида 'advert=60,funnel=60' в {датасет: интервал в секундах}."""
+    schedule = {}
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        name, minutes = item.split('=')
+        name = name.strip()
+        if name not in JOBS:
+            raise ValueError(f"Неизвестный датасет в расписании: {name}")
+        schedule[name] = int(minutes) * 60
+    return schedule
+
+
+class WarmState:
+    """
+    Всё, что переживает между запусками датасетов внутри демона:
+    токены, пул разбора ответов, таблица, кампании, история их активности и статусы.
+    HTTP-соединения живут в общем пуле wb_core.http и закрываются в close().
+    """
+
+    def __init__(self, days_back=1, days=None, parse_in_pool=True):
+        self.started_at = time.time()
+        self.days_back = days_back
+        # Фиксированные дни (ГГГГ-ММ-ДД) вместо скользящего окна — для воркера очереди
+        self.days = days
+        self.parse_in_pool = parse_in_pool
+        self.tokens = {}
+        self.parser_pool = None
+        self.spreadsheet = None
+        self.campaigns = {}
+        # Нулевые дни кампаний для отсева перед fullstats
+        self.activity = load_history()
+        self.status = {}
+        # Датасеты идут параллельными корутинами: rolling.json и identity.json
+        # пишутся по одному (загрузка-изменение-запись в потоке)
+        self.state_write_lock = asyncio.Lock()
+        # Обновление листа по номерам строк и удаление строк ретеншном на одном листе
+        # не должны пересекаться: после deleteDimension номера строк сдвигаются
+        self.sheet_locks = defaultdict(asyncio.Lock)
+        # fullstats выгружают job_advert и job_snapshot: по одному, чтобы не делить
+        # лимит токена и не трогать историю активности из двух мест сразу
+        self.advert_lock = asyncio.Lock()
+
+    async def write_state(self, func, *args):
+        """Выполняет запись файла состояния в потоке, не пересекаясь с другими датасетами."""
+        async with self.state_write_lock:
+            return await asyncio.to_thread(func, *args)
+
+    def reload_tokens_if_changed(self):
+        """Подхватывает изменения tokens.json: load_api_tokens перечитывает файл только при смене mtime."""
+        tokens = load_api_tokens()
+        if tokens is None or tokens == self.tokens:
+            return
+        for account in set(self.tokens) - set(tokens):
+            self.campaigns.pop(account, None)
+        self.tokens = tokens
+        logging.info(f"🔑 Загружены токены: {len(tokens)} кабинетов")
+
+    async def start(self):
+        self.reload_tokens_if_changed()
+        # При профилировании разбор идёт в процессе демона, иначе этапы разбора не попадут в отчёт
+        if self.parse_in_pool and not profile_inline():
+            self.parser_pool = ProcessPoolExecutor(max_workers=os.cpu_count())
+
+    async def close(self):
+        await close_sessions()
+        if self.parser_pool is not None:
+            self.parser_pool.shutdown()
+
+    async def worksheet(self, title):
+        if self.spreadsheet is None:
+            self.spreadsheet = await asyncio.to_thread(safe_open_spreadsheet, SPREADSHEET_TITLE, reopen=True)
+        return await asyncio.to_thread(self.spreadsheet.worksheet, title)
+
+    async def campaign_list(self, account, api_token):
+        """(время получения, {advertId: статус и время изменения}) с кэшем на CAMPAIGNS_TTL."""
+        loaded_at, campaigns = self.campaigns.get(account, (0, None))
+        if campaigns is None or time.time() - loaded_at > CAMPAIGNS_TTL:
+            campaigns = await asyncio.to_thread(utils_advert.get_campaigns, api_token, account)
+            loaded_at = time.time()
+            self.campaigns[account] = (loaded_at, campaigns)
+        return loaded_at, campaigns
+
+    def dates(self):
+        """Сегодня (внутридневные данные) и days_back прошедших дней."""
+        if self.days is not None:
+            return [datetime.strptime(day, "%Y-%m-%d") for day in self.days]
+        today = now()
+        return [today - timedelta(days=day) for day in range(0, self.days_back + 1)]
+
+
+async def fetch_advert(state, days, record=True):
+    """
+    Статистика fullstats всех кабинетов за дни days (datetime) в колонках листа.
+
+    record=False — нулевые дни кампаний не запоминаются: внутридневной снимок
+    видит неполный день, и его нули не доказывают неактивность за сутки.
+    """
+    planned = []
+    days = [day.strftime("%Y-%m-%d") for day in days]
+    for account, api_token in state.tokens.items():
+        loaded_at, campaigns = await state.campaign_list(account, api_token)
+        # Кампании без доказанной активности за день в fullstats не запрашиваем
+        plan = await asyncio.to_thread(plan_requests, account, api_token, campaigns, loaded_at, days, state.activity)
+        planned += [(account, api_token, date_from, plan[date_from]) for date_from in days]
+    stats = await asyncio.gather(*(
+        utils_advert.adv_stat_async(campaign_ids, date_from, date_from, api_token, account, parser_pool=state.parser_pool)
+        for account, api_token, date_from, campaign_ids in planned
+    ))
+    if record:
+        today = now().strftime("%Y-%m-%d")
+        for (account, _, date_from, campaign_ids), stat in zip(planned, stats):
+            # Сегодняшний день ещё не закончился: его нули в историю не идут
+            if date_from < today and len(stat) == -(-len(campaign_ids) // 100):
+                record_activity(state.activity, account, date_from, campaign_ids, stat)
+        await asyncio.to_thread(save_history, state.activity, accounts=state.tokens)
+    batches = [batch for stat in stats for batch in stat]
+    df = columns_to_frame(batches)
+    return utils_advert.prepare_adv_frame(df) if not df.empty else df
+
+
+async def job_advert(state):
+    async with state.advert_lock:
+        df_short = await fetch_advert(state, state.dates())
+    if df_short.empty:
+        return 0
+    async with state.sheet_locks["БД_Рекламная_статистика"]:
+        sheet = await state.worksheet("БД_Рекламная_статистика")
+        await asyncio.to_thread(refresh_df_in_google, df_short, sheet, ['date', 'account', 'advertId'])
+    await state.write_state(update_rolling_store, df_short)
+    await state.write_state(remember, None, df_short)
+    return len(df_short)
+
+
+async def fetch_funnel(state, days):
+    """Воронка всех кабинетов за дни days (datetime)."""
+    tasks = [
+        utils_funnel.get_funnel_v3(day, day, account, api_token, parser_pool=state.parser_pool)
+        for account, api_token in state.tokens.items()
+        for day in days
+    ]
+    batches = [batch for result in await asyncio.gather(*tasks) if result for batch in result]
+    return columns_to_frame(batches).drop_duplicates()
+
+
+async def job_funnel(state):
+    df = await fetch_funnel(state, state.dates())
+    if df.empty:
+        return 0
+    async with state.sheet_locks["БД_Воронка"]:
+        sheet = await state.worksheet("БД_Воронка")
+        await asyncio.to_thread(refresh_df_in_google, df, sheet, ['date', 'account', 'nm_id'])
+    await state.write_state(update_rolling_store, None, df)
+    await state.write_state(remember, df)
+    return len(df)
+
+
+async def job_snapshot(state):
+    """Внутридневной снимок сегодняшних рекламы и воронки: в хранилище пишутся только приращения."""
+    today = now()
+
+    async def fetch_advert_today():
+        async with state.advert_lock:
+            return await fetch_advert(state, [today], record=False)
+
+    advert_df, funnel_df = await asyncio.gather(fetch_advert_today(), fetch_funnel(state, [today]))
+    rows = 0
+    for dataset, df in (('advert', advert_df), ('funnel', funnel_df)):
+        if not df.empty:
+            rows += await asyncio.to_thread(take_snapshot, dataset, df, today.strftime("%Y-%m-%d"))
+    return rows
+
+
+async def job_advert_spend(state):
+    import pandas as pd
+
+    frames = []
+    for day in state.dates():
+        date_from = day.strftime("%Y-%m-%d")
+        for account, api_token in state.tokens.items():
+            headers = {"Authorization": api_token}
+            frames.append(await asyncio.to_thread(utils_adv_spend.get_adv_spend, account, date_from, date_from, headers))
+    frames = [frame for frame in frames if frame is not None and len(frame)]
+    if not frames:
+        return 0
+    df = utils_adv_spend.postprocess_adv_spend(pd.concat(frames, ignore_index=True), state.dates()[0].strftime("%Y-%m-%d"))
+    df['updTime'] = df['updTime'].astype(str)
+    sheet = await state.worksheet("БД_Рекламные_затраты")
+    await asyncio.to_thread(refresh_df_in_google, df, sheet, ['updTime', 'account', 'advertId', 'updNum'])
+    return len(df)
+
+
+async def job_content(state):
+    from gspread_dataframe import set_with_dataframe
+
+    df = await asyncio.to_thread(utils_content.collect_content, state.tokens)
+    sheet = await state.worksheet("БД_Фото")
+    if state.days is not None:
+        # Воркер очереди выгружает один кабинет: лист целиком перезаписывать нельзя
+        await asyncio.to_thread(refresh_df_in_google, df, sheet, ['account', 'nmID'])
+    else:
+        await asyncio.to_thread(set_with_dataframe, sheet, df)
+    return len(df)
+
+
+async def job_retention(state):
+    spreadsheet = await asyncio.to_thread(safe_open_spreadsheet, SPREADSHEET_TITLE)
+    hot_days, mode = int(os.getenv('WB_HOT_DAYS', HOT_DAYS)), os.getenv('WB_ARCHIVE_MODE', 'sheet')
+    moved = 0
+    for title, date_col in RETENTION_SHEETS.items():
+        # Пока job_advert/job_funnel обновляют лист, строки с него не удаляем
+        async with state.sheet_locks[title]:
+            moved += sum((await asyncio.to_thread(apply_retention, spreadsheet, hot_days, mode, sheets={title: date_col})).values())
+    return moved
+
+
+JOBS = {
+    'advert': job_advert,
+    'funnel': job_funnel,
+    'advert_spend': job_advert_spend,
+    'content': job_content,
+    # Не входят в расписание по умолчанию: включаются явно, например snapshot=60,retention=1440
+    'snapshot': job_snapshot,
+    'retention': job_retention,
+}
+
+
+async def run_job(state, name):
+    state.reload_tokens_if_changed()
+    status = state.status.setdefault(name, {'runs': 0, 'errors': 0})
+    started = time.time()
+    status['last_start'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    try:
+        status['rows'] = await JOBS[name](state)
+        status['last_ok'] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        status.pop('last_error', None)
+    except Exception as e:
+        logging.exception(f"💥 Ошибка датасета {name}")
+        status['errors'] += 1
+        status['last_error'] = str(e)
+        # Переоткроем таблицу на следующем запуске — вдруг протух доступ
+        state.spreadsheet = None
+    finally:
+        status['runs'] += 1
+        status['duration_sec'] = round(time.time() - started, 1)
+
+
+async def schedule_loop(state, name, interval):
+    while True:
+        started = time.time()
+        await run_job(state, name)
+        state.status[name]['next_run'] = datetime.fromtimestamp(started + interval).strftime("%Y-%m-%d %H:%M:%S")
+        await asyncio.sleep(max(0, interval - (time.time() - started)))
+
+
+async def handle_status(state, reader, writer):
+    """Минимальный HTTP: GET /health и GET /status."""
+    request_line = await reader.readline()
+    while (await reader.readline()).strip():
+        pass
+    parts = request_line.decode('latin-1').split()
+    path = parts[1] if len(parts) > 1 else '/'
+    if path == '/health':
+        code, body = 200, {'status': 'ok', 'uptime_sec': round(time.time() - state.started_at), 'accounts': len(state.tokens)}
+    elif path == '/status':
+        code, body = 200, state.status
+    else:
+        code, body = 404, {'error': 'not found'}
+    payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+    writer.write(
+        f"HTTP/1.1 {code} {'OK' if code == 200 else 'Not Found'}\r\n"
+        f"Content-Type: application/json; charset=utf-8\r\nContent-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode('latin-1')
+        + payload
+    )
+    await writer.drain()
+    writer.close()
+
+
+async def run_daemon(schedule, host='127.0.0.1', port=8765, days_back=1):
+    """
+    Запускает датасеты по расписанию в одном долгоживущем процессе.
+
+    schedule — {датасет: интервал в секундах}, см. parse_schedule.
+    """
+    state = WarmState(days_back=days_back)
+    await state.start()
+    server = await asyncio.start_server(lambda r, w: handle_status(state, r, w), host, port)
+    logging.info(f"🩺 Статус демона: http://{host}:{port}/status")
+    try:
+        async with server:
+            await asyncio.gather(*(schedule_loop(state, name, interval) for name, interval in schedule.items()))
+    finally:
+        await state.close()
@@ -0,0 +1,165 @@
+import time
+import asyncio
+import logging
+import multiprocessing
+from datetime import datetime, timedelta
+
+from advert.utils_pruning import load_history
+from daemon.utils_daemon import JOBS, WarmState
+from wb_core.config import load_api_tokens
+from wb_core.jobqueue import QUEUE_PATH, JobQueue, LeaseLost, worker_id
+from wb_core.logs import setup_logging, stop_logging
+from wb_core.sheets import write_limiter
+
+# Датасеты, которые можно раздать воркерам: единица — (кабинет, день)
+DATASETS = ('advert', 'funnel', 'advert_spend', 'content')
+# Пауза между опросами пустой очереди, секунд
+POLL_INTERVAL = 15
+
+
+def queue_days(days_count, include_today=False):
+    """Дни ГГГГ-ММ-ДД для постановки в очередь: вчера и ранее, от свежих к старым."""
+    start = 0 if include_today else 1
+    return [(datetime.now() - timedelta(days=day)).strftime("%Y-%m-%d") for day in range(start, days_count + 1)]
+
+
+def enqueue(datasets, days, accounts=None, force=False, path=QUEUE_PATH):
+    """
+    Ставит единицы (датасет, кабинет, день) в очередь.
+
+    content — снимок карточек на момент выгрузки, для него ставится только сегодняшний день.
+    """
+    tokens = load_api_tokens() or {}
+    accounts = [account for account in (accounts or tokens) if account in tokens]
+    queue = JobQueue(path)
+    try:
+        for dataset in datasets:
+            dataset_days = [datetime.now().strftime("%Y-%m-%d")] if dataset == 'content' else days
+            added = queue.enqueue(dataset, accounts, dataset_days, force=force)
+            logging.info(f"📥 {dataset}: в очередь поставлено {added} единиц ({len(accounts)} кабинетов × {len(dataset_days)} дней)")
+    finally:
+        queue.close()
+
+
+def print_queue(path=QUEUE_PATH):
+    queue = JobQueue(path)
+    try:
+        rows = queue.stats()
+    finally:
+        queue.close()
+    if not rows:
+        print("Очередь пуста")
+    for row in rows:
+        print(f"{row['dataset']:<14}{row['status']:<10}{row['count']:>8}")
+
+
+async def _keep_lease(queue, unit, job):
+    """Продлевает аренду, пока идёт выгрузка; если её забрал другой воркер — отменяет выгрузку."""
+    while True:
+        await asyncio.sleep(queue.lease_seconds / 3)
+        if not await asyncio.to_thread(queue.heartbeat, unit):
+            logging.info(f"⚠️ Аренда {unit['dataset']}/{unit['account']}/{unit['day']} потеряна, прерываем")
+            job.cancel()
+            return
+
+
+async def run_unit(state, queue, unit):
+    """Выгружает одну единицу тем же кодом, что и демон, на токене одного кабинета."""
+    tokens = load_api_tokens() or {}
+    if unit['account'] not in tokens:
+        raise KeyError(f"Нет токена кабинета {unit['account']}")
+    state.tokens = {unit['account']: tokens[unit['account']]}
+    state.days = [unit['day']]
+    if unit['dataset'] == 'advert':
+        # Историю пишут и другие воркеры: перечитываем перед выгрузкой,
+        # а save_history заменяет в файле только ключи этого кабинета
+        state.activity = load_history()
+    job = asyncio.ensure_future(JOBS[unit['dataset']](state))
+    keeper = asyncio.ensure_future(_keep_lease(queue, unit, job))
+    try:
+        return await job
+    except asyncio.CancelledError:
+        if keeper.done() and not keeper.cancelled():
+            raise LeaseLost(unit['id'])
+        raise
+    finally:
+        keeper.cancel()
+
+
+async def worker_loop(path=QUEUE_PATH, datasets=None, exit_when_empty=True):
+    """
+    Берёт единицы из очереди по одной, пока они есть.
+
+    Разбор ответов идёт в самом процессе воркера: параллельность дают
+    сами воркеры, общий пул процессов на каждом только отнимал бы ядра.
+    """
+    queue = JobQueue(path)
+    # Квота записи Sheets одна на всех воркеров: окно считается в файле очереди
+    write_limiter.share(path)
+    state = WarmState(days=[], parse_in_pool=False)
+    await state.start()
+    owner = worker_id()
+    done = 0
+    try:
+        while True:
+            unit = await asyncio.to_thread(queue.lease, owner, datasets)
+            if unit is None:
+                # Свободных нет, но единицы кабинета, занятого другим воркером, ещё могут освободиться
+                if exit_when_empty and not await asyncio.to_thread(queue.unfinished, datasets):
+                    break
+                await asyncio.sleep(POLL_INTERVAL)
+                continue
+            name = f"{unit['dataset']}/{unit['account']}/{unit['day']}"
+            started = time.time()
+            try:
+                rows = await run_unit(state, queue, unit)
+            except LeaseLost:
+                continue
+            except Exception as e:
+                logging.exception(f"💥 {owner}: ошибка {name}, попытка {unit['attempts']}")
+                await asyncio.to_thread(queue.fail, unit, e)
+                state.spreadsheet = None
+                continue
+            if await asyncio.to_thread(queue.complete, unit, rows):
+                done += 1
+                logging.info(f"✅ {owner}: {name} — {rows} строк за {time.time() - started:.0f} с")
+            else:
+                # Аренда истекла и единицу уже взял другой воркер: отметку оставляем ему.
+                # Листы обновляются по ключам, поэтому повторная запись данных безопасна
+                logging.info(f"⚠️ {owner}: {name} выгружена, но аренда уже не наша — отметку не ставим")
+    finally:
+        await state.close()
+        queue.close()
+    logging.info(f"🏁 {owner}: выполнено единиц: {done}")
+    return done
+
+
+def _worker_process(path, datasets, exit_when_empty):
+    # Своя очередь логов: пулы разбора этого воркера пишут в неё, а atexit
+    # в процессе multiprocessing не вызывается — дописываем её явно
+    setup_logging()
+    try:
+        asyncio.run(worker_loop(path, datasets, exit_when_empty))
+    finally:
+        stop_logging()
+
+
+def run_workers(processes=1, path=QUEUE_PATH, datasets=None, exit_when_empty=True):
+    """
+    Запускает processes воркеров на этой машине.
+
+    Воркеры на других машинах запускаются так же и видят ту же очередь
+    через общий том. Лимиты WB считаются на токен, поэтому пропускная
+    способность растёт с числом воркеров, пока кабинетов больше, чем воркеров.
+    """
+    if processes == 1:
+        asyncio.run(worker_loop(path, datasets, exit_when_empty))
+        return
+    workers = [
+        multiprocessing.Process(target=_worker_process, args=(path, datasets, exit_when_empty), name=f"wb-worker-{i}")
+        for i in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
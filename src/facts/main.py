@@ -0,0 +1,8 @@
+from utils_facts import main_facts
+from wb_core.logs import setup_logging
+
+if __name__ == "__main__":
+    setup_logging()
+    # Сколько последних дней выгружать в лист фактов (None — вся история)
+    days_count = 90
+    main_facts(days_count)
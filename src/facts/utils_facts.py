@@ -0,0 +1,169 @@
+import logging
+import numpy as np
+import pandas as pd
+from wb_core.config import SPREADSHEET_TITLE
+from wb_core.identity import remember
+from wb_core.profiling import stage
+from wb_core.sheets import safe_open_spreadsheet, read_sheet_df
+from wb_core.utils import parse_dates
+
+# Названия листов-источников в гугл-таблице
+ADV_STAT_SHEET = "БД_Рекламная_статистика"
+ADV_SPEND_SHEET = "БД_Рекламные_затраты"
+FUNNEL_SHEET = "БД_Воронка"
+CONTENT_SHEET = "БД_Фото"
+FACTS_SHEET = "БД_Факты"
+
+# Ключ факт-таблицы: один ряд на артикул в кабинете за день
+FACT_KEY = ["date", "account", "nm_id"]
+
+# Колонки, которые пишут в листы наши пайплайны (см. main.py в advert, advert_spend, funnel, content)
+ADV_STAT_COLS = ['date', 'avg_position', 'cr', 'atbs', 'article_id', 'advertId', 'views', 'clicks', 'sum', 'orders', 'sum_price', 'canceled', 'ctr', 'cpc', 'cpm', 'account']
+ADV_SPEND_COLS = ['updTime', 'campName', 'paymentType', 'updNum', 'updSum', 'advertId', 'advertType', 'advertStatus', 'sku', 'account']
+FUNNEL_COLS = ['account', 'nm_id', 'vendor_code', 'title', 'subject_name', 'open_count', 'cart_count', 'order_count', 'orders_sum', 'buyout_count', 'buyout_sum', 'cancel_count', 'cancel_sum', 'date']
+CONTENT_COLS = ['nmID', 'subjectName', 'vendorCode', 'photos', 'account']
+
+
+def _to_date(series):
+    return parse_dates(series).dt.strftime('%Y-%m-%d')
+
+
+def _to_num(df, cols):
+    for col in cols:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df
+
+
+def campaign_article_index(adv_stat_df):
+    """
+    Хэш-индекс advertId -> nm_id.
+
+    Берём последнюю известную привязку кампании к артикулу из рекламной статистики.
+    """
+    mapping = adv_stat_df.dropna(subset=['advertId', 'article_id'])
+    mapping = mapping.sort_values('date').drop_duplicates('advertId', keep='last')
+    return mapping.set_index('advertId')['article_id']
+
+
+def build_fact_table(adv_stat_df, adv_spend_df, funnel_df, content_df, identity=None):
+    """
+    Собирает ежедневную факт-таблицу (date, account, nm_id) из четырёх источников.
+
+    Все соединения выполняются через хэш-индексы pandas по ключам,
+    а производные метрики считаются векторно по всей таблице.
+    identity — IdentityIndex: артикулы кампаний, которых нет в рекламной
+    статистике за период, и артикулы продавца, которых нет в воронке и контенте.
+    """
+    adv = _to_num(adv_stat_df.copy(), ['advertId', 'article_id', 'views', 'clicks', 'atbs', 'orders', 'sum', 'sum_price'])
+    adv['date'] = _to_date(adv['date'])
+    spend = _to_num(adv_spend_df.copy(), ['advertId', 'updSum'])
+    spend['date'] = _to_date(spend['updTime'])
+    funnel = _to_num(funnel_df.copy(), ['nm_id', 'open_count', 'cart_count', 'order_count', 'orders_sum', 'buyout_count', 'buyout_sum', 'cancel_count', 'cancel_sum'])
+    funnel['date'] = _to_date(funnel['date'])
+    content = _to_num(content_df.copy(), ['nmID'])
+
+    # === 1. Рекламная статистика: кампании -> артикулы ===
+    adv = adv.rename(columns={'article_id': 'nm_id', 'sum': 'adv_sum', 'sum_price': 'adv_orders_sum', 'orders': 'adv_orders'})
+    adv_fact = (
+        adv.dropna(subset=['nm_id'])
+        .groupby(FACT_KEY, sort=False)[['views', 'clicks', 'atbs', 'adv_orders', 'adv_sum', 'adv_orders_sum']]
+        .sum()
+    )
+    adv_fact['campaigns_count'] = adv.dropna(subset=['nm_id']).groupby(FACT_KEY, sort=False)['advertId'].nunique()
+
+    # === 2. Рекламные затраты: через индекс advertId -> nm_id ===
+    camp_index = campaign_article_index(adv.rename(columns={'nm_id': 'article_id'}))
+    spend['nm_id'] = spend['advertId'].map(camp_index)
+    if identity is not None:
+        spend['nm_id'] = spend['nm_id'].fillna(identity.map(spend['advertId'], 'advert_id', 'nm_id').astype('float64'))
+    unmapped = spend['nm_id'].isna().sum()
+    if unmapped:
+        logging.info(f"⚠️ Для {unmapped} строк затрат не найден артикул кампании")
+    spend_fact = (
+        spend.dropna(subset=['nm_id'])
+        .groupby(FACT_KEY, sort=False)[['updSum']]
+        .sum()
+        .rename(columns={'updSum': 'upd_sum'})
+    )
+
+    # === 3. Воронка ===
+    funnel_fact = (
+        funnel.dropna(subset=['nm_id'])
+        .drop_duplicates(FACT_KEY, keep='last')
+        .set_index(FACT_KEY)[['vendor_code', 'title', 'subject_name', 'open_count', 'cart_count', 'order_count', 'orders_sum', 'buyout_count', 'buyout_sum', 'cancel_count', 'cancel_sum']]
+    )
+
+    # === 4. Соединяем по ключу (date, account, nm_id) ===
+    fact = funnel_fact.join(adv_fact, how='outer').join(spend_fact, how='outer').reset_index()
+
+    # === 5. Контент: индекс (account, nmID) ===
+    content_index = (
+        content.dropna(subset=['nmID'])
+        .drop_duplicates(['account', 'nmID'], keep='last')
+        .rename(columns={'nmID': 'nm_id', 'photos': 'photo'})
+        .set_index(['account', 'nm_id'])[['photo', 'subjectName', 'vendorCode']]
+    )
+    fact = fact.join(content_index, on=['account', 'nm_id'])
+    fact['vendor_code'] = fact['vendor_code'].fillna(fact.pop('vendorCode'))
+    fact['subject_name'] = fact['subject_name'].fillna(fact.pop('subjectName'))
+    if identity is not None:
+        fact['vendor_code'] = fact['vendor_code'].fillna(identity.map(fact['nm_id'], 'nm_id', 'vendor_code'))
+
+    # === 6. Производные метрики ===
+    metric_cols = ['views', 'clicks', 'atbs', 'adv_orders', 'adv_sum', 'adv_orders_sum', 'upd_sum', 'campaigns_count',
+                   'open_count', 'cart_count', 'order_count', 'orders_sum', 'buyout_count', 'buyout_sum', 'cancel_count', 'cancel_sum']
+    fact[metric_cols] = fact[metric_cols].fillna(0)
+    # Фактические списания берём из затрат, если их нет — из рекламной статистики
+    fact['ad_spend'] = fact['upd_sum'].where(fact['upd_sum'] > 0, fact['adv_sum'])
+
+    views = fact['views'].replace(0, np.nan)
+    clicks = fact['clicks'].replace(0, np.nan)
+    spend_nz = fact['ad_spend'].replace(0, np.nan)
+    fact['ctr'] = (fact['clicks'] / views * 100).round(2)
+    fact['cpc'] = (fact['ad_spend'] / clicks).round(2)
+    fact['cpm'] = (fact['ad_spend'] / views * 1000).round(2)
+    fact['adv_cr'] = (fact['adv_orders'] / clicks * 100).round(2)
+    # Доля рекламных расходов в выручке (ДРР) и ROMI
+    fact['drr'] = (fact['ad_spend'] / fact['orders_sum'].replace(0, np.nan) * 100).round(2)
+    fact['romi'] = ((fact['adv_orders_sum'] - fact['ad_spend']) / spend_nz * 100).round(2)
+    # Конверсии воронки
+    fact['cart_conversion'] = (fact['cart_count'] / fact['open_count'].replace(0, np.nan) * 100).round(2)
+    fact['order_conversion'] = (fact['order_count'] / fact['cart_count'].replace(0, np.nan) * 100).round(2)
+
+    fact['nm_id'] = fact['nm_id'].astype('int64')
+    return fact.sort_values(FACT_KEY, ignore_index=True)
+
+
+def load_fact_sources(table):
+    """Читает все листы-источники, по одному запросу на лист."""
+    return (
+        read_sheet_df(table.worksheet(ADV_STAT_SHEET), ADV_STAT_COLS),
+        read_sheet_df(table.worksheet(ADV_SPEND_SHEET), ADV_SPEND_COLS),
+        read_sheet_df(table.worksheet(FUNNEL_SHEET), FUNNEL_COLS),
+        read_sheet_df(table.worksheet(CONTENT_SHEET), CONTENT_COLS),
+    )
+
+
+def main_facts(days_count=None):
+    from gspread_dataframe import set_with_dataframe
+
+    table = safe_open_spreadsheet(SPREADSHEET_TITLE)
+    with stage('facts.read'):
+        sources = load_fact_sources(table)
+    with stage('facts.identity'):
+        # Индекс пополняется и из листов: в них есть история, которой нет в текущих выгрузках
+        adv_stat_df, _, _, content_df = sources
+        identity = remember(articles=content_df, campaigns=adv_stat_df, nm_col='nmID', vendor_col='vendorCode')
+    with stage('facts.join'):
+        fact = build_fact_table(*sources, identity=identity)
+    if days_count:
+        last_date = fact['date'].max() if not fact.empty else None
+        if last_date:
+            since = (pd.to_datetime(last_date) - pd.Timedelta(days=days_count - 1)).strftime('%Y-%m-%d')
+            fact = fact[fact['date'] >= since]
+    print(f"⚡ Факт-таблица: {len(fact)} строк")
+    with stage('facts.upload'):
+        sheet = table.worksheet(FACTS_SHEET)
+        sheet.clear()
+        set_with_dataframe(sheet, fact.fillna(''))
@@ -0,0 +1,223 @@
+import os
+import json
+import heapq
+import logging
+import threading
+from datetime import date, datetime
+
+from wb_core.utils import state_lock
+
+# Суммируемые метрики, из которых считаются все производные показатели
+METRICS = ('views', 'clicks', 'spend', 'adv_orders', 'open_count', 'cart_count', 'order_count', 'orders_sum')
+METRIC_INDEX = {name: i for i, name in enumerate(METRICS)}
+WINDOWS = (7, 14, 30)
+
+# Уровни агрегации: артикул и рекламная кампания
+LEVEL_NM = 'nm'
+LEVEL_ADVERT = 'advert'
+
+# Какие метрики приносит каждый источник: при повторной загрузке дня
+# источник перезаписывает только свои поля, не трогая чужие
+ADVERT_FIELDS = {'views': 'views', 'clicks': 'clicks', 'spend': 'sum', 'adv_orders': 'orders'}
+FUNNEL_FIELDS = {'open_count': 'open_count', 'cart_count': 'cart_count', 'order_count': 'order_count', 'orders_sum': 'orders_sum'}
+
+STATE_PATH = os.path.join(os.getenv('WB_STATE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'state')), 'rolling.json')
+
+
+def _ratio(num, den, scale=1):
+    return round(num / den * scale, 2) if den else None
+
+
+# Производные метрики считаются из сумм окна, а не усредняются по дням
+DERIVED = {
+    'ctr': lambda v: _ratio(v[1], v[0], 100),
+    'cpc': lambda v: _ratio(v[2], v[1]),
+    'cpm': lambda v: _ratio(v[2], v[0], 1000),
+    'conversion': lambda v: _ratio(v[3], v[1], 100),
+    'funnel_conversion': lambda v: _ratio(v[6], v[4], 100),
+    'spend': lambda v: round(v[2], 2),
+}
+
+
+def _ordinal(day):
+    if isinstance(day, str):
+        day = datetime.strptime(day[:10], "%Y-%m-%d").date()
+    elif isinstance(day, datetime):
+        day = day.date()
+    return day.toordinal()
+
+
+class RollingAggregates:
+    """
+    Скользящие суммы за 7/14/30 дней по артикулам и кампаниям.
+
+    Хранит подневные значения только за последние max(WINDOWS) дней и
+    текущие суммы по каждому окну. Новый день прибавляется к суммам,
+    а выпавший из окна вычитается — история целиком не пересчитывается.
+    """
+
+    def __init__(self, windows=WINDOWS):
+        self.windows = tuple(sorted(windows))
+        self.current = None
+        self.days = {LEVEL_NM: {}, LEVEL_ADVERT: {}}
+        self.totals = {LEVEL_NM: {}, LEVEL_ADVERT: {}}
+        # Индекс день -> ключи, у которых есть данные за этот день,
+        # чтобы при сдвиге окна трогать только выпадающие ключи
+        self.keys_by_day = {}
+
+    @property
+    def horizon(self):
+        return self.windows[-1]
+
+    def _advance(self, day):
+        previous, self.current = self.current, day
+        if previous is None:
+            return
+        for window in self.windows:
+            expired = [d for d in self.keys_by_day if previous - window < d <= day - window]
+            for d in expired:
+                for level, key in self.keys_by_day[d]:
+                    values = self.days[level][key][d]
+                    total = self.totals[level][key][window]
+                    for i, value in enumerate(values):
+                        total[i] -= value
+
+        # Удаляем дни, которые вышли из самого длинного окна
+        for d in [d for d in self.keys_by_day if d <= day - self.horizon]:
+            for level, key in self.keys_by_day.pop(d):
+                key_days = self.days[level][key]
+                key_days.pop(d, None)
+                if not key_days:
+                    del self.days[level][key]
+                    del self.totals[level][key]
+
+    def update(self, day, level, rows):
+        """
+        Добавляет (или перезаписывает) данные за день.
+
+        rows — итерируемое из пар (key, {metric: value}); перезаписываются
+        только переданные метрики, остальные поля дня сохраняются.
+        """
+        day = _ordinal(day)
+        if self.current is None or day > self.current:
+            self._advance(day)
+        if day <= self.current - self.horizon:
+            logging.info(f"⚠️ День {date.fromordinal(day)} старше самого длинного окна, пропускаем")
+            return
+
+        day_keys = self.keys_by_day.setdefault(day, set())
+        for key, values in rows:
+            key_days = self.days[level].setdefault(key, {})
+            old = key_days.get(day) or [0.0] * len(METRICS)
+            new = list(old)
+            for name, value in values.items():
+                new[METRIC_INDEX[name]] = float(value or 0)
+            key_days[day] = new
+            day_keys.add((level, key))
+
+            totals = self.totals[level].setdefault(key, {w: [0.0] * len(METRICS) for w in self.windows})
+            for window in self.windows:
+                if day > self.current - window:
+                    total = totals[window]
+                    for i in range(len(METRICS)):
+                        total[i] += new[i] - old[i]
+
+    def get(self, level, key, window):
+        """Суммы и производные метрики ключа за окно."""
+        totals = self.totals[level].get(key)
+        if totals is None:
+            return None
+        values = totals[window]
+        result = dict(zip(METRICS, values))
+        result.update({name: func(values) for name, func in DERIVED.items()})
+        return result
+
+    def top_n(self, level, metric, window=7, n=10, largest=True):
+        """
+        Рейтинг ключей по метрике окна, например худший CPM или лучшая конверсия.
+
+        Читается прямо из текущих сумм, без обращения к подневной истории.
+        """
+        func = DERIVED.get(metric)
+        if func is None:
+            index = METRIC_INDEX[metric]
+            func = lambda v: v[index]
+        scored = ((func(totals[window]), key) for key, totals in self.totals[level].items())
+        scored = (item for item in scored if item[0] is not None)
+        pick = heapq.nlargest if largest else heapq.nsmallest
+        return pick(n, scored)
+
+    def to_dict(self):
+        return {
+            'windows': list(self.windows),
+            'current': self.current,
+            'days': {level: {key: {str(d): v for d, v in key_days.items()} for key, key_days in keys.items()} for level, keys in self.days.items()},
+            'totals': {level: {key: {str(w): v for w, v in totals.items()} for key, totals in keys.items()} for level, keys in self.totals.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        store = cls(data['windows'])
+        store.current = data['current']
+        for level, keys in data['days'].items():
+            for key, key_days in keys.items():
+                store.days[level][key] = {int(d): v for d, v in key_days.items()}
+                for d in store.days[level][key]:
+                    store.keys_by_day.setdefault(d, set()).add((level, key))
+        for level, keys in data['totals'].items():
+            for key, totals in keys.items():
+                store.totals[level][key] = {int(w): v for w, v in totals.items()}
+        return store
+
+
+def load_rolling_store(path=STATE_PATH):
+    if not os.path.isfile(path):
+        return RollingAggregates()
+    with open(path, 'r', encoding='utf-8') as f:
+        return RollingAggregates.from_dict(json.load(f))
+
+
+def save_rolling_store(store, path=STATE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(store.to_dict(), f)
+    os.replace(tmp_path, path)
+
+
+def _frame_rows(df, key_cols, fields):
+    """Превращает DataFrame в пары (key, {metric: value}) для RollingAggregates.update."""
+    import pandas as pd
+
+    # ID в рекламе после fillna(0) — float ("123.0"), в воронке — int ("123"):
+    # без приведения строки одного артикула из двух источников не сходятся
+    df = df.assign(**{col: pd.to_numeric(df[col], errors='coerce').astype('Int64') for col in key_cols if col != 'account'})
+    grouped = df.groupby(key_cols)[list(fields.values())].sum()
+    for key, values in zip(grouped.index, grouped.itertuples(index=False)):
+        yield '|'.join(str(k) for k in key), dict(zip(fields, values))
+
+
+def update_rolling_store(adv_df=None, funnel_df=None, path=STATE_PATH):
+    """
+    Доливает в хранилище свежие строки рекламной статистики и/или воронки.
+
+    adv_df — строки вида листа БД_Рекламная_статистика (date, account, advertId, article_id, ...),
+    funnel_df — строки вида листа БД_Воронка (date, account, nm_id, ...).
+    Дни применяются по возрастанию даты.
+    """
+    batches = []
+    if adv_df is not None and not adv_df.empty:
+        for day, day_df in adv_df.groupby('date'):
+            batches.append((str(day), LEVEL_ADVERT, _frame_rows(day_df, ['account', 'advertId'], ADVERT_FIELDS)))
+            batches.append((str(day), LEVEL_NM, _frame_rows(day_df, ['account', 'article_id'], ADVERT_FIELDS)))
+    if funnel_df is not None and not funnel_df.empty:
+        for day, day_df in funnel_df.groupby('date'):
+            batches.append((str(day), LEVEL_NM, _frame_rows(day_df, ['account', 'nm_id'], FUNNEL_FIELDS)))
+
+    # Хранилище обновляют и демон, и воркеры очереди: загрузка и запись — под одной блокировкой
+    with state_lock(path):
+        store = load_rolling_store(path)
+        for day, level, rows in sorted(batches, key=lambda b: b[0]):
+            store.update(day, level, rows)
+        save_rolling_store(store, path)
+    return store
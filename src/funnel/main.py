@@ -1,8 +1,15 @@
 from utils_funnel import main_funnel_daily
+from wb_core.logs import setup_logging
 import asyncio
+import argparse
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    # Режим обновления: перезапрашиваем последние N дней и пишем только изменившиеся ячейки
+    parser.add_argument('--refresh-days', type=int, default=0)
+    args = parser.parse_args()
+    setup_logging()
     # Выбираем нужное количество дней
-    days_count = 1
+    days_count = args.refresh_days or 1
     # Получаем данные
-    asyncio.run(main_funnel_daily(days_count))
\ No newline at end of file
+    asyncio.run(main_funnel_daily(days_count, refresh=bool(args.refresh_days)))
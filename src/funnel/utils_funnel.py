@@ -1,89 +1,45 @@
 import os
-import aiohttp
 import asyncio
-from datetime import datetime, timedelta
-import gspread
-from time import time
-from calendar import monthrange
+from datetime import timedelta
 import logging
-from dotenv import load_dotenv
 import json
-import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from facts.utils_rolling import update_rolling_store
+from wb_core.config import load_api_tokens, SPREADSHEET_TITLE
+from wb_core.sheets import safe_open_spreadsheet, send_df_to_google, refresh_df_in_google
+from wb_core.planner import funnel_unit, funnel_pages_hint, estimate, fit_deadline, format_duration
+from wb_core.profiling import stage, profile_inline
+from wb_core.http import get_session, close_sessions, pause
+from wb_core.cassette import now
+from wb_core.identity import remember
+from wb_core.logs import count, flush_counters, in_worker, merge_counters, sample
+from wb_core.raw_store import ResponseRecorder, new_fetch_id, save_response
+from wb_core.jsonstream import STREAM_ENABLED, iter_array
+from wb_core.utils import batchify, columns_to_frame, records_to_columns
 
-# Импортируем переменные окружения
-load_dotenv()
+# Суммы воронки за календарные недели и месяцы (режим периодов) — отдельный лист:
+# с дневными строками БД_Воронка они не смешиваются
+FUNNEL_PERIOD_SHEET = "БД_Воронка_Периоды"
+FUNNEL_PERIOD_KEY = ['period', 'period_start', 'account', 'nm_id']
 
-def load_api_tokens():
-    # Проверяем наличие файла tokens.json во всех директориях проекта
-    current_dir = os.path.dirname(os.path.abspath(__file__))
+log = logging.getLogger('wb.funnel')
 
-    while True:
-        tokens_path = os.path.join(current_dir, 'tokens.json')
-        if os.path.isfile(tokens_path):
-            try:
-                with open(tokens_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
-            except json.JSONDecodeError:
-                print(f"Ошибка декодирования JSON в файле: {tokens_path}")
-                return None
-
-        # Поднимаемся на уровень выше
-        parent_dir = os.path.dirname(current_dir)
-        if parent_dir == current_dir:
-            # Достигли корня диска
-            break
-        current_dir = parent_dir
-
-    print("Файл tokens.json не найден ни в одной из директорий")
-    return None
-
-def safe_open_spreadsheet(title, retries=5, delay=5):
+
+async def get_funnel_v3(date_start: None, date_end: None, account: str, api_token: str, parser_pool=None, session=None, stream=None, raw_dataset='funnel'):
     """
-    Пытается открыть таблицу с повторными попытками при APIError 503.
+    Получение статистики по воронке продаж Wildberries.
+
+    Ответ каждой страницы разбирается в пуле процессов parser_pool
+    (None — в текущем процессе), а при stream=True — потоково по мере
+    чтения (None — по WB_STREAM_JSON). Без явной session запросы идут через
+    общий пул соединений к хосту. Возвращает список колоночных батчей.
+    raw_dataset — под каким датасетом сырые ответы попадут в wb_core.raw_store.
     """
-    gc = gspread.service_account(filename=os.path.join(os.path.dirname(__file__), 'creds.json'))
-    
-    for attempt in range(1, retries + 1):
-        logging.info(f"[Попытка {attempt}] открыть доступ к таблице '{title}'")
-        
-        try:
-            spreadsheet = gc.open(title)
-            logging.info(f"✅ Таблица '{title}' успешно открыта")
-            return spreadsheet
-            
-        except gspread.APIError as e:
-            error_code = e.response.status_code if hasattr(e, 'response') else None
-            logging.info(f"⚠️ [Попытка {attempt}/{retries}] APIError {error_code}: {e}")
-            
-            if error_code == 503:
-                if attempt < retries:
-                    logging.info(f"⏳ Ожидание {delay} секунд перед повторной попыткой...")
-                    time.sleep(delay)
-                    # Увеличиваем задержку для следующей попытки (exponential backoff)
-                    delay *= 2
-                else:
-                    logging.error("❌ Все попытки исчерпаны")
-                    raise
-            else:
-                # Другие ошибки API (403, 404 и т.д.) - не повторяем
-                raise
-                
-        except gspread.SpreadsheetNotFound:
-            logging.info(f"❌ Таблица '{title}' не найдена")
-            raise
-            
-        except Exception as e:
-            logging.error(f"⚠️ [Попытка {attempt}/{retries}] Неожиданная ошибка: {e}")
-            if attempt < retries:
-                logging.error(f"⏳ Ожидание {delay} секунд...")
-                time.sleep(delay)
-                delay *= 2
-            else:
-                raise RuntimeError(f"Не удалось открыть таблицу '{title}' после {retries} попыток.")
-
-async def get_funnel_v3(date_start: None, date_end: None, account: str, api_token: str):
-    """Получение статистики по воронке продаж Wildberries"""
+    import aiohttp
+
     products_list = []
+    products_total = 0
     headers = {"Authorization": api_token}
     normal_delay = 2
     retry_delay = 20
@@ -95,110 +51,196 @@ async def get_funnel_v3(date_start: None, date_end: None, account: str, api_toke
     max_attempts = 30
     attempt = 0
     semaphore = asyncio.Semaphore(10)
+    fetch_id = new_fetch_id()
+    if stream is None:
+        stream = STREAM_ENABLED
     
     async with semaphore:
-        async with aiohttp.ClientSession(headers=headers) as session:
-            while True:
-                payload = {
-                    "selectedPeriod": {
-                        "start": start.strftime("%Y-%m-%d"),
-                        "end": end.strftime("%Y-%m-%d")
-                    },
-                    "limit": limit,
-                    "offset": offset
-                }
-
-                try:
-                    async with session.post(url, json=payload) as res:
-                        if res.status == 200:
-                            data = await res.json()
-                            products = data.get("data", {}).get("products", [])
-
-                            if not products:
-                                logging.info(f"📭 Нет данных для {account}")
-                                break
-
-                            for p in products:
-                                p["account"] = account
-                            products_list.extend(products)
-
-                            logging.info(f"✅ Получено {len(products_list)} товаров ({len(products)} новых) для {account} за период {payload['selectedPeriod']}")
-
-                            if len(products) < limit:
-                                break
-
-                            offset += len(products)
-                            attempt = 0
-                            await asyncio.sleep(normal_delay)
-
-                        elif res.status == 429:
-                            logging.info(f"⚠️ Ошибка 429 для {account}: слишком много запросов, ждем {retry_delay} сек.")
-                            await asyncio.sleep(retry_delay)
-                            retry_delay += 0.1
-                            attempt += 1
-                            if attempt >= max_attempts:
-                                logging.info(f"🚫 Превышено число попыток ({max_attempts}) для {account}")
-                                break
-                            continue
-
-                        elif res.status in (400, 401, 403):
-                            err = await res.json()
-                            logging.info(f"⚠️ Ошибка {res.status} для {account}: {err.get('detail', 'Ошибка доступа')}")
-                            return None
+        if session is None:
+            session = get_session(url)
+        while True:
+            payload = {
+                "selectedPeriod": {
+                    "start": start.strftime("%Y-%m-%d"),
+                    "end": end.strftime("%Y-%m-%d")
+                },
+                "limit": limit,
+                "offset": offset
+            }
 
+            try:
+                async with session.post(url, json=payload, headers=headers) as res:
+                    if res.status == 200:
+                        if stream:
+                            recorder = ResponseRecorder(raw_dataset, payload['selectedPeriod']['start'], account, fetch_id, offset=offset, date_to=payload['selectedPeriod']['end'])
+                            products_count, columns = await read_funnel_stream(res, account, recorder)
+                            # Сырой ответ пишем только дочитанным: оборванный уйдёт на повтор
+                            recorder.close()
                         else:
-                            logging.info(f"⚠️ Неожиданный статус {res.status} для {account}")
-                            attempt += 1
-                            if attempt >= max_attempts:
-                                break
-
-                except aiohttp.ClientError as err:
-                    logging.info(f"🌐 Сетевая ошибка: {err}")
-                    attempt += 1
-                    if attempt >= max_attempts:
-                        break
-
-                except Exception as e:
-                    logging.info(f"💥 Неожиданная ошибка: {e}")
+                            raw = await res.read()
+                            # Сырой ответ — в локальное хранилище для офлайн-пересборки (wb reprocess)
+                            await asyncio.to_thread(save_response, raw_dataset, payload['selectedPeriod']['start'], account, fetch_id, raw, offset=offset, date_to=payload['selectedPeriod']['end'])
+                            if parser_pool is not None:
+                                loop = asyncio.get_running_loop()
+                                products_count, columns = merge_counters(await loop.run_in_executor(parser_pool, in_worker, parse_funnel_page, raw, account))
+                            else:
+                                products_count, columns = parse_funnel_page(raw, account)
+
+                        if not products_count:
+                            log.info(f"📭 Нет данных для {account}")
+                            break
+
+                        products_list.append(columns)
+                        products_total += products_count
+
+                        count('страниц воронки')
+                        # Строка на страницу — только выборочно, итог по кабинету пишется ниже
+                        if sample('funnel page'):
+                            log.debug(f"✅ Получено {products_total} товаров ({products_count} новых) для {account} за период {payload['selectedPeriod']}")
+
+                        if products_count < limit:
+                            break
+
+                        offset += products_count
+                        attempt = 0
+                        await pause(normal_delay)
+
+                    elif res.status == 429:
+                        count('воронка HTTP 429')
+                        if sample('funnel 429'):
+                            log.warning(f"⚠️ Ошибка 429 для {account}: слишком много запросов, ждем {retry_delay} сек.")
+                        await pause(retry_delay)
+                        retry_delay += 0.1
+                        attempt += 1
+                        if attempt >= max_attempts:
+                            log.warning(f"🚫 Превышено число попыток ({max_attempts}) для {account}")
+                            break
+                        continue
+
+                    elif res.status in (400, 401, 403):
+                        err = await res.json()
+                        log.warning(f"⚠️ Ошибка {res.status} для {account}: {err.get('detail', 'Ошибка доступа')}")
+                        return None
+
+                    else:
+                        log.warning(f"⚠️ Неожиданный статус {res.status} для {account}")
+                        attempt += 1
+                        if attempt >= max_attempts:
+                            break
+
+            except aiohttp.ClientError as err:
+                log.warning(f"🌐 Сетевая ошибка для {account}: {err}")
+                attempt += 1
+                if attempt >= max_attempts:
                     break
 
+            except Exception as e:
+                log.exception(f"💥 Неожиданная ошибка для {account}: {e}")
+                break
+
         if products_list:
-            logging.info(f"🟢 Завершено получение данных по {account}. Всего товаров: {len(products_list)}")
+            log.info(f"🟢 Завершено получение данных по {account}. Всего товаров: {products_total}")
             return products_list
         else:
-            logging.info(f"❌ Не удалось получить данные по воронке продаж для {account}")
+            log.warning(f"❌ Не удалось получить данные по воронке продаж для {account}")
             return None
 
-async def fetch_all(date_start: int, date_end: None):
+async def fetch_all(date_start: int, date_end: None, parser_pool=None, raw_dataset='funnel'):
     # Создаем задачник для получения данных о поставках по всем аккаунтам асинхронно
-    tasks = [get_funnel_v3(date_start, date_end, account, api_token) for account, api_token in load_api_tokens().items()]
+    tasks = [get_funnel_v3(date_start, date_end, account, api_token, parser_pool, raw_dataset=raw_dataset) for account, api_token in load_api_tokens().items()]
     res = await asyncio.gather(*tasks)
     return res
 
-# === Для ежедневной воронки
-def batchify(data, batch_size):
+def funnel_product_row(product):
+    """Разворачивает товар из ответа sales-funnel v3 в плоскую строку."""
+    # Извлекаем данные 
+    prod_info = product.get("product", {})
+    stat = product.get("statistic", {})
+    selected = stat.get("selected", {})
+    time_to_ready = selected.get("timeToReady", {})
+    stocks = prod_info.get("stocks", {})
+
+    # Базовая информация
+    return {
+        "account": product.get("account"),
+        "nm_id": prod_info.get("nmId"),
+        "vendor_code": prod_info.get("vendorCode"),  
+        "title": prod_info.get("title"),
+        "subject_id": prod_info.get("subjectId"),
+        "subject_name": prod_info.get("subjectName"),
+        "brand_name": prod_info.get("brandName"),
+        "product_rating": prod_info.get("productRating"),
+        "feedback_rating": prod_info.get("feedbackRating"),
+        "stocks_wb": stocks.get("wb"),
+        "stocks_mp": stocks.get("mp"),
+        "balance_sum": stocks.get("balanceSum"),
+        # Метрики selected
+        "open_count": selected.get("openCount"),
+        "cart_count": selected.get("cartCount"),
+        "order_count": selected.get("orderCount"),
+        "orders_sum": selected.get("orderSum"),
+        "buyout_count": selected.get("buyoutCount"),
+        "buyout_sum": selected.get("buyoutSum"),
+        "cancel_count": selected.get("cancelCount"),
+        "cancel_sum": selected.get("cancelSum"),
+        "avg_price": selected.get("avgPrice"),
+        "avg_orders_count_per_day": selected.get("avgOrdersCountPerDay"),
+        "share_order_percent": selected.get("shareOrderPercent"),
+        "add_to_wish_list": selected.get("addToWishlist"),
+        "time_to_ready": (
+            time_to_ready.get("days", 0) * 24 * 60 +
+            time_to_ready.get("hours", 0) * 60 +
+            time_to_ready.get("mins", 0)
+        ),
+        "localization_percent": selected.get("localizationPercent"),
+        "date": selected.get("period", {}).get("end"),
+    }
+
+def flatten_funnel_products(products):
+    """Разворачивает товары воронки сразу в колонки {колонка: [значения]}."""
+    rows = [funnel_product_row(product) for product in products]
+    if not rows:
+        return {}
+    return {key: [row[key] for row in rows] for key in rows[0]}
+
+def parse_funnel_page(raw: bytes, account: str):
     """
-    Splits data into batches of a specified size.
+    Декодирует страницу sales-funnel v3 и разворачивает её в колоночный батч.
 
-    Parameters:
-    - data: The list of items to be batched.
-    - batch_size: The size of each batch.
+    Выполняется в процессе пула. Возвращает (число товаров на странице, колонки).
+    """
+    with stage('funnel.decode'):
+        data = json.loads(raw)
+    with stage('funnel.flatten'):
+        products = data.get("data", {}).get("products", []) or []
+        for p in products:
+            p["account"] = account
+        columns = flatten_funnel_products(products)
+    return len(products), columns
 
-    Returns:
-    - A generator yielding batches of data.
+async def read_funnel_stream(response, account: str, recorder=None):
+    """
+    Потоковый разбор страницы воронки: товары разворачиваются в строки по мере
+    прихода байтов. Возвращает (число товаров на странице, колонки).
     """
-    for i in range(0, len(data), batch_size):
-        yield data[i:i + batch_size]
+    rows = []
+    async for products in iter_array(response, key='products', recorder=recorder):
+        for p in products:
+            p["account"] = account
+        rows.extend(funnel_product_row(p) for p in products)
+    return len(rows), records_to_columns(rows)
 
 async def process_funnel_daily(days_count=1):
     """
     Оптимизированная версия: собираем ВСЕ данные в один DataFrame за 3 месяца
     """
+    import pandas as pd
+
     # === 1. УКАЗЫВАЕМ НУЖНЫЙ ПЕРИОД В  ===
     bath_size = 28
     date_ranges = []
     for day_num in range(1, days_count + 1):
-        found_day = datetime.now()-timedelta(days=day_num)
+        found_day = now()-timedelta(days=day_num)
         first_date, last_date = found_day, found_day
         date_ranges.append((first_date, last_date))
     
@@ -207,133 +249,153 @@ async def process_funnel_daily(days_count=1):
     batches = batchify(date_ranges, bath_size)
 
     # === 2. ПАРАЛЛЕЛЬНЫЙ ЗАПРОС ВСЕХ МЕСЯЦЕВ ===
+    # Страницы воронки разбираются в пуле процессов, event loop только ждёт сеть
+    # (при профилировании — в текущем процессе, чтобы этапы разбора попали в отчёт)
     list_dfs = []
-    for batch in batches:
-        tasks = [fetch_all(first, last) for first, last in batch]
-        results = await asyncio.gather(*tasks)
-        
-        print(f"✅ Получено {sum(len(r) for r in results)} записей")
-        
-        # === 3. ОБЪЕДИНЯЕМ ВСЕ ДАННЫЕ В ОДИН СПИСОК ===
-        all_products = []
-        for result in results:
-            for acc_data in result:
-                if acc_data:
-                    all_products.extend(acc_data)
-        
-        print(f"📦 Обработано {len(all_products)} товаров")
-        
-        # === 4. ОБРАБОТКА ВСЕХ ДАННЫХ ===
-        rows = []
-        for product in all_products:
-            # Извлекаем данные 
-            prod_info = product.get("product", {})
-            stat = product.get("statistic", {})
-            selected = stat.get("selected", {})
-            time_to_ready = selected.get("timeToReady", {})
-            
-            # Базовая информация
-            row = {
-                "account": product.get("account"),
-                "nm_id": prod_info.get("nmId"),
-                "vendor_code": prod_info.get("vendorCode"),  
-                "title": prod_info.get("title"),
-                "subject_id": prod_info.get("subjectId"),
-                "subject_name": prod_info.get("subjectName"),
-                "brand_name": prod_info.get("brandName"),
-                "product_rating": prod_info.get("productRating"),
-                "feedback_rating": prod_info.get("feedbackRating"),
-                "stocks_wb": prod_info.get("stocks", {}).get("wb"),
-                "stocks_mp": prod_info.get("stocks", {}).get("mp"),
-                "balance_sum": prod_info.get("stocks", {}).get("balanceSum"),
-            }
-            
-            # Метрики selected
-            row.update({
-                "open_count": selected.get("openCount"),
-                "cart_count": selected.get("cartCount"),
-                "order_count": selected.get("orderCount"),
-                "orders_sum": selected.get("orderSum"),
-                "buyout_count": selected.get("buyoutCount"),
-                "buyout_sum": selected.get("buyoutSum"),
-                "cancel_count": selected.get("cancelCount"),
-                "cancel_sum": selected.get("cancelSum"),
-                "avg_price": selected.get("avgPrice"),
-                "avg_orders_count_per_day": selected.get("avgOrdersCountPerDay"),
-                "share_order_percent": selected.get("shareOrderPercent"),
-                "add_to_wish_list": selected.get("addToWishlist"),
-                "time_to_ready": (
-                    time_to_ready.get("days", 0) * 24 * 60 +
-                    time_to_ready.get("hours", 0) * 60 +
-                    time_to_ready.get("mins", 0)
-                ),
-                "localization_percent": selected.get("localizationPercent"),
-                "date": selected.get("period", {}).get("end"),
-            })
-            
-            rows.append(row)
-                
-        # === 5. ОДИН DataFrame ===
-        df_full = pd.DataFrame(rows)
-        list_dfs.append(df_full)
+    with nullcontext() if profile_inline() else ProcessPoolExecutor(max_workers=os.cpu_count()) as parser_pool:
+        for batch in batches:
+            tasks = [fetch_all(first, last, parser_pool) for first, last in batch]
+            with stage('funnel.fetch'):
+                results = await asyncio.gather(*tasks)
+
+            # === 3. ОБЪЕДИНЯЕМ ВСЕ КОЛОНОЧНЫЕ БАТЧИ ===
+            column_batches = []
+            for result in results:
+                for acc_data in result:
+                    if acc_data:
+                        column_batches.extend(acc_data)
+
+            # === 4. ОДИН DataFrame ===
+            with stage('funnel.frame'):
+                df_full = columns_to_frame(column_batches)
+            print(f"📦 Обработано {len(df_full)} товаров")
+            list_dfs.append(df_full)
+    await close_sessions()
+    flush_counters(log)
     df_final = pd.concat(list_dfs)
-    # === 6. Создаем новые колонки ===
-    # df_final['month'] = pd.to_datetime(df_final['date']).dt.strftime('%m-%Y')
-    # df_final['wild'] = df_final['vendor_code'].str.extract(r'(wild\d+)')
+    # === 5. Создаем новые колонки ===
+    # Суммы за неделю/месяц — одним запросом на период, см. main_funnel_period
+    # wild-код артикула — в индексе идентификаторов: IdentityIndex.map(nm_id, 'nm_id', 'wild')
     
     print(f"⚡ DataFrame создан: {len(df_final)} строк за {len(date_ranges)} дней")   
     return df_final
 
-def send_df_to_google(df, sheet):
+def period_ranges(period='month', count=1, include_current=False, today=None):
     """
-    Отправляет DataFrame на указанный лист Google Таблицы.
+    Календарные недели (пн–вс) или месяцы для режима периодов, от свежих к старым.
 
-    Параметры:
-    df (DataFrame): DataFrame, который нужно отправить.
-    sheet (gspread.models.Worksheet): Объект листа, на который будут добавлены данные.
+    count — сколько последних завершённых периодов; include_current=True
+    добавляет текущий период с его начала по вчерашний день.
+    """
+    today = (today or now()).replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == 'week':
+        current_start = today - timedelta(days=today.weekday())
+    elif period == 'month':
+        current_start = today.replace(day=1)
+    else:
+        raise ValueError(f"Неизвестный период: {period}")
+    ranges = []
+    if include_current and today > current_start:
+        ranges.append((current_start, today - timedelta(days=1)))
+    end = current_start - timedelta(days=1)
+    for _ in range(count):
+        start = end - timedelta(days=end.weekday()) if period == 'week' else end.replace(day=1)
+        ranges.append((start, end))
+        end = start - timedelta(days=1)
+    return ranges
 
-    Возвращаемое значение:
-    None
+async def process_funnel_period(period='month', count=1, include_current=False):
+    """
+    Воронка за календарные периоды: один selectedPeriod на неделю/месяц и кабинет
+    вместо выгрузки каждого дня. WB сам суммирует период, поэтому строки
+    помечаются колонкой period и не смешиваются с дневными.
     """
+    ranges = period_ranges(period, count, include_current)
+    print(f"📅 Запрашиваем воронку за {len(ranges)} периодов ({period})...")
+    with nullcontext() if profile_inline() else ProcessPoolExecutor(max_workers=os.cpu_count()) as parser_pool:
+        with stage('funnel.fetch'):
+            # Сырые ответы периодов — отдельным датасетом, чтобы wb reprocess не принял их за дневные
+            results = await asyncio.gather(*(fetch_all(start, end, parser_pool, raw_dataset='funnel_period') for start, end in ranges))
+    await close_sessions()
+    flush_counters(log)
+    column_batches = []
+    for (start, end), result in zip(ranges, results):
+        for acc_data in result:
+            for batch in acc_data or []:
+                rows = len(batch.get('nm_id', []))
+                batch['period'] = [period] * rows
+                batch['period_start'] = [start.strftime("%Y-%m-%d")] * rows
+                batch['period_end'] = [end.strftime("%Y-%m-%d")] * rows
+                column_batches.append(batch)
+    with stage('funnel.frame'):
+        df = columns_to_frame(column_batches)
+    if df.empty:
+        return df
+    # date в ответе — конец периода; чтобы строку нельзя было принять за дневную, её нет
+    df = df.drop(columns=['date'])
+    print(f"📦 Обработано {len(df)} строк за {len(ranges)} периодов")
+    lead = ['period', 'period_start', 'period_end']
+    return df[lead + [col for col in df.columns if col not in lead]]
+
+def get_or_create_worksheet(table, title, cols):
+    import gspread
+    from wb_core.sheets import write_limiter
+
     try:
-        # Данные, которые нужно добавить
-        df_data_to_append = [df.columns.values.tolist()] + df.values.tolist()
-        
-        # Проверка существующих данных на листе
-        existing_data = sheet.get_all_values()
-        
-        if len(existing_data) <= 1:  # Если данных нет
-            print("Добавляем заголовки и данные")
-            sheet.append_rows(df_data_to_append, value_input_option='USER_ENTERED')
-             # Получаем текущую дату и время
-            now = datetime.now()
-            formatted_time = now.strftime("%Y-%m-%d %H:%M:%S")
-            
-            # Получаем количество колонок на листе
-            max_columns = sheet.col_count
-            
-            # Записываем дату и время в первую строку последней колонки
-            sheet.update_cell(1, max_columns, formatted_time)
-            print(f"Дата и время последнего обновления: {formatted_time}")
-        else:
-            print("Добавляем только данные")
-            sheet.append_rows(df_data_to_append[1:], value_input_option='USER_ENTERED')
-            now = datetime.now()
-            formatted_time = now.strftime("%Y-%m-%d %H:%M:%S")
-            
-            # Получаем количество колонок на листе
-            max_columns = sheet.col_count
-            
-            # Записываем дату и время в первую строку последней колонки
-            sheet.update_cell(1, max_columns, formatted_time)
-            print(f"Дата и время последнего обновления: {formatted_time}")
-            
-    except Exception as e:
-        print(f"An error occurred: {e}")
-
-async def main_funnel_daily(days_count=30):
+        return table.worksheet(title)
+    except gspread.WorksheetNotFound:
+        write_limiter.wait()
+        return table.add_worksheet(title=title, rows=1, cols=cols)
+
+async def main_funnel_period(period='month', count=1, include_current=False):
+    """Воронка за недели/месяцы на отдельный лист; перезапуск обновляет те же строки по ключу."""
+    df = await process_funnel_period(period, count, include_current)
+    if df.empty:
+        print("❌ Нет данных воронки за периоды")
+        return
+    table = safe_open_spreadsheet(SPREADSHEET_TITLE)
+    sheet = get_or_create_worksheet(table, FUNNEL_PERIOD_SHEET, len(df.columns))
+    with stage('funnel.upload'):
+        refresh_df_in_google(df, sheet, key_cols=FUNNEL_PERIOD_KEY)
+    with stage('funnel.identity'):
+        remember(articles=df)
+
+def fit_funnel_days(days_count, deadline):
+    """Сколько последних дней воронки успеет выгрузиться за deadline секунд (см. wb_core.planner)."""
+    # Подсказка по страницам — одна на кабинет, для всех его дней
+    pages = {account: funnel_pages_hint(account) for account in load_api_tokens()}
+    units = [
+        funnel_unit(account, (now() - timedelta(days=day)).strftime("%Y-%m-%d"), pages[account])
+        for account in pages
+        for day in range(1, days_count + 1)
+    ]
+    kept, dropped = fit_deadline(units, deadline)
+    if dropped:
+        log.info(f"✂️ Под дедлайн {format_duration(deadline)} не влезли дни: {', '.join(sorted(dropped))}")
+    for requests_count, seconds in estimate(kept).values():
+        log.info(f"⏱ воронка: {requests_count} запросов, ~{format_duration(seconds)}")
+    return days_count - len(dropped)
+
+async def main_funnel_daily(days_count=30, refresh=False, deadline=None):
+    """
+    refresh=True — перезапрашиваем последние days_count дней и обновляем
+    на листе только изменившиеся выкупы/отмены вместо дописывания дублей.
+    deadline — лимит времени выгрузки в секундах: старые дни, которые не
+    успеют выгрузиться по модели лимитов, отбрасываются.
+    """
+    if deadline:
+        days_count = fit_funnel_days(days_count, deadline)
     df = await process_funnel_daily(days_count=days_count)
-    df.drop_duplicates
-    table = safe_open_spreadsheet("Наш Файл УУ ( Акселерация)")
+    df = df.drop_duplicates()
+    table = safe_open_spreadsheet(SPREADSHEET_TITLE)
     sheet = table.worksheet("БД_Воронка")
-    send_df_to_google(df, sheet)
\ No newline at end of file
+    with stage('funnel.upload'):
+        if refresh:
+            refresh_df_in_google(df, sheet, key_cols=['date', 'account', 'nm_id'])
+        else:
+            send_df_to_google(df, sheet)
+    # Доливаем дни в скользящие окна 7/14/30 дней
+    with stage('funnel.rolling'):
+        update_rolling_store(funnel_df=df)
+    with stage('funnel.identity'):
+        remember(articles=df)
\ No newline at end of file
@@ -0,0 +1,13 @@
+"""
+Общее ядро клиентов WB: конфиг и токены, работа с Google Таблицами, утилиты.
+
+Тяжёлые зависимости (pandas, gspread, aiohttp) импортируются внутри функций,
+поэтому импорт самого пакета и запуск CLI остаются быстрыми.
+"""
+
+import os
+
+# Воспроизведение кассеты из окружения (без CLI): каталоги состояния подменяются
+# до того, как модули пайплайнов прочитают свои пути, см. wb_core.cassette.sandbox
+if os.getenv('WB_CASSETTE_MODE') == 'replay':
+    from wb_core import cassette  # noqa: F401
@@ -0,0 +1,3 @@
+from wb_core.cli import main
+
+main()
@@ -0,0 +1,368 @@
+import os
+import gzip
+import json
+import time
+import base64
+import asyncio
+import logging
+import tempfile
+import threading
+from collections import defaultdict, deque
+from urllib.parse import parse_qsl, urlsplit
+
+# Запись и воспроизведение HTTP-обменов с WB и Google Sheets для воспроизводимых
+# прогонов пайплайна целиком. Кассета — cassettes/<имя>.jsonl.gz, по gzip member
+# на обмен. Заголовки запросов (с токенами) не сохраняются, а токены из
+# tokens.json вычищаются из URL, параметров и тел.
+# WB_CASSETTE_MODE=record|replay, WB_CASSETTE — путь к кассете,
+# WB_CASSETTE_TIMING=fast (без задержек) или recorded (с записанным временем ответа)
+MODE = os.getenv('WB_CASSETTE_MODE')
+PATH = os.getenv('WB_CASSETTE', os.path.join('cassettes', 'run.jsonl.gz'))
+TIMING = os.getenv('WB_CASSETTE_TIMING', 'fast')
+
+# Файлы, которые пайплайн пишет рядом с выгрузкой: при воспроизведении они уходят
+# во временный каталог, а рабочие хранилища и состояние остаются нетронутыми
+SANDBOX_ENV = {
+    'WB_STATE_DIR': 'state',
+    'WB_RAW_DIR': 'raw',
+    'WB_SNAPSHOT_DIR': 'snapshots',
+    'WB_ARCHIVE_DIR': 'archive',
+}
+
+_SECRET = '***'
+_lock = threading.Lock()
+_cassette = None
+
+
+class CassetteMiss(LookupError):
+    """В кассете нет ответа на запрос: пайплайн сделал запрос, которого не было при записи."""
+
+
+def configure(mode, path=None, timing=None):
+    """Включает запись (record), воспроизведение (replay) или выключает кассету (None)."""
+    global MODE, PATH, TIMING, _cassette
+    MODE, PATH, TIMING = mode, path or PATH, timing or TIMING
+    _cassette = None
+    if mode:
+        logging.info(f"📼 Кассета {PATH}: {mode}" + (f", время ответов {TIMING}" if mode == 'replay' else ''))
+    if mode == 'replay':
+        sandbox()
+
+
+def sandbox():
+    """
+    Направляет файлы состояния, сырые ответы, снимки и архив во временный каталог.
+
+    Пути читаются модулями при импорте, поэтому вызывается до импорта
+    пайплайнов: из configure() в CLI или при импорте wb_core с WB_CASSETTE_MODE=replay.
+    """
+    root = tempfile.mkdtemp(prefix='wb-replay-')
+    for name, subdir in SANDBOX_ENV.items():
+        os.environ[name] = os.path.join(root, subdir)
+    logging.info(f"📼 Воспроизведение пишет файлы в {root}, рабочие хранилища не меняются")
+    return root
+
+
+def recording():
+    return MODE == 'record'
+
+
+def replaying():
+    return MODE == 'replay'
+
+
+def fast_replay():
+    """Воспроизведение без задержек: паузы под лимиты API тоже пропускаются."""
+    return MODE == 'replay' and TIMING == 'fast'
+
+
+def _secrets():
+    from wb_core.config import load_api_tokens
+    return [token for token in (load_api_tokens() or {}).values() if token]
+
+
+def _scrub(text, secrets):
+    for secret in secrets:
+        text = text.replace(secret, _SECRET)
+    return text
+
+
+def _request_key(method, url, params, body):
+    """Ключ точного совпадения запроса: метод, адрес без query, параметры и тело."""
+    parts = urlsplit(url)
+    query = sorted([(str(k), str(v)) for k, v in (params or {}).items()] + parse_qsl(parts.query))
+    return json.dumps([method.upper(), f"{parts.netloc}{parts.path}", query, body], sort_keys=True, ensure_ascii=False, default=str)
+
+
+def _endpoint(method, url):
+    parts = urlsplit(url)
+    return f"{method.upper()} {parts.netloc}{parts.path}"
+
+
+def _encode_body(body):
+    try:
+        return {'text': body.decode('utf-8')}
+    except UnicodeDecodeError:
+        return {'base64': base64.b64encode(body).decode('ascii')}
+
+
+def _decode_body(record):
+    if 'base64' in record:
+        return base64.b64decode(record['base64'])
+    return record['text'].encode('utf-8')
+
+
+class Cassette:
+    """
+    Обмены одной кассеты.
+
+    При воспроизведении запрос сначала ищется по точному ключу, затем — по
+    порядку среди записанных обменов того же метода и адреса: даты в параметрах
+    считаются от текущего дня и при повторном прогоне не совпадают.
+    Повторы одного запроса (429, пагинация) отдаются в порядке записи.
+    """
+
+    def __init__(self, path, mode):
+        self.path = path
+        self.mode = mode
+        self.started = time.monotonic()
+        # Время начала записи: при воспроизведении "сейчас" сдвигается к нему (см. now())
+        self.recorded_at = time.time()
+        self.clock_shift = 0.0
+        self.secrets = _secrets() if mode == 'record' else []
+        self.by_key = defaultdict(deque)
+        self.by_endpoint = defaultdict(deque)
+        if mode == 'replay':
+            self._load()
+
+    def _load(self):
+        if not os.path.isfile(self.path):
+            raise FileNotFoundError(f"Кассета {self.path} не найдена, запишите её с WB_CASSETTE_MODE=record")
+        count = 0
+        with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+            try:
+                for line in f:
+                    record = json.loads(line)
+                    if not count and 'recorded_at' in record:
+                        self.clock_shift = record['recorded_at'] - time.time()
+                    record['used'] = False
+                    self.by_key[record['key']].append(record)
+                    self.by_endpoint[record['endpoint']].append(record)
+                    count += 1
+            except (EOFError, gzip.BadGzipFile) as e:
+                logging.info(f"⚠️ Оборванная запись в кассете {self.path}, читаем до неё: {e}")
+        logging.info(f"📼 Загружено обменов из кассеты: {count}")
+
+    def record(self, method, url, params, body, status, headers, content, elapsed):
+        url = _scrub(url, self.secrets)
+        params = json.loads(_scrub(json.dumps(params or {}, ensure_ascii=False, default=str), self.secrets))
+        body = json.loads(_scrub(json.dumps(body, ensure_ascii=False, default=str), self.secrets))
+        record = {
+            'recorded_at': self.recorded_at,
+            'at': round(time.monotonic() - self.started - elapsed, 3),
+            'elapsed': round(elapsed, 3),
+            'method': method.upper(),
+            'url': url,
+            'params': params,
+            'body': body,
+            'key': _request_key(method, url, params, body),
+            'endpoint': _endpoint(method, url),
+            'status': status,
+            'content_type': headers.get('Content-Type', ''),
+        }
+        encoded = _encode_body(content)
+        if 'text' in encoded:
+            encoded['text'] = _scrub(encoded['text'], self.secrets)
+        record.update(encoded)
+        line = json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n'
+        with _lock:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'ab') as f:
+                f.write(gzip.compress(line))
+
+    def take(self, method, url, params, body):
+        """Следующий неиспользованный обмен для запроса."""
+        with _lock:
+            for queue in (self.by_key[_request_key(method, url, params, body)], self.by_endpoint[_endpoint(method, url)]):
+                while queue and queue[0]['used']:
+                    queue.popleft()
+                if queue:
+                    record = queue.popleft()
+                    record['used'] = True
+                    return record
+        raise CassetteMiss(f"Нет записанного ответа на {_endpoint(method, url)} {params or ''}")
+
+    def delay(self, record):
+        return record['elapsed'] if TIMING == 'recorded' else 0
+
+
+def now():
+    """
+    Текущее время для дат в запросах. При воспроизведении — время записи кассеты
+    (плюс прошедшее с начала воспроизведения), чтобы запросы совпали по ключу.
+    """
+    from datetime import datetime, timedelta
+
+    if MODE == 'replay':
+        return datetime.now() + timedelta(seconds=get_cassette().clock_shift)
+    return datetime.now()
+
+
+def get_cassette():
+    global _cassette
+    if _cassette is None:
+        with _lock:
+            if _cassette is None:
+                _cassette = Cassette(PATH, MODE)
+    return _cassette
+
+
+def _json_body(kwargs):
+    if 'json' in kwargs:
+        return kwargs['json']
+    data = kwargs.get('data')
+    if isinstance(data, bytes):
+        return data.decode('utf-8', 'replace')
+    return data
+
+
+# --- aiohttp -----------------------------------------------------------------
+
+class _ReplayContent:
+    def __init__(self, body):
+        self._body = body
+
+    async def iter_chunked(self, size):
+        for start in range(0, len(self._body), size):
+            yield self._body[start:start + size]
+
+    async def read(self):
+        return self._body
+
+
+class ReplayResponse:
+    """Ответ из кассеты с интерфейсом aiohttp.ClientResponse, который использует пайплайн."""
+
+    def __init__(self, method, url, status, body, content_type=''):
+        self.method, self.url, self.status = method, url, status
+        self.headers = {'Content-Type': content_type}
+        self._body = body
+        self.content = _ReplayContent(body)
+
+    async def read(self):
+        return self._body
+
+    async def text(self, encoding='utf-8'):
+        return self._body.decode(encoding)
+
+    async def json(self, **kwargs):
+        return json.loads(self._body)
+
+    def raise_for_status(self):
+        if self.status >= 400:
+            import aiohttp
+            from multidict import CIMultiDict, CIMultiDictProxy
+            from yarl import URL
+
+            info = aiohttp.RequestInfo(URL(self.url), self.method, CIMultiDictProxy(CIMultiDict()), URL(self.url))
+            raise aiohttp.ClientResponseError(info, (), status=self.status, message=f"HTTP {self.status}")
+
+    def release(self):
+        pass
+
+
+class _RequestContext:
+    def __init__(self, session, method, url, kwargs):
+        self.session, self.method, self.url, self.kwargs = session, method, url, kwargs
+
+    async def __aenter__(self):
+        cassette = get_cassette()
+        params, body = self.kwargs.get('params'), _json_body(self.kwargs)
+        if cassette.mode == 'replay':
+            record = cassette.take(self.method, self.url, params, body)
+            if cassette.delay(record):
+                await asyncio.sleep(cassette.delay(record))
+            return ReplayResponse(self.method, self.url, record['status'], _decode_body(record), record['content_type'])
+        started = time.monotonic()
+        async with self.session.request(self.method, self.url, **self.kwargs) as response:
+            content = await response.read()
+            status, headers = response.status, dict(response.headers)
+        await asyncio.to_thread(cassette.record, self.method, self.url, params, body, status, headers, content, time.monotonic() - started)
+        # Тело уже прочитано: дальше пайплайн работает с копией, как при воспроизведении
+        return ReplayResponse(self.method, self.url, status, content, headers.get('Content-Type', ''))
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class CassetteSession:
+    """
+    Обёртка над aiohttp.ClientSession: запись обменов или их воспроизведение.
+
+    При воспроизведении реальной сессии нет, сеть не используется.
+    """
+
+    def __init__(self, session=None):
+        self.session = session
+
+    @property
+    def closed(self):
+        return self.session.closed if self.session is not None else False
+
+    def request(self, method, url, **kwargs):
+        return _RequestContext(self.session, method, url, kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+
+
+# --- requests ----------------------------------------------------------------
+
+def _replay_requests_response(method, url, record):
+    import requests
+
+    response = requests.models.Response()
+    response.status_code = record['status']
+    response._content = _decode_body(record)
+    response.headers['Content-Type'] = record['content_type']
+    response.url = url
+    response.encoding = 'utf-8'
+    response.request = requests.Request(method, url).prepare()
+    return response
+
+
+def wrap_requests_session(session):
+    """
+    Подменяет session.request записью или воспроизведением.
+
+    Подходит и для requests.Session из wb_core.http, и для AuthorizedSession gspread.
+    """
+    real_request = session.request
+
+    def request(method, url, *args, **kwargs):
+        cassette = get_cassette()
+        params, body = kwargs.get('params'), _json_body(kwargs)
+        if cassette.mode == 'replay':
+            record = cassette.take(method, url, params, body)
+            if cassette.delay(record):
+                time.sleep(cassette.delay(record))
+            return _replay_requests_response(method, url, record)
+        started = time.monotonic()
+        response = real_request(method, url, *args, **kwargs)
+        cassette.record(method, url, params, body, response.status_code, response.headers, response.content, time.monotonic() - started)
+        return response
+
+    session.request = request
+    return session
+
+
+if MODE == 'replay':
+    sandbox()
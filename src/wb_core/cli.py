@@ -0,0 +1,257 @@
+import os
+import argparse
+import asyncio
+
+
+# Модули пайплайнов импортируются внутри команд: pandas, aiohttp и gspread
+# загружаются только для того этапа, который реально запускается
+
+def cmd_advert(args):
+    from advert.utils_advert import main_advert
+    main_advert(args.refresh_days or args.days, refresh=bool(args.refresh_days), prune=not args.no_prune, deadline=_deadline(args))
+
+
+def cmd_funnel(args):
+    from funnel.utils_funnel import main_funnel_daily, main_funnel_period
+    if args.period:
+        asyncio.run(main_funnel_period(args.period, args.periods, args.current))
+        return
+    asyncio.run(main_funnel_daily(args.refresh_days or args.days, refresh=bool(args.refresh_days), deadline=_deadline(args)))
+
+
+def _deadline(args):
+    return args.deadline * 60 if args.deadline else None
+
+
+def cmd_advert_spend(args):
+    from advert_spend.utils_adv_spend import main_adv_spend
+    main_adv_spend(args.days)
+
+
+def cmd_content(args):
+    from content.utils_content import main_content
+    main_content()
+
+
+def cmd_facts(args):
+    from facts.utils_facts import main_facts
+    main_facts(args.days)
+
+
+def cmd_daemon(args):
+    from daemon.utils_daemon import DEFAULT_SCHEDULE, parse_schedule, run_daemon
+    asyncio.run(run_daemon(parse_schedule(args.schedule or DEFAULT_SCHEDULE), port=args.port, days_back=args.days))
+
+
+def cmd_retention(args):
+    from wb_core.config import SPREADSHEET_TITLE
+    from wb_core.retention import RETENTION_SHEETS, apply_retention
+    from wb_core.sheets import safe_open_spreadsheet
+
+    sheets = {title: RETENTION_SHEETS[title] for title in args.sheet} if args.sheet else RETENTION_SHEETS
+    apply_retention(safe_open_spreadsheet(SPREADSHEET_TITLE), args.hot_days, args.mode, args.archive_dir, sheets)
+
+
+def cmd_reprocess(args):
+    from wb_core.reprocess import DATASETS, reprocess
+    reprocess(args.date_from, args.date_to, args.dataset or DATASETS, args.raw_dir, args.out_dir, args.upload, args.workers)
+
+
+def cmd_plan(args):
+    from datetime import datetime, timedelta
+    from wb_core.planner import build_plan, fit_deadline, print_plan
+
+    days = [(datetime.now() - timedelta(days=day)).strftime("%Y-%m-%d") for day in range(1, args.days + 1)]
+    units = build_plan(days, args.dataset or ('advert', 'funnel'), prune=not args.no_prune)
+    dropped = ()
+    if args.deadline:
+        units, dropped = fit_deadline(units, _deadline(args))
+    print_plan(units, dropped)
+
+
+def cmd_query(args):
+    import json
+    from wb_core import query
+
+    if args.action == 'build':
+        query.update_store(query.load_sources(args.source, args.date_from, args.date_to), args.store_dir)
+    elif args.action == 'serve':
+        query.serve(port=args.port, store_dir=args.store_dir)
+    else:
+        rows = query.open_table(args.table, args.store_dir).select(
+            nm_id=args.nm_id, advert_id=args.advert_id, account=args.account,
+            date_from=args.date_from, date_to=args.date_to,
+            columns=args.columns.split(',') if args.columns else None,
+        )
+        for row in rows:
+            print(json.dumps(row, ensure_ascii=False))
+
+
+def cmd_snapshot(args):
+    import sys
+    from datetime import datetime
+    from wb_core import snapshots
+
+    day = args.day or datetime.now().strftime("%Y-%m-%d")
+    if args.action == 'at':
+        df = snapshots.value_at(args.dataset, day, args.at, args.snapshot_dir)
+    else:
+        df = snapshots.increments(args.dataset, day, args.freq * 60, args.snapshot_dir)
+    df.to_csv(sys.stdout, index=False)
+
+
+def cmd_enqueue(args):
+    from daemon.utils_worker import DATASETS, enqueue, queue_days
+    enqueue(args.dataset or DATASETS, queue_days(args.days, args.today), args.account, args.force, args.queue)
+
+
+def cmd_worker(args):
+    from daemon.utils_worker import print_queue, run_workers
+    if args.status:
+        print_queue(args.queue)
+    else:
+        run_workers(args.processes, args.queue, args.dataset, exit_when_empty=not args.forever)
+
+
+def cmd_tokens(args):
+    from wb_core.config import find_config_file, load_api_tokens
+    tokens = load_api_tokens() or {}
+    print(f"tokens.json: {find_config_file('tokens.json', 'WB_TOKENS_PATH')}")
+    for account in tokens:
+        print(f"  {account}")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='wb', description='Сбор статистики WB в Google Таблицы')
+    # Профилирование этапов: --profile (время) или --profile cprofile,tracemalloc
+    parser.add_argument('--profile', nargs='?', const='time', default=None)
+    # Кассета HTTP-обменов: --record пишет, --replay воспроизводит без сети (см. wb_core.cassette)
+    cassette = parser.add_mutually_exclusive_group()
+    cassette.add_argument('--record', metavar='CASSETTE')
+    cassette.add_argument('--replay', metavar='CASSETTE')
+    parser.add_argument('--replay-timing', choices=('fast', 'recorded'), default='fast')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    for name, func in (('advert', cmd_advert), ('funnel', cmd_funnel)):
+        p = sub.add_parser(name)
+        p.add_argument('--days', type=int, default=1)
+        # Режим обновления: перезапрашиваем последние N дней и пишем только изменившиеся ячейки
+        p.add_argument('--refresh-days', type=int, default=0)
+        # Лимит времени в минутах: старые дни, не успевающие по модели лимитов, отбрасываются
+        p.add_argument('--deadline', type=float, default=None)
+        p.set_defaults(func=func)
+    # Запрашивать fullstats по всем кампаниям, без отсева неактивных
+    sub.choices['advert'].add_argument('--no-prune', action='store_true')
+    # Режим периодов: один запрос на календарную неделю/месяц и кабинет, отдельный лист
+    sub.choices['funnel'].add_argument('--period', choices=('week', 'month'))
+    sub.choices['funnel'].add_argument('--periods', type=int, default=1, help='Сколько последних завершённых периодов')
+    sub.choices['funnel'].add_argument('--current', action='store_true', help='Добавить текущий период по вчерашний день')
+
+    p = sub.add_parser('advert-spend')
+    p.add_argument('--days', type=int, default=1)
+    p.set_defaults(func=cmd_advert_spend)
+
+    p = sub.add_parser('content')
+    p.set_defaults(func=cmd_content)
+
+    p = sub.add_parser('facts')
+    p.add_argument('--days', type=int, default=90)
+    p.set_defaults(func=cmd_facts)
+
+    p = sub.add_parser('daemon')
+    p.add_argument('--schedule', default=None)
+    p.add_argument('--port', type=int, default=8765)
+    p.add_argument('--days', type=int, default=1)
+    p.set_defaults(func=cmd_daemon)
+
+    p = sub.add_parser('retention')
+    # Сколько последних дней остаётся на рабочем листе
+    p.add_argument('--hot-days', type=int, default=60)
+    p.add_argument('--mode', choices=('sheet', 'file'), default='sheet')
+    p.add_argument('--archive-dir', default='archive')
+    p.add_argument('--sheet', action='append', help='Лист для обрезки (по умолчанию все растущие листы)')
+    p.set_defaults(func=cmd_retention)
+
+    # Офлайн-пересборка таблиц из сохранённых сырых ответов (см. wb_core.raw_store)
+    p = sub.add_parser('reprocess')
+    p.add_argument('--from', dest='date_from', required=True, help='ГГГГ-ММ-ДД')
+    p.add_argument('--to', dest='date_to', required=True, help='ГГГГ-ММ-ДД')
+    p.add_argument('--dataset', action='append', choices=('advert', 'funnel', 'advert_spend', 'content'))
+    p.add_argument('--raw-dir', default=os.getenv('WB_RAW_DIR', 'raw'))
+    p.add_argument('--out-dir', default=os.getenv('WB_REPROCESS_DIR', 'reprocess'))
+    p.add_argument('--workers', type=int, default=None)
+    p.add_argument('--upload', action='store_true', help='Обновить листы Google Таблицы по ключам')
+    p.set_defaults(func=cmd_reprocess)
+
+    # Оценка числа запросов и времени выгрузки без запросов к fullstats и воронке
+    p = sub.add_parser('plan')
+    p.add_argument('--days', type=int, default=1)
+    p.add_argument('--dataset', action='append', choices=('advert', 'funnel'))
+    p.add_argument('--deadline', type=float, default=None, help='Лимит времени в минутах')
+    p.add_argument('--no-prune', action='store_true')
+    p.set_defaults(func=cmd_plan)
+
+    # Локальное индексированное хранилище: build — собрать, get — выборка, serve — HTTP
+    p = sub.add_parser('query')
+    p.add_argument('action', choices=('build', 'get', 'serve'))
+    p.add_argument('--store-dir', default=os.getenv('WB_QUERY_DIR', 'store'))
+    p.add_argument('--source', choices=('raw', 'sheets'), default='raw', help='build: сырые ответы или листы таблицы')
+    p.add_argument('--table', choices=('advert', 'advert_spend', 'funnel', 'content'), default='advert')
+    p.add_argument('--nm-id', type=int)
+    p.add_argument('--advert-id', type=int)
+    p.add_argument('--account')
+    p.add_argument('--from', dest='date_from', help='ГГГГ-ММ-ДД')
+    p.add_argument('--to', dest='date_to', help='ГГГГ-ММ-ДД')
+    p.add_argument('--columns', help='Колонки через запятую')
+    p.add_argument('--port', type=int, default=8766)
+    p.set_defaults(func=cmd_query)
+
+    # Внутридневные снимки (пишет демон, датасет snapshot): at — значения на момент, increments — по интервалам
+    p = sub.add_parser('snapshot')
+    p.add_argument('action', choices=('at', 'increments'))
+    p.add_argument('--dataset', choices=('advert', 'funnel'), default='advert')
+    p.add_argument('--day', help='ГГГГ-ММ-ДД, по умолчанию сегодня')
+    p.add_argument('--at', help="'ЧЧ:ММ' или 'ГГГГ-ММ-ДД ЧЧ:ММ', по умолчанию последний снимок")
+    p.add_argument('--freq', type=int, default=60, help='Интервал приращений в минутах')
+    p.add_argument('--snapshot-dir', default=os.getenv('WB_SNAPSHOT_DIR', 'snapshots'))
+    p.set_defaults(func=cmd_snapshot)
+
+    # Очередь единиц (датасет, кабинет, день) для воркеров на одной или нескольких машинах
+    queue_path = os.getenv('WB_QUEUE_PATH', os.path.join('state', 'queue.db'))
+    p = sub.add_parser('enqueue')
+    p.add_argument('--dataset', action='append', choices=('advert', 'funnel', 'advert_spend', 'content'))
+    p.add_argument('--days', type=int, default=1)
+    p.add_argument('--today', action='store_true', help='Поставить и сегодняшний день')
+    p.add_argument('--account', action='append', help='Только указанные кабинеты')
+    p.add_argument('--force', action='store_true', help='Перезапустить уже выполненные и упавшие единицы')
+    p.add_argument('--queue', default=queue_path)
+    p.set_defaults(func=cmd_enqueue)
+
+    p = sub.add_parser('worker')
+    p.add_argument('--processes', type=int, default=1)
+    p.add_argument('--dataset', action='append', choices=('advert', 'funnel', 'advert_spend', 'content'))
+    p.add_argument('--forever', action='store_true', help='Не завершаться на пустой очереди, а ждать новых единиц')
+    p.add_argument('--status', action='store_true', help='Показать состояние очереди и выйти')
+    p.add_argument('--queue', default=queue_path)
+    p.set_defaults(func=cmd_worker)
+
+    p = sub.add_parser('tokens')
+    p.set_defaults(func=cmd_tokens)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    from wb_core.logs import setup_logging
+    setup_logging()
+    if args.record or args.replay:
+        from wb_core import cassette
+        cassette.configure('record' if args.record else 'replay', args.record or args.replay, args.replay_timing)
+    if args.profile:
+        from wb_core.profiling import enable_profiling
+        enable_profiling([option.strip() for option in args.profile.split(',')])
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import os
+import json
+import logging
+from functools import lru_cache
+
+SPREADSHEET_TITLE = "Наш Файл УУ ( Акселерация)"
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+log = logging.getLogger('wb.config')
+
+# Найденные пути: промахи не запоминаем, чтобы долгоживущий процесс увидел
+# файл, созданный уже после его старта
+_found = {}
+
+
+def _find_upwards(name, start):
+    if (name, start) in _found:
+        return _found[name, start]
+    current_dir = start
+    while True:
+        path = os.path.join(current_dir, name)
+        if os.path.isfile(path):
+            _found[name, start] = path
+            return path
+        # Поднимаемся на уровень выше
+        parent_dir = os.path.dirname(current_dir)
+        if parent_dir == current_dir:
+            # Достигли корня диска
+            return None
+        current_dir = parent_dir
+
+
+def find_config_file(name, env_var=None):
+    """
+    Ищет файл конфигурации (tokens.json, creds.json).
+
+    Порядок: переменная окружения env_var, затем вверх от текущей директории,
+    затем вверх от директории пакета. Найденный путь запоминается на процесс,
+    отсутствие файла — нет.
+    """
+    if env_var and os.getenv(env_var):
+        return os.getenv(env_var)
+    return _find_upwards(name, os.getcwd()) or _find_upwards(name, PACKAGE_DIR)
+
+
+@lru_cache(maxsize=None)
+def _load_dotenv_once():
+    from dotenv import load_dotenv
+    load_dotenv()
+
+
+@lru_cache(maxsize=4)
+def _read_tokens(path, mtime):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def load_api_tokens():
+    """
+    Возвращает {кабинет: токен} из tokens.json.
+
+    Файл читается один раз и перечитывается только при изменении mtime,
+    так что долгоживущие процессы подхватывают новые токены без рестарта.
+    """
+    _load_dotenv_once()
+    tokens_path = find_config_file('tokens.json', 'WB_TOKENS_PATH')
+    if tokens_path is None:
+        log.error("Файл tokens.json не найден ни в одной из директорий")
+        return None
+    try:
+        return dict(_read_tokens(tokens_path, os.stat(tokens_path).st_mtime))
+    except json.JSONDecodeError:
+        log.error(f"Ошибка декодирования JSON в файле: {tokens_path}")
+        return None
+
+
+def creds_path():
+    """Путь к creds.json сервисного аккаунта Google."""
+    path = find_config_file('creds.json', 'WB_CREDS_PATH')
+    if path is None:
+        log.error("Файл creds.json не найден ни в одной из директорий")
+    return path
@@ -0,0 +1,103 @@
+import time
+import asyncio
+import threading
+from urllib.parse import urlsplit
+
+from wb_core import cassette
+
+# Один пул соединений на хост WB: кабинеты и пайплайны делят keep-alive соединения,
+# а токен передаётся в заголовках каждого запроса
+DEFAULT_HEADERS = {"Accept-Encoding": "gzip, deflate"}
+# Сколько соединений держим открытыми к одному хосту
+POOL_SIZE = 20
+KEEPALIVE_TIMEOUT = 60
+DNS_CACHE_TTL = 10 * 60
+
+_async_sessions = {}
+_sync_sessions = {}
+_sync_lock = threading.Lock()
+
+
+def host_of(url):
+    return urlsplit(url).netloc
+
+
+def get_session(url):
+    """
+    Общая aiohttp-сессия для хоста url в текущем event loop.
+
+    Соединения переиспользуются (keep-alive), DNS кэшируется коннектором,
+    ответы запрашиваются сжатыми и распаковываются aiohttp.
+    С включённой кассетой (wb_core.cassette) обмены записываются или
+    воспроизводятся без сети.
+    """
+    loop = asyncio.get_running_loop()
+    key = (id(loop), host_of(url))
+    session = _async_sessions.get(key)
+    if session is None or session.closed:
+        if cassette.replaying():
+            session = cassette.CassetteSession()
+        else:
+            session = _new_async_session()
+            if cassette.recording():
+                session = cassette.CassetteSession(session)
+        _async_sessions[key] = session
+    return session
+
+
+def _new_async_session():
+    import aiohttp
+
+    connector = aiohttp.TCPConnector(
+        limit_per_host=POOL_SIZE,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        use_dns_cache=True,
+        ttl_dns_cache=DNS_CACHE_TTL,
+    )
+    return aiohttp.ClientSession(connector=connector, headers=DEFAULT_HEADERS, auto_decompress=True)
+
+
+async def close_sessions():
+    """Закрывает aiohttp-сессии текущего event loop; вызывать в конце asyncio.run."""
+    loop_id = id(asyncio.get_running_loop())
+    for key in [key for key in _async_sessions if key[0] == loop_id]:
+        await _async_sessions.pop(key).close()
+
+
+def get_sync_session(url):
+    """
+    Общая requests-сессия для хоста url.
+
+    requests.Session держит пул keep-alive соединений, поэтому TCP+TLS
+    рукопожатие и DNS-запрос выполняются один раз на соединение, а не на вызов.
+    """
+    host = host_of(url)
+    session = _sync_sessions.get(host)
+    if session is not None:
+        return session
+    with _sync_lock:
+        session = _sync_sessions.get(host)
+        if session is None:
+            import requests
+            from requests.adapters import HTTPAdapter
+
+            session = requests.Session()
+            session.headers.update(DEFAULT_HEADERS)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            if cassette.MODE:
+                cassette.wrap_requests_session(session)
+            _sync_sessions[host] = session
+    return session
+
+
+async def pause(seconds):
+    """Пауза под лимиты API; при быстром воспроизведении кассеты лимитов нет и ждать не нужно."""
+    if not cassette.fast_replay():
+        await asyncio.sleep(seconds)
+
+
+def pause_sync(seconds):
+    if not cassette.fast_replay():
+        time.sleep(seconds)
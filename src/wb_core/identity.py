@@ -0,0 +1,168 @@
+import os
+import json
+import logging
+import threading
+from datetime import datetime
+
+from wb_core.utils import state_lock
+
+# Постоянный индекс идентификаторов артикула: nmID, vendorCode (артикул продавца),
+# wild-код из артикула продавца и advertId кампаний, которые продвигают артикул.
+# Пополняется карточками контента, воронкой и рекламной статистикой; пайплайны
+# и соединения берут из него соответствия векторно, без regex и поиска по кадрам
+IDENTITY_PATH = os.path.join(os.getenv('WB_STATE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'state')), 'identity.json')
+WILD_PATTERN = r'(wild\d+)'
+
+ARTICLE_COLUMNS = ['account', 'nm_id', 'vendor_code', 'wild', 'updated']
+CAMPAIGN_COLUMNS = ['account', 'advert_id', 'nm_id', 'updated']
+# Из каких ключей соответствие однозначно: wild объединяет несколько артикулов
+LOOKUP_KEYS = ('nm_id', 'vendor_code', 'advert_id')
+
+
+def extract_wild(vendor_codes):
+    """wild-код из артикулов продавца (Series), NaN, если его нет."""
+    return vendor_codes.astype(str).str.extract(WILD_PATTERN, expand=False)
+
+
+def _ids(values):
+    import pandas as pd
+    return pd.to_numeric(pd.Series(values), errors='coerce').astype('Int64')
+
+
+class IdentityIndex:
+    """
+    Соответствия идентификаторов артикула.
+
+    articles — по строке на nm_id (последние известные vendor_code и wild),
+    campaigns — по строке на advert_id (артикул кампании). Поиск идёт через
+    хэш-индексы pandas: map() переводит целую колонку за один get_indexer.
+    """
+
+    def __init__(self, articles=None, campaigns=None):
+        import pandas as pd
+
+        self.articles = articles if articles is not None else pd.DataFrame(columns=ARTICLE_COLUMNS)
+        self.campaigns = campaigns if campaigns is not None else pd.DataFrame(columns=CAMPAIGN_COLUMNS)
+        self.articles['nm_id'] = _ids(self.articles['nm_id']).to_numpy()
+        self.campaigns['advert_id'] = _ids(self.campaigns['advert_id']).to_numpy()
+        self.campaigns['nm_id'] = _ids(self.campaigns['nm_id']).to_numpy()
+        self._lookups = {}
+
+    @classmethod
+    def load(cls, path=IDENTITY_PATH):
+        import pandas as pd
+
+        if not os.path.isfile(path):
+            return cls()
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(pd.DataFrame(data['articles'], columns=ARTICLE_COLUMNS), pd.DataFrame(data['campaigns'], columns=CAMPAIGN_COLUMNS))
+
+    def save(self, path=IDENTITY_PATH):
+        def columns(df):
+            return {col: [None if value != value else value for value in df[col].astype(object)] for col in df.columns}
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'articles': columns(self.articles), 'campaigns': columns(self.campaigns)}, f, ensure_ascii=False, default=int)
+        os.replace(tmp_path, path)
+
+    def update_articles(self, df, nm_col='nm_id', vendor_col='vendor_code'):
+        """Добавляет и обновляет артикулы из кадра с колонками account, nm_col и vendor_col."""
+        import pandas as pd
+
+        new = pd.DataFrame({
+            'account': df['account'].astype(str).to_numpy(),
+            'nm_id': _ids(df[nm_col]).to_numpy(),
+            'vendor_code': df[vendor_col].astype(str).to_numpy(),
+        }).dropna(subset=['nm_id'])
+        new = new[new['vendor_code'].ne('') & new['vendor_code'].ne('nan')]
+        new['wild'] = extract_wild(new['vendor_code'])
+        new['updated'] = datetime.now().strftime("%Y-%m-%d")
+        return self._merge('articles', new, 'nm_id', ['vendor_code'])
+
+    def update_campaigns(self, df, advert_col='advertId', nm_col='article_id'):
+        """Добавляет и обновляет привязки кампаний к артикулам (последняя строка кадра побеждает)."""
+        import pandas as pd
+
+        new = pd.DataFrame({
+            'account': df['account'].astype(str).to_numpy(),
+            'advert_id': _ids(df[advert_col]).to_numpy(),
+            'nm_id': _ids(df[nm_col]).to_numpy(),
+        }).dropna(subset=['advert_id', 'nm_id'])
+        new['updated'] = datetime.now().strftime("%Y-%m-%d")
+        return self._merge('campaigns', new, 'advert_id', ['nm_id'])
+
+    def _merge(self, table, new, key, compare):
+        """Сливает new в таблицу по ключу; возвращает число новых и изменившихся строк."""
+        import pandas as pd
+
+        current = getattr(self, table)
+        new = new.drop_duplicates(key, keep='last')
+        known = current.set_index(key)[compare].reindex(new[key]).reset_index(drop=True)
+        same = (known == new[compare].reset_index(drop=True)).fillna(False).all(axis=1)
+        changed = ~same.to_numpy(dtype=bool)
+        if not changed.any():
+            return 0
+        merged = pd.concat([current[~current[key].isin(new[key][changed])], new[changed]], ignore_index=True)
+        for col in ('nm_id', 'advert_id'):
+            if col in merged:
+                merged[col] = _ids(merged[col]).to_numpy()
+        setattr(self, table, merged[current.columns.tolist()])
+        self._lookups.clear()
+        return int(changed.sum())
+
+    def _lookup(self, src):
+        """(pd.Index ключей src, строки таблицы в порядке индекса) — строится один раз на версию таблицы."""
+        import pandas as pd
+
+        if src not in self._lookups:
+            table = self.campaigns if src == 'advert_id' else self.articles
+            table = table.dropna(subset=[src]).drop_duplicates(src, keep='last')
+            self._lookups[src] = (pd.Index(table[src]), table.reset_index(drop=True))
+        return self._lookups[src]
+
+    def map(self, values, src, dst):
+        """
+        Переводит колонку идентификаторов src в dst: nm_id, vendor_code, wild или advert_id -> nm_id.
+
+        Возвращает Series того же размера, неизвестные значения — NA.
+        """
+        import pandas as pd
+
+        if src not in LOOKUP_KEYS:
+            raise ValueError(f"По {src} соответствие неоднозначно, ключ поиска — один из {LOOKUP_KEYS}")
+        index = values.index if isinstance(values, pd.Series) else None
+        values = _ids(values) if src in ('nm_id', 'advert_id') else pd.Series(values).astype(str)
+        keys, table = self._lookup(src)
+        positions = keys.get_indexer(values)
+        # Строки таблицы пронумерованы с нуля: позиция -1 (ключ не найден) даёт NA, в том числе на пустом индексе
+        if src == 'advert_id':
+            nm_ids = table['nm_id'].reindex(positions).reset_index(drop=True)
+            if dst == 'nm_id':
+                return nm_ids.set_axis(index) if index is not None else nm_ids
+            return self.map(nm_ids, 'nm_id', dst).set_axis(index if index is not None else nm_ids.index)
+        result = table[dst].reindex(positions).reset_index(drop=True)
+        return result.set_axis(index) if index is not None else result
+
+
+def remember(articles=None, campaigns=None, nm_col='nm_id', vendor_col='vendor_code', path=IDENTITY_PATH):
+    """
+    Пополняет сохранённый индекс кадрами пайплайнов и сохраняет его, если что-то изменилось.
+
+    articles — кадр с account, nm_col и vendor_col (воронка или карточки контента),
+    campaigns — кадр рекламной статистики с account, advertId и article_id.
+    """
+    # Индекс пополняют и демон, и воркеры очереди: загрузка и запись — под одной блокировкой
+    with state_lock(path):
+        index = IdentityIndex.load(path)
+        changed = 0
+        if articles is not None and len(articles):
+            changed += index.update_articles(articles, nm_col, vendor_col)
+        if campaigns is not None and len(campaigns):
+            changed += index.update_campaigns(campaigns)
+        if changed:
+            index.save(path)
+        logging.info(f"🪪 Индекс артикулов: обновлено {changed} соответствий")
+    return index
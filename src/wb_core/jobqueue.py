@@ -0,0 +1,168 @@
+import os
+import time
+import uuid
+import socket
+import sqlite3
+import logging
+
+# Очередь единиц работы (датасет, кабинет, день) в SQLite. Воркеры в разных
+# процессах (и на разных машинах с общим томом) берут единицы в аренду,
+# продлевают её, пока работают, и отмечают выполнение ровно один раз.
+# На сетевом томе журнал остаётся в режиме DELETE: WAL там не работает.
+QUEUE_PATH = os.getenv('WB_QUEUE_PATH', os.path.join('state', 'queue.db'))
+LEASE_SECONDS = int(os.getenv('WB_LEASE_SECONDS', 15 * 60))
+MAX_ATTEMPTS = 3
+
+PENDING, LEASED, DONE, FAILED = 'pending', 'leased', 'done', 'failed'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS units (
+    id INTEGER PRIMARY KEY,
+    dataset TEXT NOT NULL,
+    account TEXT NOT NULL,
+    day TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_token TEXT,
+    lease_expires REAL,
+    rows INTEGER,
+    error TEXT,
+    created_at REAL NOT NULL,
+    finished_at REAL,
+    UNIQUE (dataset, account, day)
+);
+CREATE INDEX IF NOT EXISTS units_status ON units (status, lease_expires);
+"""
+
+
+class LeaseLost(Exception):
+    """Аренду единицы забрал другой воркер, пока эта выгрузка ещё шла."""
+
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    """
+    Очередь единиц работы.
+
+    lease() выдаёт единицу с уникальным lease_token; complete() и fail()
+    срабатывают, только если аренда всё ещё принадлежит этому токену.
+    Просроченная аренда (воркер упал или завис) возвращается в очередь.
+    Одновременно в аренде не больше одной единицы на кабинет и датасет: лимиты
+    WB считаются на токен и метод, и два воркера на одном лимите только мешали
+    бы друг другу.
+    """
+
+    def __init__(self, path=QUEUE_PATH, lease_seconds=LEASE_SECONDS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # isolation_level=None — транзакции открываем явно через BEGIN IMMEDIATE
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(_SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def enqueue(self, dataset, accounts, days, force=False):
+        """Ставит единицы в очередь; уже известные пропускаются, force=True перезапускает выполненные и упавшие."""
+        now = time.time()
+        added = 0
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            for account in accounts:
+                for day in days:
+                    cursor = self.db.execute(
+                        "INSERT OR IGNORE INTO units (dataset, account, day, created_at) VALUES (?, ?, ?, ?)",
+                        (dataset, account, day, now),
+                    )
+                    if not cursor.rowcount and force:
+                        cursor = self.db.execute(
+                            "UPDATE units SET status = ?, attempts = 0, error = NULL, lease_token = NULL "
+                            "WHERE dataset = ? AND account = ? AND day = ? AND status IN (?, ?)",
+                            (PENDING, dataset, account, day, DONE, FAILED),
+                        )
+                    added += cursor.rowcount
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+        return added
+
+    def lease(self, owner=None, datasets=None):
+        """
+        Берёт в аренду следующую единицу: сначала самые свежие дни.
+
+        Возвращает dict с полями единицы и lease_token или None, если брать нечего.
+        """
+        now = time.time()
+        token = uuid.uuid4().hex
+        dataset_filter = f"AND dataset IN ({','.join('?' * len(datasets))})" if datasets else ""
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.db.execute(
+                f"""
+                SELECT * FROM units
+                WHERE (status = ? OR (status = ? AND lease_expires < ?))
+                  AND NOT EXISTS (
+                      SELECT 1 FROM units AS busy
+                      WHERE busy.account = units.account AND busy.dataset = units.dataset
+                        AND busy.status = ? AND busy.lease_expires >= ?
+                  )
+                  {dataset_filter}
+                ORDER BY day DESC, id
+                LIMIT 1
+                """,
+                (PENDING, LEASED, now, LEASED, now, *(datasets or ())),
+            ).fetchone()
+            if row is None:
+                self.db.execute("COMMIT")
+                return None
+            if row['status'] == LEASED:
+                logging.info(f"⏰ Аренда {row['lease_owner']} на {row['dataset']}/{row['account']}/{row['day']} истекла, забираем")
+            self.db.execute(
+                "UPDATE units SET status = ?, attempts = attempts + 1, lease_owner = ?, lease_token = ?, lease_expires = ? WHERE id = ?",
+                (LEASED, owner or worker_id(), token, now + self.lease_seconds, row['id']),
+            )
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+        unit = dict(row)
+        unit.update(status=LEASED, lease_token=token, attempts=row['attempts'] + 1)
+        return unit
+
+    def _update_leased(self, unit, sql, params):
+        cursor = self.db.execute(f"{sql} WHERE id = ? AND lease_token = ? AND status = ?", (*params, unit['id'], unit['lease_token'], LEASED))
+        return cursor.rowcount == 1
+
+    def heartbeat(self, unit):
+        """Продлевает аренду; False — аренду уже забрал другой воркер."""
+        return self._update_leased(unit, "UPDATE units SET lease_expires = ?", (time.time() + self.lease_seconds,))
+
+    def complete(self, unit, rows=None):
+        """Отмечает единицу выполненной ровно один раз: повторная или чужая отметка вернёт False."""
+        return self._update_leased(unit, "UPDATE units SET status = ?, rows = ?, error = NULL, finished_at = ?", (DONE, rows, time.time()))
+
+    def fail(self, unit, error):
+        """Возвращает единицу в очередь, после MAX_ATTEMPTS попыток — помечает упавшей."""
+        status = FAILED if unit['attempts'] >= MAX_ATTEMPTS else PENDING
+        return self._update_leased(unit, "UPDATE units SET status = ?, error = ?, lease_expires = NULL", (status, str(error)[:1000]))
+
+    def unfinished(self, datasets=None):
+        """Сколько единиц ещё ждут или выполняются (в том числе занятые другими воркерами)."""
+        dataset_filter = f"AND dataset IN ({','.join('?' * len(datasets))})" if datasets else ""
+        return self.db.execute(
+            f"SELECT COUNT(*) FROM units WHERE status IN (?, ?) {dataset_filter}", (PENDING, LEASED, *(datasets or ()))
+        ).fetchone()[0]
+
+    def stats(self):
+        """Количество единиц по датасетам и статусам."""
+        return self.db.execute(
+            "SELECT dataset, status, COUNT(*) AS count FROM units GROUP BY dataset, status ORDER BY dataset, status"
+        ).fetchall()
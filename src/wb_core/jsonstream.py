@@ -0,0 +1,142 @@
+import os
+import re
+import json
+import codecs
+
+# WB_STREAM_JSON=1 — разбирать большие ответы по мере прихода байтов в текущем
+# процессе вместо read() целиком и разбора в пуле: меньше пик памяти и первые
+# строки готовы до конца ответа, но декодирование идёт в event loop
+STREAM_ENABLED = os.getenv('WB_STREAM_JSON') == '1'
+CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = ' \t\n\r'
+# Токены, от которых зависит вложенность: строка целиком (в ней скобки не считаются)
+# и скобки. Строка без закрывающей кавычки в конце куска — group(1) пустая
+_TOKEN = re.compile(r'"(?:[^"\\]|\\.)*(?:(")|\\?\Z)|[\[\]{}]')
+# Скаляр на месте элемента массива: строка или число/true/false/null до разделителя
+_SCALAR = re.compile(r'"(?:[^"\\]|\\.)*"|[^",\]\s][^,\]\s]*')
+
+
+class JsonArrayStream:
+    """
+    Инкрементальный разбор элементов JSON-массива из потока байтов.
+
+    key=None — массив на верхнем уровне ответа (fullstats), иначе — массив
+    по ключу key (например 'products' в ответе воронки). Элемент, целиком
+    лежащий в куске, декодируется сразу; растянутый на много кусков копится
+    частями, границу ищем по скобкам вне строк, просматривая каждый кусок
+    один раз, и декодируем его один раз — на закрывающей скобке.
+    """
+
+    def __init__(self, key=None):
+        self._decoder = codecs.getincrementaldecoder('utf-8')()
+        self._json = json.JSONDecoder()
+        start = re.compile(r'"%s"\s*:\s*\[' % re.escape(key)) if key else re.compile(r'\s*\[')
+        self._find_start = start.search if key else start.match
+        # До начала массива — всё прочитанное, потом — непросмотренный хвост
+        # (оборванная строка или скаляр), который дочитывается со следующим куском
+        self._buffer = ''
+        self._in_array = False
+        # Уже просмотренные части текущего элемента и глубина скобок в нём
+        self._parts = []
+        self._depth = 0
+        self.done = False
+        self.count = 0
+
+    def feed(self, chunk):
+        """Добавляет байты ответа и возвращает элементы, которые удалось дочитать."""
+        if self.done:
+            return []
+        text = self._buffer + self._decoder.decode(chunk)
+        self._buffer = ''
+        if not self._in_array:
+            match = self._find_start(text)
+            if match is None:
+                self._buffer = text
+                return []
+            text = text[match.end():]
+            self._in_array = True
+
+        items = []
+        pos = 0
+        while True:
+            if not self._depth:
+                # Между элементами: пропускаем разделители
+                while pos < len(text) and (text[pos] in _WHITESPACE or text[pos] == ','):
+                    pos += 1
+                if pos == len(text):
+                    break
+                if text[pos] == ']':
+                    self.done = True
+                    break
+                if text[pos] not in '[{':
+                    match = _SCALAR.match(text, pos)
+                    if match is None or match.end() == len(text):
+                        # Скаляр может продолжиться в следующем куске
+                        self._buffer = text[pos:]
+                        break
+                    items.append(json.loads(match.group()))
+                    pos = match.end()
+                    continue
+                try:
+                    # Элемент целиком в этом куске — обычный случай, декодер на C
+                    item, pos = self._json.raw_decode(text, pos)
+                    items.append(item)
+                    continue
+                except json.JSONDecodeError:
+                    pass
+            pos = self._scan(text, pos, items)
+            if pos is None:
+                break
+        self.count += len(items)
+        return items
+
+    def _scan(self, text, start, items):
+        """
+        Просматривает элемент от start (с его открывающей скобки или продолжения).
+
+        Возвращает позицию после закрытого элемента или None, если текст кончился раньше.
+        """
+        for match in _TOKEN.finditer(text, start):
+            token = match.group()
+            if token[0] == '"':
+                if match.group(1) is None:
+                    # Строка оборвана на границе куска: дочитаем её со следующим
+                    self._parts.append(text[start:match.start()])
+                    self._buffer = text[match.start():]
+                    return None
+                continue
+            self._depth += 1 if token in '[{' else -1
+            if not self._depth:
+                self._parts.append(text[start:match.end()])
+                items.append(json.loads(''.join(self._parts)))
+                self._parts = []
+                return match.end()
+        self._parts.append(text[start:])
+        return None
+
+    def close(self):
+        """
+        Проверяет, что начатый массив дочитан до конца, иначе ответ оборван.
+
+        Если массив так и не встретился (null вместо списка), элементов просто нет.
+        """
+        if self._in_array and not self.done:
+            raise ValueError(f"Ответ оборван: массив не закрыт после {self.count} элементов")
+
+
+async def iter_array(response, key=None, recorder=None, chunk_size=CHUNK_SIZE):
+    """
+    Асинхронно отдаёт элементы массива из тела aiohttp-ответа пачками по мере чтения.
+
+    recorder — ResponseRecorder из wb_core.raw_store: сырые байты
+    сохраняются по пути, без второго буфера на весь ответ.
+    """
+    parser = JsonArrayStream(key)
+    async for chunk in response.content.iter_chunked(chunk_size):
+        if recorder is not None:
+            recorder.write(chunk)
+        items = parser.feed(chunk)
+        if items:
+            yield items
+    parser.close()
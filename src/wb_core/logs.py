@@ -0,0 +1,150 @@
+import os
+import json
+import atexit
+import logging
+import threading
+import multiprocessing
+import logging.handlers
+from collections import Counter
+
+# Общий слой логирования. Записи уходят в очередь (QueueHandler), в stderr их
+# пишет отдельный поток QueueListener — горячий путь не ждёт вывода. Очередь
+# multiprocessing: дочерние процессы пулов разбора, созданные fork, пишут в неё же.
+# Повторяющиеся состояния (кампания без boosterStats) не логируются построчно,
+# а считаются count() и выводятся одной строкой в flush_counters(); счётчики
+# задачи в процессе пула возвращаются вместе с её результатом (in_worker) и
+# прибавляются к счётчикам основного процесса до flush_counters (merge_counters).
+# События на каждый запрос проходят через sample().
+# WB_LOG_LEVEL — уровень (INFO), WB_LOG_FORMAT=json — JSON-строки вместо текста,
+# WB_LOG_SAMPLE — из скольких однотипных событий логируется одно (после первых SAMPLE_FIRST)
+LOG_LEVEL = os.getenv('WB_LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('WB_LOG_FORMAT', 'text')
+SAMPLE_EVERY = int(os.getenv('WB_LOG_SAMPLE', 100))
+SAMPLE_FIRST = 3
+_listener = None
+_handler = None
+_owner_pid = None
+_counters = Counter()
+_samples = Counter()
+_lock = threading.Lock()
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна JSON-строка; поля из extra={'fields': {...}} попадают в неё как есть."""
+
+    def format(self, record):
+        data = {
+            'ts': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'process': record.processName,
+            'msg': record.getMessage(),
+        }
+        data.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+def setup_logging(level=None, fmt=None):
+    """
+    Настраивает корневой логгер: очередь + поток вывода. Повторный вызов ничего не делает.
+
+    Вызывается в точке входа (wb, daemon/main.py) до создания пулов процессов;
+    в отдельном процессе (воркер очереди) — заново, со своей очередью,
+    и тогда в конце процесса нужен явный stop_logging().
+    """
+    global _listener, _handler, _owner_pid
+    if _listener is not None and _owner_pid == os.getpid():
+        return
+    _handler = logging.StreamHandler()
+    if (fmt or LOG_FORMAT) == 'json':
+        _handler.setFormatter(JsonFormatter())
+    else:
+        _handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s [%(processName)s] %(name)s: %(message)s', '%H:%M:%S'))
+    queue = multiprocessing.Queue(-1)
+    root = logging.getLogger()
+    root.handlers[:] = [logging.handlers.QueueHandler(queue)]
+    root.setLevel(level or LOG_LEVEL)
+    _listener = logging.handlers.QueueListener(queue, _handler, respect_handler_level=True)
+    _listener.start()
+    _owner_pid = os.getpid()
+    atexit.register(stop_logging)
+
+
+def stop_logging():
+    """Дописывает очередь до конца и выводит накопленные счётчики."""
+    global _listener
+    if _listener is None or _owner_pid != os.getpid():
+        return
+    _listener.stop()
+    _listener = None
+    # Дальше — без очереди, напрямую в поток вывода
+    logging.getLogger().handlers[:] = [_handler]
+    flush_counters()
+
+
+def count(event, n=1):
+    """Учитывает повторяющееся состояние без записи в лог; выводится в flush_counters()."""
+    with _lock:
+        _counters[event] += n
+
+
+def flush_counters(logger=None, **fields):
+    """
+    Одна строка со всеми накопленными счётчиками процесса, счётчики обнуляются.
+
+    Вызывается в основном процессе в конце этапа; задачи пула запускаются
+    через in_worker(), и их счётчики к этому моменту уже прибавлены merge_counters().
+    """
+    with _lock:
+        counters = dict(_counters)
+        _counters.clear()
+    if counters:
+        summary = ', '.join(f"{event}: {n}" for event, n in sorted(counters.items()))
+        (logger or logging.getLogger('wb')).info(f"📊 {summary}", extra={'fields': {'counters': counters, **fields}})
+    return counters
+
+
+def _in_pool():
+    return _owner_pid is not None and _owner_pid != os.getpid()
+
+
+def in_worker(func, *args):
+    """
+    Запускает func(*args) в процессе пула и возвращает (результат, счётчики задачи).
+
+    Счётчики едут обратно вместе с результатом, а не через очередь логов:
+    так они гарантированно у основного процесса к его flush_counters().
+    В основном процессе (и без setup_logging) счётчики остаются на месте.
+    """
+    if not _in_pool():
+        return func(*args), {}
+    with _lock:
+        # Унаследованное при fork от основного процесса — не наше
+        _counters.clear()
+    result = func(*args)
+    with _lock:
+        counters = dict(_counters)
+        _counters.clear()
+    return result, counters
+
+
+def merge_counters(outcome):
+    """Результат in_worker в основном процессе: счётчики задачи прибавляются к своим, возвращается результат."""
+    result, counters = outcome
+    for event, n in counters.items():
+        count(event, n)
+    return result
+
+
+def sample(event):
+    """
+    Нужно ли логировать очередное событие event: первые SAMPLE_FIRST, затем каждое SAMPLE_EVERY-е.
+
+    Возвращает порядковый номер события или 0, если его пропускаем.
+    """
+    with _lock:
+        _samples[event] += 1
+        seen = _samples[event]
+    return seen if seen <= SAMPLE_FIRST or seen % SAMPLE_EVERY == 0 else 0
@@ -0,0 +1,185 @@
+import os
+import heapq
+import logging
+from functools import lru_cache
+
+from wb_core.raw_store import RAW_DIR, iter_day
+from wb_core.utils import batchify
+
+# Модель лимитов, по которой оценивается длительность выгрузки.
+# fullstats: до 100 ID в запросе, после каждого батча adv_stat_async спит минуту
+# (лимит WB — 1 запрос в минуту на токен), одновременно идут не больше 10 задач
+FULLSTATS_IDS_PER_REQUEST = 100
+FULLSTATS_INTERVAL = 60
+FULLSTATS_CONCURRENCY = 10
+# sales-funnel v3: страница до 1000 товаров, между страницами 2 секунды,
+# но WB пропускает не больше FUNNEL_REQUESTS_PER_MINUTE запросов на токен
+FUNNEL_PAGE_SIZE = 1000
+FUNNEL_INTERVAL = 2
+FUNNEL_REQUESTS_PER_MINUTE = int(os.getenv('WB_FUNNEL_REQUESTS_PER_MINUTE', 3))
+# Среднее время ответа API, секунд
+REQUEST_LATENCY = float(os.getenv('WB_REQUEST_LATENCY', 3))
+
+
+def pack_ids(campaign_ids, size=FULLSTATS_IDS_PER_REQUEST):
+    """Раскладывает ID кампаний по запросам: без дублей, по size штук, последний батч — остаток."""
+    return list(batchify(sorted(set(campaign_ids)), size))
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours} ч {minutes:02d} мин" if hours else f"{minutes} мин {seconds:02d} с"
+
+
+def fullstats_unit(account, day, campaign_ids):
+    """Единица плана fullstats: кабинет за день и его батчи ID."""
+    return {'dataset': 'advert', 'account': account, 'day': day, 'batches': pack_ids(campaign_ids)}
+
+
+def funnel_unit(account, day, pages=1):
+    return {'dataset': 'funnel', 'account': account, 'day': day, 'pages': max(1, pages)}
+
+
+def estimate_fullstats(units):
+    """
+    Оценка времени выгрузки fullstats, секунд.
+
+    Берём максимум из двух ограничений: задачи (кабинет, день) занимают
+    FULLSTATS_CONCURRENCY слотов в порядке плана, а запросы одного токена
+    не чаще раза в FULLSTATS_INTERVAL — лишние получат 429 и будут ждать.
+    """
+    slots = [0.0] * min(FULLSTATS_CONCURRENCY, len(units) or 1)
+    makespan = 0.0
+    per_token = {}
+    for unit in units:
+        duration = len(unit['batches']) * (REQUEST_LATENCY + FULLSTATS_INTERVAL)
+        finish = heapq.heappop(slots) + duration
+        heapq.heappush(slots, finish)
+        makespan = max(makespan, finish)
+        per_token[unit['account']] = per_token.get(unit['account'], 0) + len(unit['batches'])
+    token_bound = max(per_token.values(), default=0) * FULLSTATS_INTERVAL
+    return max(makespan, token_bound)
+
+
+def estimate_funnel(units):
+    """Оценка времени выгрузки воронки, секунд: токены идут параллельно, страницы токена — по лимиту."""
+    pace = max(REQUEST_LATENCY + FUNNEL_INTERVAL, 60 / FUNNEL_REQUESTS_PER_MINUTE)
+    per_token = {}
+    for unit in units:
+        per_token[unit['account']] = per_token.get(unit['account'], 0) + unit['pages']
+    return max(per_token.values(), default=0) * pace
+
+
+ESTIMATORS = {'advert': estimate_fullstats, 'funnel': estimate_funnel}
+
+
+def requests_count(unit):
+    return len(unit['batches']) if unit['dataset'] == 'advert' else unit['pages']
+
+
+def estimate(units):
+    """Число запросов и оценка времени по датасетам: {датасет: (запросов, секунд)}."""
+    result = {}
+    for dataset, estimator in ESTIMATORS.items():
+        dataset_units = [unit for unit in units if unit['dataset'] == dataset]
+        if dataset_units:
+            result[dataset] = (sum(requests_count(unit) for unit in dataset_units), estimator(dataset_units))
+    return result
+
+
+def fit_deadline(units, deadline_sec):
+    """
+    Урезает план под дедлайн: дни берутся от самых свежих к старым
+    целиком (все кабинеты дня), пока оценка укладывается в deadline_sec.
+
+    Датасеты выгружаются параллельно, поэтому ограничивается самый долгий из них.
+    Самый свежий день остаётся в плане, даже если один не влезает.
+    Возвращает (оставленные единицы, отброшенные дни).
+    """
+    days = sorted({unit['day'] for unit in units}, reverse=True)
+    kept = []
+    for i, day in enumerate(days):
+        candidate = kept + [unit for unit in units if unit['day'] == day]
+        if kept and max(seconds for _, seconds in estimate(candidate).values()) > deadline_sec:
+            return kept, days[i:]
+        kept = candidate
+    return kept, []
+
+
+@lru_cache(maxsize=None)
+def _day_pages(raw_dir, day, mtime, size):
+    """
+    {кабинет: страниц в самой длинной выгрузке} по одному дню сырых ответов воронки.
+
+    Файл распаковывается один раз на процесс и версию (mtime, size), а не на каждый кабинет и день плана.
+    """
+    fetches = {}
+    for meta, _ in iter_day('funnel', day, raw_dir):
+        key = (meta['account'], meta['fetch_id'])
+        fetches[key] = fetches.get(key, 0) + 1
+    pages = {}
+    for (account, _), count in fetches.items():
+        pages[account] = max(pages.get(account, 0), count)
+    return pages
+
+
+def funnel_pages_hint(account, raw_dir=RAW_DIR):
+    """Сколько страниц воронки было у кабинета в последней сохранённой выгрузке (1, если неизвестно)."""
+    funnel_dir = os.path.join(raw_dir, 'funnel')
+    if not os.path.isdir(funnel_dir):
+        return 1
+    for name in sorted(os.listdir(funnel_dir), reverse=True):
+        if not name.endswith('.jsonl.gz'):
+            continue
+        stat = os.stat(os.path.join(funnel_dir, name))
+        pages = _day_pages(raw_dir, name[:10], stat.st_mtime, stat.st_size)
+        if account in pages:
+            return pages[account]
+    return 1
+
+
+def print_plan(units, dropped_days=()):
+    lines = [f"{'Датасет':<10}{'Кабинет':<24}{'дней':>6}{'запросов':>10}"]
+    summary = {}
+    for unit in units:
+        key = (unit['dataset'], unit['account'])
+        days, count = summary.get(key, (0, 0))
+        summary[key] = (days + 1, count + requests_count(unit))
+    for (dataset, account), (days, count) in sorted(summary.items()):
+        lines.append(f"{dataset:<10}{account:<24}{days:>6}{count:>10}")
+    for dataset, (count, seconds) in estimate(units).items():
+        lines.append(f"⏱ {dataset}: {count} запросов, ~{format_duration(seconds)}")
+    if dropped_days:
+        lines.append(f"✂️ Не влезли в дедлайн: {', '.join(sorted(dropped_days))}")
+    print('\n'.join(lines))
+
+
+def build_plan(days, datasets=('advert', 'funnel'), prune=True, tokens=None):
+    """
+    План выгрузки по каталогу кампаний и кабинетам за дни days (ГГГГ-ММ-ДД).
+
+    Каталог кампаний запрашивается у API (дёшево, без fullstats);
+    prune=True — с отсевом неактивных кампаний, как в get_all_adv_data.
+    """
+    import time
+    from wb_core.config import load_api_tokens
+
+    tokens = tokens or load_api_tokens() or {}
+    units = []
+    for account, api_token in tokens.items():
+        if 'advert' in datasets:
+            from advert.utils_advert import get_campaigns
+            from advert.utils_pruning import load_history, plan_requests
+
+            campaigns = get_campaigns(api_token, account)
+            if prune:
+                plan = plan_requests(account, api_token, campaigns, time.time(), days, load_history())
+            else:
+                plan = {day: list(campaigns) for day in days}
+            units += [fullstats_unit(account, day, plan[day]) for day in days]
+        if 'funnel' in datasets:
+            pages = funnel_pages_hint(account)
+            units += [funnel_unit(account, day, pages) for day in days]
+    logging.info(f"🗺 План: {len(units)} задач по {len(tokens)} кабинетам за {len(days)} дней")
+    return units
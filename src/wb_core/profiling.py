@@ -0,0 +1,150 @@
+import os
+import io
+import time
+import atexit
+import logging
+import contextlib
+from datetime import datetime
+
+# WB_PROFILE=1 — время (wall/CPU) по этапам; через запятую можно добавить
+# cprofile (горячие функции) и tracemalloc (пик памяти и места аллокаций),
+# например WB_PROFILE=1,cprofile,tracemalloc
+PROFILE_DIR = os.getenv('WB_PROFILE_DIR', 'profiles')
+TOP_N = 15
+
+_options = set()
+_stats = {}
+_active_profiler = None
+# Пик памяти, набранный каждым открытым этапом до того, как вложенный этап сбросил счётчик tracemalloc
+_peak_carry = []
+
+
+def enable_profiling(options=('time',)):
+    """Включает профилирование; вызывается из CLI (--profile) или по WB_PROFILE."""
+    global _options
+    if _options:
+        _options.update(options)
+        return
+    _options = {'time', *options}
+    if 'tracemalloc' in _options:
+        import tracemalloc
+        tracemalloc.start(10)
+    atexit.register(write_report)
+
+
+def profile_inline():
+    """
+    Нужно ли разбирать ответы в текущем процессе, а не в пуле: этапы
+    decode/flatten в дочерних процессах не попали бы в отчёт (ни время,
+    ни cProfile, ни tracemalloc).
+    """
+    return bool(_options)
+
+
+def _parse_env(value):
+    options = {item.strip().lower() for item in value.split(',') if item.strip()}
+    options.discard('1')
+    return options
+
+
+class StageStats:
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak_memory = 0
+        self.profiles = []
+        self.snapshot = None
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Замеряет именованный этап: wall/CPU время, при включённых опциях —
+    cProfile и пик памяти tracemalloc. Без профилирования почти бесплатен.
+    """
+    global _active_profiler
+    if not _options:
+        yield
+        return
+
+    stats = _stats.setdefault(name, StageStats())
+    profiler = None
+    # cProfile не вкладывается: профиль пишет самый внешний активный этап
+    if 'cprofile' in _options and _active_profiler is None:
+        import cProfile
+        profiler = _active_profiler = cProfile.Profile()
+        profiler.enable()
+    if 'tracemalloc' in _options:
+        import tracemalloc
+        # reset_peak общий на процесс: пик внешнего этапа до сброса сохраняем
+        if _peak_carry:
+            _peak_carry[-1] = max(_peak_carry[-1], tracemalloc.get_traced_memory()[1])
+        _peak_carry.append(0)
+        tracemalloc.reset_peak()
+
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        stats.calls += 1
+        stats.wall += time.perf_counter() - wall
+        stats.cpu += time.process_time() - cpu
+        if profiler is not None:
+            profiler.disable()
+            _active_profiler = None
+            stats.profiles.append(profiler)
+        if 'tracemalloc' in _options and _peak_carry:
+            import tracemalloc
+            peak = max(_peak_carry.pop(), tracemalloc.get_traced_memory()[1])
+            stats.peak_memory = max(stats.peak_memory, peak)
+            if _peak_carry:
+                _peak_carry[-1] = max(_peak_carry[-1], peak)
+            else:
+                # Снимок дорогой и сам искажает замер: только на выходе из внешнего этапа
+                stats.snapshot = tracemalloc.take_snapshot()
+
+
+def _format_profile(profiles):
+    import pstats
+    out = io.StringIO()
+    pstats.Stats(*profiles, stream=out).sort_stats('cumulative').print_stats(TOP_N)
+    return out.getvalue()
+
+
+def _format_snapshot(snapshot):
+    lines = []
+    for stat in snapshot.statistics('lineno')[:TOP_N]:
+        frame = stat.traceback[0]
+        lines.append(f"    {stat.size / 1024 / 1024:8.2f} MiB  {stat.count:>8} блоков  {frame.filename}:{frame.lineno}")
+    return '\n'.join(lines)
+
+
+def format_report():
+    lines = [f"{'Этап':<32}{'вызовов':>8}{'wall, с':>10}{'CPU, с':>10}{'пик, MiB':>10}"]
+    for name, stats in sorted(_stats.items(), key=lambda item: -item[1].wall):
+        peak = f"{stats.peak_memory / 1024 / 1024:.1f}" if stats.peak_memory else '-'
+        lines.append(f"{name:<32}{stats.calls:>8}{stats.wall:>10.2f}{stats.cpu:>10.2f}{peak:>10}")
+    for name, stats in _stats.items():
+        if stats.profiles:
+            lines += ['', f"=== {name}: горячие функции (cProfile) ===", _format_profile(stats.profiles)]
+        if stats.snapshot is not None:
+            lines += ['', f"=== {name}: крупнейшие аллокации (tracemalloc) ===", _format_snapshot(stats.snapshot)]
+    return '\n'.join(lines)
+
+
+def write_report():
+    """Пишет отчёт за запуск в PROFILE_DIR/run_<время>_<pid>.txt."""
+    if not _stats:
+        return None
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"run_{datetime.now():%Y%m%d_%H%M%S}_{os.getpid()}.txt")
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(format_report())
+    logging.info(f"📊 Отчёт профилирования: {path}")
+    _stats.clear()
+    return path
+
+
+if os.getenv('WB_PROFILE'):
+    enable_profiling(_parse_env(os.environ['WB_PROFILE']))
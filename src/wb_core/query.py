@@ -0,0 +1,329 @@
+import os
+import json
+import time
+import shutil
+import logging
+from datetime import date
+
+from wb_core.utils import parse_dates
+
+# Локальное колоночное хранилище для быстрых выборок по артикулу, кампании
+# и кабинету. Каждая колонка — отдельный .npy, читается через memory map:
+# выборка трогает только страницы нужных строк, а не весь файл.
+# Строки хранятся словарём (коды int32 + vocab.json), даты — днями от 1970-01-01.
+STORE_DIR = os.getenv('WB_QUERY_DIR', 'store')
+
+# Для каждой таблицы: колонки артикула, кампании и даты (None — нет) и натуральный ключ строки
+TABLES = {
+    'advert': {'nm_id': 'article_id', 'advert_id': 'advertId', 'date': 'date', 'key': ['date', 'account', 'advertId']},
+    'advert_spend': {'nm_id': None, 'advert_id': 'advertId', 'date': 'updTime', 'key': ['updTime', 'account', 'advertId', 'updNum']},
+    'funnel': {'nm_id': 'nm_id', 'advert_id': None, 'date': 'date', 'key': ['date', 'account', 'nm_id']},
+    'content': {'nm_id': 'nmID', 'advert_id': None, 'date': None, 'key': ['account', 'nmID']},
+}
+# Индексы: (ключ, дата), строки отсортированы по ключу, внутри ключа — по дате
+INDEXES = ('nm_id', 'advert_id', 'account')
+
+KEY_NA = -1
+DATE_NA = -2 ** 31
+_EPOCH = date(1970, 1, 1).toordinal()
+
+
+def date_to_days(value):
+    return date.fromisoformat(str(value)[:10]).toordinal() - _EPOCH
+
+
+def days_to_date(days):
+    return None if days == DATE_NA else date.fromordinal(int(days) + _EPOCH).isoformat()
+
+
+def _encode_column(series, kind):
+    """Колонка DataFrame -> (numpy-массив, словарь строк или None)."""
+    import numpy as np
+    import pandas as pd
+
+    if kind == 'date':
+        parsed = parse_dates(series)
+        days = (parsed - pd.Timestamp('1970-01-01')).dt.days
+        return days.fillna(DATE_NA).astype(np.int32).to_numpy(), None
+    if kind == 'int':
+        return pd.to_numeric(series, errors='coerce').fillna(KEY_NA).astype(np.int64).to_numpy(), None
+    if kind == 'float':
+        return pd.to_numeric(series, errors='coerce').astype(np.float64).to_numpy(), None
+    codes, vocab = pd.factorize(series.fillna('').astype(str))
+    return codes.astype(np.int32), list(vocab)
+
+
+def _column_kind(name, series, spec):
+    import pandas as pd
+
+    if name == spec['date']:
+        return 'date'
+    if name in (spec['nm_id'], spec['advert_id']):
+        return 'int'
+    if pd.api.types.is_bool_dtype(series):
+        return 'str'
+    if pd.api.types.is_integer_dtype(series):
+        return 'int'
+    if pd.api.types.is_float_dtype(series):
+        return 'float'
+    # Значения из листов приходят строками: числовая колонка та, что целиком приводится к числу
+    numeric = pd.to_numeric(series.replace('', None), errors='coerce')
+    if numeric.notna().sum() and numeric.notna().sum() == series.replace('', None).notna().sum():
+        return 'float'
+    return 'str'
+
+
+def write_table(df, table, store_dir=STORE_DIR):
+    """
+    Записывает таблицу целиком: колонки, словари строк и индексы.
+
+    Пишется во временный каталог, который затем подменяет старый —
+    читатели видят либо старую, либо новую версию.
+    """
+    import numpy as np
+
+    spec = TABLES[table]
+    path = os.path.join(store_dir, table)
+    tmp_path = f"{path}.tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    kinds, vocabs, arrays = {}, {}, {}
+    for name in df.columns:
+        kinds[name] = _column_kind(name, df[name], spec)
+        arrays[name], vocab = _encode_column(df[name], kinds[name])
+        if vocab is not None:
+            vocabs[name] = vocab
+        np.save(os.path.join(tmp_path, f"col_{name}.npy"), arrays[name])
+
+    dates = arrays[spec['date']] if spec['date'] else np.zeros(len(df), dtype=np.int32)
+    for index in INDEXES:
+        column = 'account' if index == 'account' else spec[index]
+        if column is None or column not in arrays:
+            continue
+        keys = arrays[column].astype(np.int64)
+        rows = np.lexsort((dates, keys))
+        np.save(os.path.join(tmp_path, f"idx_{index}_key.npy"), keys[rows])
+        np.save(os.path.join(tmp_path, f"idx_{index}_date.npy"), dates[rows])
+        np.save(os.path.join(tmp_path, f"idx_{index}_rows.npy"), rows.astype(np.int64))
+
+    with open(os.path.join(tmp_path, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump({'rows': len(df), 'columns': kinds, 'built_at': time.strftime("%Y-%m-%d %H:%M:%S")}, f, ensure_ascii=False)
+    with open(os.path.join(tmp_path, 'vocab.json'), 'w', encoding='utf-8') as f:
+        json.dump(vocabs, f, ensure_ascii=False)
+
+    old_path = f"{path}.old"
+    shutil.rmtree(old_path, ignore_errors=True)
+    if os.path.isdir(path):
+        os.replace(path, old_path)
+    os.replace(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    _tables.pop((store_dir, table), None)
+
+
+class Table:
+    """Открытая на чтение таблица хранилища: колонки и индексы через memory map."""
+
+    def __init__(self, table, store_dir=STORE_DIR):
+        import numpy as np
+
+        self.name = table
+        self.spec = TABLES[table]
+        self.path = os.path.join(store_dir, table)
+        with open(os.path.join(self.path, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        with open(os.path.join(self.path, 'vocab.json'), 'r', encoding='utf-8') as f:
+            self.vocabs = json.load(f)
+        self.vocab_codes = {name: {value: code for code, value in enumerate(vocab)} for name, vocab in self.vocabs.items()}
+        self.columns = {name: np.load(os.path.join(self.path, f"col_{name}.npy"), mmap_mode='r') for name in self.meta['columns']}
+        self.indexes = {}
+        for index in INDEXES:
+            key_path = os.path.join(self.path, f"idx_{index}_key.npy")
+            if os.path.isfile(key_path):
+                self.indexes[index] = tuple(
+                    np.load(os.path.join(self.path, f"idx_{index}_{part}.npy"), mmap_mode='r') for part in ('key', 'date', 'rows')
+                )
+
+    def _key_code(self, index, value):
+        if index == 'account':
+            return self.vocab_codes.get('account', {}).get(str(value))
+        return int(value)
+
+    def _lookup(self, index, value, date_from, date_to):
+        """Номера строк по индексу: бинарный поиск ключа, затем диапазона дат внутри ключа."""
+        import numpy as np
+
+        keys, dates, rows = self.indexes[index]
+        code = self._key_code(index, value)
+        if code is None:
+            return np.empty(0, dtype=np.int64)
+        if self.spec['date'] is None:
+            # Срез без дат (карточки): период не применяется
+            date_from = date_to = None
+        lo, hi = np.searchsorted(keys, code, 'left'), np.searchsorted(keys, code, 'right')
+        key_dates = dates[lo:hi]
+        start = lo + (np.searchsorted(key_dates, date_to_days(date_from), 'left') if date_from else 0)
+        end = lo + (np.searchsorted(key_dates, date_to_days(date_to), 'right') if date_to else hi - lo)
+        return np.asarray(rows[start:end])
+
+    def select(self, nm_id=None, advert_id=None, account=None, date_from=None, date_to=None, columns=None):
+        """
+        Строки по артикулу, кампании и/или кабинету за период (даты включительно).
+
+        Для поиска берётся самый избирательный из заданных индексов,
+        остальные условия проверяются на найденных строках.
+        Возвращает список словарей в порядке возрастания даты.
+        """
+        import numpy as np
+
+        filters = {'nm_id': nm_id, 'advert_id': advert_id, 'account': account}
+        filters = {index: value for index, value in filters.items() if value is not None}
+        usable = [index for index in INDEXES if index in filters and index in self.indexes]
+        if not usable:
+            raise ValueError(f"Для таблицы {self.name} нужен хотя бы один из фильтров: {', '.join(self.indexes)}")
+        rows = self._lookup(usable[0], filters[usable[0]], date_from, date_to)
+        for index in usable[1:]:
+            column = 'account' if index == 'account' else self.spec[index]
+            code = self._key_code(index, filters[index])
+            rows = rows[np.asarray(self.columns[column][rows]) == code] if code is not None else rows[:0]
+
+        names = columns or list(self.columns)
+        decoded = {name: self._decode(name, np.asarray(self.columns[name][rows])) for name in names}
+        return [dict(zip(names, values)) for values in zip(*(decoded[name] for name in names))]
+
+    def _decode(self, name, values):
+        kind = self.meta['columns'][name]
+        if kind == 'str':
+            vocab = self.vocabs[name]
+            return [vocab[code] for code in values]
+        if kind == 'date':
+            return [days_to_date(value) for value in values]
+        if kind == 'int':
+            return [None if value == KEY_NA else int(value) for value in values]
+        return [None if value != value else float(value) for value in values]
+
+    def to_frame(self):
+        import pandas as pd
+
+        return pd.DataFrame({name: self._decode(name, self.columns[name]) for name in self.columns})
+
+
+_tables = {}
+
+
+def open_table(table, store_dir=STORE_DIR):
+    """Таблица хранилища; открытые memory map переиспользуются между запросами."""
+    key = (store_dir, table)
+    current = _tables.get(key)
+    meta_path = os.path.join(store_dir, table, 'meta.json')
+    if not os.path.isfile(meta_path):
+        raise FileNotFoundError(f"Таблица {table} ещё не собрана в {store_dir}: wb query build")
+    # Таблицу пересобрали — переоткрываем
+    if current is None or os.path.getmtime(meta_path) != current[0]:
+        current = (os.path.getmtime(meta_path), Table(table, store_dir))
+        _tables[key] = current
+    return current[1]
+
+
+def _normalize_key(df, table):
+    """
+    Приводит колонки натурального ключа к одному виду: история из хранилища
+    приходит с датами ГГГГ-ММ-ДД и числовыми ID, листы — с ДД.ММ.ГГГГ и строками.
+    """
+    import pandas as pd
+
+    spec = TABLES[table]
+    key = [name for name in spec['key'] if name in df.columns]
+    for name in key:
+        if name == spec['date']:
+            df[name] = parse_dates(df[name]).dt.strftime('%Y-%m-%d')
+        elif name == 'account':
+            df[name] = df[name].astype(str)
+        else:
+            df[name] = pd.to_numeric(df[name], errors='coerce').astype('Int64')
+    return key
+
+
+def update_store(frames, store_dir=STORE_DIR):
+    """
+    Доливает таблицы в хранилище: новые строки заменяют старые с тем же
+    натуральным ключом, остальная история сохраняется.
+
+    frames — {таблица: DataFrame в колонках листа}.
+    """
+    import pandas as pd
+
+    for table, df in frames.items():
+        if table not in TABLES or df is None or df.empty:
+            continue
+        if os.path.isfile(os.path.join(store_dir, table, 'meta.json')):
+            df = pd.concat([open_table(table, store_dir).to_frame(), df], ignore_index=True)
+            key = _normalize_key(df, table)
+            df = df.drop_duplicates(key, keep='last') if key else df
+        write_table(df.reset_index(drop=True), table, store_dir)
+        logging.info(f"🗄 {table}: {len(df)} строк в хранилище {store_dir}")
+
+
+def load_sources(source, date_from=None, date_to=None):
+    """Таблицы для хранилища: из сохранённых сырых ответов (raw) или из листов Google Таблицы (sheets)."""
+    if source == 'raw':
+        from wb_core.reprocess import replay
+        return replay(date_from, date_to)
+    from facts.utils_facts import load_fact_sources
+    from wb_core.config import SPREADSHEET_TITLE
+    from wb_core.sheets import safe_open_spreadsheet
+
+    adv, spend, funnel, content = load_fact_sources(safe_open_spreadsheet(SPREADSHEET_TITLE))
+    return {'advert': adv, 'advert_spend': spend, 'funnel': funnel, 'content': content}
+
+
+def serve(host='127.0.0.1', port=8766, store_dir=STORE_DIR):
+    """
+    HTTP-доступ к хранилищу:
+    GET /query?table=advert&nm_id=...&advert_id=...&account=...&from=ГГГГ-ММ-ДД&to=...&columns=a,b
+    GET /tables — состав хранилища.
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import urlsplit, parse_qs
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlsplit(self.path)
+            params = {name: values[0] for name, values in parse_qs(url.query).items()}
+            try:
+                if url.path == '/tables':
+                    code, body = 200, {
+                        table: open_table(table, store_dir).meta
+                        for table in TABLES if os.path.isfile(os.path.join(store_dir, table, 'meta.json'))
+                    }
+                elif url.path == '/query':
+                    started = time.perf_counter()
+                    rows = open_table(params.get('table', 'advert'), store_dir).select(
+                        nm_id=params.get('nm_id'),
+                        advert_id=params.get('advert_id'),
+                        account=params.get('account'),
+                        date_from=params.get('from'),
+                        date_to=params.get('to'),
+                        columns=params['columns'].split(',') if params.get('columns') else None,
+                    )
+                    code, body = 200, {'count': len(rows), 'ms': round((time.perf_counter() - started) * 1000, 2), 'rows': rows}
+                else:
+                    code, body = 404, {'error': 'not found'}
+            except (KeyError, ValueError, FileNotFoundError) as e:
+                code, body = 400, {'error': str(e)}
+            payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            logging.debug(format % args)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    logging.info(f"🔎 Запросы к хранилищу: http://{host}:{port}/query?table=advert&nm_id=...")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
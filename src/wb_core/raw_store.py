@@ -0,0 +1,125 @@
+import os
+import gzip
+import json
+import zlib
+import uuid
+import logging
+from datetime import date, datetime, timedelta
+
+from wb_core.utils import state_lock
+
+# Сырые ответы WB складываются как есть в raw/<датасет>/<ГГГГ-ММ-ДД>.jsonl.gz,
+# чтобы после исправления преобразований пересобрать историю без запросов к API.
+# WB_RAW_STORE=0 отключает запись
+RAW_DIR = os.getenv('WB_RAW_DIR', 'raw')
+ENABLED = os.getenv('WB_RAW_STORE', '1') != '0'
+
+
+def new_fetch_id():
+    """Идентификатор одной выгрузки (все страницы/батчи кабинета за день)."""
+    return uuid.uuid4().hex
+
+
+def day_path(dataset, day, raw_dir=RAW_DIR):
+    return os.path.join(raw_dir, dataset, f"{day}.jsonl.gz")
+
+
+class ResponseRecorder:
+    """
+    Запись одного сырого ответа в хранилище по кускам, по мере чтения из сети.
+
+    Строка: метаданные JSON, табуляция, тело ответа. Переводы строк в теле
+    JSON допустимы только как пробельные символы, поэтому их можно выбросить.
+    Байты сразу сжимаются, в памяти держится только сжатый ответ. В close()
+    он дописывается в файл отдельным gzip member одним write под flock файла
+    дня (в него пишут и воркеры очереди в других процессах): недописанный
+    хвост после падения не портит предыдущие записи.
+    """
+
+    def __init__(self, dataset, day, account, fetch_id, raw_dir=RAW_DIR, **params):
+        self.path = day_path(dataset, day, raw_dir)
+        self.dataset, self.day = dataset, day
+        self._parts = []
+        self._compressor = None
+        if not ENABLED:
+            return
+        meta = {
+            'fetched_at': datetime.now().isoformat(timespec='milliseconds'),
+            'fetch_id': fetch_id,
+            'account': account,
+            'date': str(day),
+            **params,
+        }
+        # wbits=31 — формат gzip, совместимый с gzip.open при чтении
+        self._compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+        self._parts.append(self._compressor.compress(json.dumps(meta, ensure_ascii=False).encode('utf-8') + b'\t'))
+
+    def write(self, chunk):
+        if self._compressor is not None:
+            self._parts.append(self._compressor.compress(chunk.replace(b'\r', b'').replace(b'\n', b'')))
+
+    def close(self):
+        if self._compressor is None:
+            return
+        self._parts.append(self._compressor.compress(b'\n') + self._compressor.flush())
+        member, self._parts, self._compressor = b''.join(self._parts), [], None
+        try:
+            with state_lock(self.path):
+                with open(self.path, 'ab') as f:
+                    f.write(member)
+        except OSError as e:
+            # Хранилище — страховка, из-за него выгрузка падать не должна
+            logging.info(f"⚠️ Не удалось сохранить сырой ответ {self.dataset} за {self.day}: {e}")
+
+
+def save_response(dataset, day, account, fetch_id, raw, raw_dir=RAW_DIR, **params):
+    """Дописывает сырой ответ в хранилище целиком. Файлы только дополняются."""
+    if isinstance(raw, str):
+        raw = raw.encode('utf-8')
+    recorder = ResponseRecorder(dataset, day, account, fetch_id, raw_dir, **params)
+    recorder.write(raw)
+    recorder.close()
+
+
+def iter_day(dataset, day, raw_dir=RAW_DIR):
+    """Все записи дня: пары (метаданные, тело ответа в байтах)."""
+    path = day_path(dataset, day, raw_dir)
+    if not os.path.isfile(path):
+        return
+    with gzip.open(path, 'rb') as f:
+        try:
+            for line in f:
+                meta, _, body = line.rstrip(b'\n').partition(b'\t')
+                yield json.loads(meta), body
+        except (EOFError, gzip.BadGzipFile) as e:
+            logging.info(f"⚠️ Оборванная запись в {path}, читаем до неё: {e}")
+
+
+def latest_day(dataset, day, raw_dir=RAW_DIR):
+    """
+    Записи последней выгрузки каждого кабинета за день.
+
+    День мог выгружаться несколько раз (демон, --refresh-days): берём
+    все ответы той выгрузки кабинета, которая началась позже остальных.
+    """
+    fetches = {}
+    for meta, body in iter_day(dataset, day, raw_dir):
+        fetch = fetches.setdefault(meta['fetch_id'], {'account': meta['account'], 'started': meta['fetched_at'], 'records': []})
+        fetch['records'].append((meta, body))
+    latest = {}
+    for fetch in fetches.values():
+        current = latest.get(fetch['account'])
+        if current is None or fetch['started'] > current['started']:
+            latest[fetch['account']] = fetch
+    return [record for fetch in latest.values() for record in fetch['records']]
+
+
+def stored_days(dataset, date_from, date_to, raw_dir=RAW_DIR):
+    """Дни диапазона [date_from, date_to], за которые в хранилище есть ответы."""
+    day, last = date.fromisoformat(str(date_from)), date.fromisoformat(str(date_to))
+    days = []
+    while day <= last:
+        if os.path.isfile(day_path(dataset, day.isoformat(), raw_dir)):
+            days.append(day.isoformat())
+        day += timedelta(days=1)
+    return days
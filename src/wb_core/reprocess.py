@@ -0,0 +1,172 @@
+import os
+import json
+import logging
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+
+from wb_core.logs import in_worker, merge_counters
+from wb_core.profiling import stage, profile_inline
+from wb_core.raw_store import RAW_DIR, latest_day, stored_days
+
+# Офлайн-пересборка: сырые ответы из wb_core.raw_store прогоняются через
+# текущие преобразования пайплайнов, сеть не нужна
+DATASETS = ('advert', 'funnel', 'advert_spend', 'content')
+OUT_DIR = os.getenv('WB_REPROCESS_DIR', 'reprocess')
+
+
+def _replay_advert(day, raw_dir):
+    from advert.utils_advert import parse_fullstats_batch
+    return [parse_fullstats_batch(body, meta['account'], meta['date']) for meta, body in latest_day('advert', day, raw_dir)]
+
+
+def _replay_funnel(day, raw_dir):
+    from funnel.utils_funnel import parse_funnel_page
+    return [parse_funnel_page(body, meta['account'])[1] for meta, body in latest_day('funnel', day, raw_dir)]
+
+
+def _replay_advert_spend(day, raw_dir):
+    from advert_spend.utils_adv_spend import spend_frame
+    return [spend_frame(json.loads(body), meta['account'], meta['date']) for meta, body in latest_day('advert_spend', day, raw_dir)]
+
+
+def _replay_content(day, raw_dir):
+    from content.utils_content import cards_frame
+    return [cards_frame(json.loads(body), meta['account']) for meta, body in latest_day('content', day, raw_dir)]
+
+
+REPLAYERS = {
+    'advert': _replay_advert,
+    'funnel': _replay_funnel,
+    'advert_spend': _replay_advert_spend,
+    'content': _replay_content,
+}
+
+
+def _replay_task(task):
+    dataset, day, raw_dir = task
+    return dataset, day, in_worker(REPLAYERS[dataset], day, raw_dir)
+
+
+def _content_days(date_to, raw_dir):
+    """Карточки — срез, а не история: берём последний сохранённый срез не позже date_to."""
+    content_dir = os.path.join(raw_dir, 'content')
+    if not os.path.isdir(content_dir):
+        return []
+    days = sorted(name[:10] for name in os.listdir(content_dir) if name.endswith('.jsonl.gz') and name[:10] <= str(date_to))
+    return days[-1:]
+
+
+def replay(date_from, date_to, datasets=DATASETS, raw_dir=RAW_DIR, workers=None):
+    """
+    Прогоняет сохранённые ответы за [date_from, date_to] через текущие
+    преобразования. Дни разбираются параллельно на всех ядрах.
+
+    Возвращаемое значение:
+    dict: {датасет: DataFrame в колонках соответствующего листа}.
+    """
+    import pandas as pd
+    from wb_core.utils import columns_to_frame
+
+    tasks = []
+    for dataset in datasets:
+        days = _content_days(date_to, raw_dir) if dataset == 'content' else stored_days(dataset, date_from, date_to, raw_dir)
+        if not days:
+            logging.info(f"📭 Нет сохранённых ответов {dataset} за {date_from} — {date_to}")
+        tasks += [(dataset, day, raw_dir) for day in days]
+
+    parts = {dataset: [] for dataset in datasets}
+    with stage('reprocess.replay'):
+        with nullcontext() if profile_inline() else ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            for dataset, day, outcome in (map if pool is None else pool.map)(_replay_task, tasks):
+                parts[dataset].extend(merge_counters(outcome))
+
+    frames = {}
+    with stage('reprocess.frame'):
+        if 'advert' in parts:
+            from advert.utils_advert import prepare_adv_frame
+            df = columns_to_frame(parts['advert'])
+            frames['advert'] = prepare_adv_frame(df) if not df.empty else df
+        if 'funnel' in parts:
+            frames['funnel'] = columns_to_frame(parts['funnel'])
+        if 'advert_spend' in parts:
+            from advert_spend.utils_adv_spend import postprocess_adv_spend
+            spend = [frame for frame in parts['advert_spend'] if len(frame)]
+            df = postprocess_adv_spend(pd.concat(spend, ignore_index=True), str(date_to)) if spend else pd.DataFrame()
+            if not df.empty:
+                df['updTime'] = df['updTime'].astype(str)
+            frames['advert_spend'] = df
+        if 'content' in parts:
+            from content.utils_content import prepare_content_frame
+            cards = [frame for frame in parts['content'] if len(frame)]
+            frames['content'] = prepare_content_frame(pd.concat(cards, ignore_index=True)) if cards else pd.DataFrame()
+    for dataset, df in frames.items():
+        logging.info(f"♻️ {dataset}: {len(df)} строк из сохранённых ответов")
+    return frames
+
+
+def build_facts(frames):
+    """Факт-таблица из пересобранных источников; недостающие источники — пустые листы."""
+    import pandas as pd
+    from facts.utils_facts import ADV_STAT_COLS, ADV_SPEND_COLS, FUNNEL_COLS, CONTENT_COLS, build_fact_table
+
+    def source(name, cols):
+        df = frames.get(name)
+        return df if df is not None and not df.empty else pd.DataFrame(columns=cols)
+
+    return build_fact_table(
+        source('advert', ADV_STAT_COLS),
+        source('advert_spend', ADV_SPEND_COLS),
+        source('funnel', FUNNEL_COLS),
+        source('content', CONTENT_COLS),
+    )
+
+
+def reprocess(date_from, date_to, datasets=DATASETS, raw_dir=RAW_DIR, out_dir=OUT_DIR, upload=False, workers=None):
+    """
+    Пересобирает все производные таблицы за период из сохранённых ответов.
+
+    Результат пишется в out_dir: листы БД_* в сжатые CSV и скользящие окна
+    в отдельный rolling.json (рабочее состояние демона не трогается).
+    upload=True дополнительно обновляет листы Google Таблицы по ключам —
+    единственный шаг, которому нужна сеть.
+    """
+    from facts.utils_facts import ADV_STAT_SHEET, ADV_SPEND_SHEET, FUNNEL_SHEET, CONTENT_SHEET, FACTS_SHEET, FACT_KEY
+    from facts.utils_rolling import update_rolling_store
+
+    frames = replay(date_from, date_to, datasets, raw_dir, workers)
+    if frames.get('advert') is not None or frames.get('funnel') is not None:
+        with stage('reprocess.facts'):
+            frames['facts'] = build_facts(frames)
+
+    sheets = {
+        'advert': (ADV_STAT_SHEET, ['date', 'account', 'advertId']),
+        'funnel': (FUNNEL_SHEET, ['date', 'account', 'nm_id']),
+        'advert_spend': (ADV_SPEND_SHEET, ['updTime', 'account', 'advertId', 'updNum']),
+        'content': (CONTENT_SHEET, ['account', 'nmID']),
+        'facts': (FACTS_SHEET, FACT_KEY),
+    }
+    os.makedirs(out_dir, exist_ok=True)
+    with stage('reprocess.write'):
+        for name, df in frames.items():
+            if df.empty:
+                continue
+            path = os.path.join(out_dir, f"{sheets[name][0]}_{date_from}_{date_to}.csv.gz")
+            df.to_csv(path, index=False)
+            print(f"💾 {sheets[name][0]}: {len(df)} строк -> {path}")
+
+        adv_df, funnel_df = frames.get('advert'), frames.get('funnel')
+        if (adv_df is not None and not adv_df.empty) or (funnel_df is not None and not funnel_df.empty):
+            update_rolling_store(adv_df, funnel_df, path=os.path.join(out_dir, 'rolling.json'))
+
+    if upload:
+        from wb_core.config import SPREADSHEET_TITLE
+        from wb_core.sheets import safe_open_spreadsheet, refresh_df_in_google
+
+        with stage('reprocess.upload'):
+            table = safe_open_spreadsheet(SPREADSHEET_TITLE)
+            for name, df in frames.items():
+                if not df.empty:
+                    title, key_cols = sheets[name]
+                    # В факт-таблице пропуски метрик — пустые ячейки, как в main_facts
+                    refresh_df_in_google(df.fillna('') if name == 'facts' else df, table.worksheet(title), key_cols)
+    return frames
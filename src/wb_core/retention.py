@@ -0,0 +1,180 @@
+import os
+import csv
+import gzip
+import logging
+from datetime import date, datetime, timedelta
+
+from wb_core.sheets import SheetWriteBatcher, write_limiter
+
+# Листы, которые только растут через append, и колонка даты в каждом из них
+RETENTION_SHEETS = {
+    "БД_Рекламная_статистика": "date",
+    "БД_Воронка": "date",
+}
+HOT_DAYS = 60
+ARCHIVE_DIR = os.getenv('WB_ARCHIVE_DIR', 'archive')
+
+
+def parse_sheet_date(value):
+    """Дата из ячейки: ГГГГ-ММ-ДД, ДД.ММ.ГГГГ или серийный номер дня Google Таблиц."""
+    if isinstance(value, (int, float)):
+        return date(1899, 12, 30) + timedelta(days=int(value))
+    value = str(value).strip()
+    for fmt, size in (("%Y-%m-%d", 10), ("%d.%m.%Y", 10)):
+        try:
+            return datetime.strptime(value[:size], fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def archive_title(title, month):
+    return f"{title}_архив_{month}"
+
+
+def _row_runs(row_numbers):
+    """Сворачивает номера строк в непрерывные диапазоны [start, end]."""
+    runs = []
+    for row_num in sorted(row_numbers):
+        if runs and runs[-1][1] == row_num - 1:
+            runs[-1][1] = row_num
+        else:
+            runs.append([row_num, row_num])
+    return runs
+
+
+def _cell_key(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return str(value)
+    return number if number == number else str(value)
+
+
+def _row_key(row, date_index):
+    """Строка для сравнения с архивом: числа и даты независимо от того, как их отдал источник."""
+    key = [_cell_key(value) for value in row]
+    if date_index < len(row):
+        key[date_index] = parse_sheet_date(row[date_index])
+    return tuple(key)
+
+
+def _not_archived(rows, archived, date_index):
+    """
+    Строки, которых ещё нет в архиве месяца.
+
+    Если прошлый запуск дописал архив, но не успел удалить строки с листа,
+    повторный запуск не задвоит их в архиве.
+    """
+    if not archived:
+        return rows
+    width = len(rows[0])
+    seen = {_row_key(row[:width] + [''] * (width - len(row)), date_index) for row in archived}
+    return [row for row in rows if _row_key(row, date_index) not in seen]
+
+
+def _archive_to_sheets(spreadsheet, title, header, cold_by_month, date_index):
+    existing = {ws.title for ws in spreadsheet.worksheets()}
+    present = [month for month in cold_by_month if archive_title(title, month) in existing]
+    if present:
+        # Уже заархивированное — одним чтением всех затронутых архивных листов
+        response = spreadsheet.values_batch_get(
+            ["'%s'" % archive_title(title, month).replace("'", "''") for month in present],
+            params={'valueRenderOption': 'UNFORMATTED_VALUE', 'dateTimeRenderOption': 'FORMATTED_STRING'},
+        )
+        for month, value_range in zip(present, response.get('valueRanges', [])):
+            cold_by_month[month] = _not_archived(cold_by_month[month], value_range.get('values', [])[1:], date_index)
+    missing = [archive_title(title, month) for month in cold_by_month if archive_title(title, month) not in existing]
+    if missing:
+        # Все недостающие архивные листы создаём одним batchUpdate
+        write_limiter.wait()
+        spreadsheet.batch_update({'requests': [
+            {'addSheet': {'properties': {'title': name, 'gridProperties': {'rowCount': 1, 'columnCount': len(header)}}}}
+            for name in missing
+        ]})
+    worksheets = {ws.title: ws for ws in spreadsheet.worksheets()}
+    batcher = SheetWriteBatcher()
+    for month, rows in cold_by_month.items():
+        if rows:
+            batcher.add_rows(worksheets[archive_title(title, month)], rows, header=header)
+    batcher.flush()
+
+
+def _archive_to_files(archive_dir, title, header, cold_by_month, date_index):
+    sheet_dir = os.path.join(archive_dir, title)
+    os.makedirs(sheet_dir, exist_ok=True)
+    for month, rows in cold_by_month.items():
+        path = os.path.join(sheet_dir, f"{month}.csv.gz")
+        is_new = not os.path.isfile(path)
+        if not is_new:
+            with gzip.open(path, 'rt', encoding='utf-8', newline='') as f:
+                rows = _not_archived(rows, list(csv.reader(f))[1:], date_index)
+            if not rows:
+                continue
+        # gzip в режиме дозаписи добавляет новый member, файл читается целиком как один поток
+        with gzip.open(path, 'at', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            if is_new:
+                writer.writerow(header)
+            writer.writerows(rows)
+
+
+def archive_cold_rows(sheet, date_col='date', hot_days=HOT_DAYS, mode='sheet', archive_dir=ARCHIVE_DIR):
+    """
+    Оставляет на листе только последние hot_days дней, старые строки уносит в архив.
+
+    mode='sheet' — помесячные архивные листы '<лист>_архив_ГГГГ-ММ' в той же таблице,
+    mode='file' — сжатые CSV archive_dir/<лист>/ГГГГ-ММ.csv.gz.
+    Сначала дописывается архив (без строк, которые уже в нём есть), затем
+    холодные строки удаляются одним batchUpdate из непрерывных диапазонов
+    (снизу вверх), так что прерванный запуск можно просто повторить.
+
+    Возвращаемое значение:
+    int: количество перенесённых строк.
+    """
+    values = sheet.get_all_values(value_render_option='UNFORMATTED_VALUE', date_time_render_option='FORMATTED_STRING')
+    if len(values) <= 1:
+        return 0
+    header = values[0]
+    date_index = header.index(date_col)
+    cutoff = date.today() - timedelta(days=hot_days)
+    # Ячейка с датой последнего обновления живёт в первой строке за пределами данных
+    width = header.index('') if '' in header else len(header)
+    header = header[:width]
+
+    cold_by_month = {}
+    cold_rows = []
+    for row_num, row in enumerate(values[1:], start=2):
+        row_date = parse_sheet_date(row[date_index]) if date_index < len(row) else None
+        if row_date is None or row_date >= cutoff:
+            continue
+        cold_by_month.setdefault(row_date.strftime("%Y-%m"), []).append(row[:width])
+        cold_rows.append(row_num)
+
+    if not cold_rows:
+        logging.info(f"🧊 На листе '{sheet.title}' нет строк старше {cutoff}")
+        return 0
+
+    if mode == 'sheet':
+        _archive_to_sheets(sheet.spreadsheet, sheet.title, header, cold_by_month, date_index)
+    elif mode == 'file':
+        _archive_to_files(archive_dir, sheet.title, header, cold_by_month, date_index)
+    else:
+        raise ValueError(f"Неизвестный режим архивации: {mode}")
+
+    # Удаляем снизу вверх, чтобы номера оставшихся диапазонов не сдвигались
+    write_limiter.wait()
+    sheet.spreadsheet.batch_update({'requests': [
+        {'deleteDimension': {'range': {'sheetId': sheet.id, 'dimension': 'ROWS', 'startIndex': start - 1, 'endIndex': end}}}
+        for start, end in reversed(_row_runs(cold_rows))
+    ]})
+    print(f"🧊 Лист '{sheet.title}': {len(cold_rows)} строк старше {cutoff} перенесено в архив ({', '.join(sorted(cold_by_month))})")
+    return len(cold_rows)
+
+
+def apply_retention(spreadsheet, hot_days=HOT_DAYS, mode='sheet', archive_dir=ARCHIVE_DIR, sheets=RETENTION_SHEETS):
+    """Применяет archive_cold_rows ко всем растущим листам таблицы."""
+    return {
+        title: archive_cold_rows(spreadsheet.worksheet(title), date_col, hot_days, mode, archive_dir)
+        for title, date_col in sheets.items()
+    }
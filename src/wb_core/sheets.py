@@ -0,0 +1,410 @@
+import os
+import time
+import logging
+import hashlib
+import threading
+from collections import deque
+from datetime import datetime
+from functools import lru_cache
+
+from wb_core import cassette
+from wb_core.config import creds_path
+from wb_core.http import pause_sync
+from wb_core.utils import batchify
+
+
+# Лимит Sheets API на запись — 60 запросов в минуту на пользователя
+WRITE_QUOTA_PER_MINUTE = int(os.getenv('WB_SHEETS_WRITES_PER_MINUTE', 60))
+# Сколько строк отправляем в одном запросе append, чтобы не упереться в размер тела
+APPEND_CHUNK_ROWS = 20000
+
+_spreadsheets = {}
+
+
+@lru_cache(maxsize=None)
+def get_client():
+    """Клиент gspread на процесс: creds.json читается и авторизуется один раз."""
+    import gspread
+
+    if cassette.replaying():
+        # Ответы Sheets берутся из кассеты: ни creds.json, ни авторизация не нужны
+        from google.auth.credentials import AnonymousCredentials
+        client = gspread.authorize(AnonymousCredentials())
+    else:
+        client = gspread.service_account(filename=creds_path())
+    if cassette.MODE:
+        # gspread 6 держит сессию в http_client, gspread 5 — в самом клиенте
+        cassette.wrap_requests_session(getattr(client, 'http_client', client).session)
+    return client
+
+
+def safe_open_spreadsheet(title, retries=5, delay=5, reopen=False):
+    """
+    Пытается открыть таблицу с повторными попытками при APIError 503.
+
+    Открытая таблица кэшируется на процесс; reopen=True открывает заново.
+    """
+    import gspread
+
+    if not reopen and title in _spreadsheets:
+        return _spreadsheets[title]
+
+    gc = get_client()
+    
+    for attempt in range(1, retries + 1):
+        logging.info(f"[Попытка {attempt}] открыть доступ к таблице '{title}'")
+        
+        try:
+            spreadsheet = gc.open(title)
+            logging.info(f"✅ Таблица '{title}' успешно открыта")
+            _spreadsheets[title] = spreadsheet
+            return spreadsheet
+            
+        except gspread.APIError as e:
+            error_code = e.response.status_code if hasattr(e, 'response') else None
+            logging.info(f"⚠️ [Попытка {attempt}/{retries}] APIError {error_code}: {e}")
+            
+            if error_code == 503:
+                if attempt < retries:
+                    logging.info(f"⏳ Ожидание {delay} секунд перед повторной попыткой...")
+                    time.sleep(delay)
+                    # Увеличиваем задержку для следующей попытки (exponential backoff)
+                    delay *= 2
+                else:
+                    logging.error("❌ Все попытки исчерпаны")
+                    raise
+            else:
+                # Другие ошибки API (403, 404 и т.д.) - не повторяем
+                raise
+                
+        except gspread.SpreadsheetNotFound:
+            logging.info(f"❌ Таблица '{title}' не найдена")
+            raise
+            
+        except Exception as e:
+            logging.error(f"⚠️ [Попытка {attempt}/{retries}] Неожиданная ошибка: {e}")
+            if attempt < retries:
+                logging.error(f"⏳ Ожидание {delay} секунд...")
+                time.sleep(delay)
+                delay *= 2
+            else:
+                raise RuntimeError(f"Не удалось открыть таблицу '{title}' после {retries} попыток.")
+
+
+class WriteRateLimiter:
+    """
+    Скользящее окно в минуту: ждёт, если следующий запрос превысит квоту записи.
+
+    Окно считается в процессе; после share(path) — в SQLite-файле, общем для
+    всех воркеров очереди (квота Sheets одна на сервисный аккаунт).
+    """
+
+    def __init__(self, per_minute=WRITE_QUOTA_PER_MINUTE):
+        self.per_minute = per_minute
+        self.calls = deque()
+        self.lock = threading.Lock()
+        self.path = None
+        self._db = None
+
+    def share(self, path):
+        """Переносит окно в SQLite-файл path (например, файл очереди wb_core.jobqueue)."""
+        with self.lock:
+            self.path, self._db = path, None
+
+    def _shared_db(self):
+        if self._db is None:
+            import sqlite3
+
+            # isolation_level=None — транзакции открываем явно через BEGIN IMMEDIATE
+            self._db = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+            self._db.execute("CREATE TABLE IF NOT EXISTS sheet_writes (at REAL NOT NULL)")
+        return self._db
+
+    def _wait_shared(self):
+        db = self._shared_db()
+        while True:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                db.execute("DELETE FROM sheet_writes WHERE at <= ?", (now - 60,))
+                calls, oldest = db.execute("SELECT COUNT(*), MIN(at) FROM sheet_writes").fetchone()
+                if calls < self.per_minute:
+                    db.execute("INSERT INTO sheet_writes (at) VALUES (?)", (now,))
+                    db.execute("COMMIT")
+                    return
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+            pause = 60 - (now - oldest)
+            logging.info(f"⏳ Квота записи Sheets исчерпана (общая для воркеров), ждём {pause:.1f} сек.")
+            time.sleep(pause)
+
+    def wait(self):
+        if self.path is not None and not cassette.fast_replay():
+            with self.lock:
+                return self._wait_shared()
+        with self.lock:
+            now = time.monotonic()
+            while self.calls and now - self.calls[0] >= 60:
+                self.calls.popleft()
+            if len(self.calls) >= self.per_minute:
+                pause = 60 - (now - self.calls[0])
+                logging.info(f"⏳ Квота записи Sheets исчерпана, ждём {pause:.1f} сек.")
+                pause_sync(pause)
+                self.calls.popleft()
+            self.calls.append(time.monotonic())
+
+
+write_limiter = WriteRateLimiter()
+
+
+def _quoted(sheet, a1):
+    title = sheet.title.replace("'", "''")
+    return f"'{title}'!{a1}"
+
+
+class SheetWriteBatcher:
+    """
+    Накопитель записей в листы одной или нескольких таблиц.
+
+    Дописываемые строки и точечные обновления ячеек (в т.ч. дата последнего
+    обновления) копятся до flush(). При сбросе на таблицу уходит один запрос
+    чтения, чтобы узнать пустые листы, по одному values.append на лист и один
+    values.batchUpdate на все ячейки всех листов. Каждая запись проходит через
+    общий ограничитель квоты.
+    """
+
+    def __init__(self, limiter=write_limiter):
+        self.limiter = limiter
+        self.appends = {}
+        self.cells = {}
+        self.sheets = {}
+
+    def _key(self, sheet):
+        key = (sheet.spreadsheet.id, sheet.id)
+        self.sheets[key] = sheet
+        return key
+
+    def add_rows(self, sheet, rows, header=None):
+        """Строки для дописывания в конец листа; header пишется, если лист пуст."""
+        pending = self.appends.setdefault(self._key(sheet), {'header': header, 'rows': []})
+        pending['rows'].extend(rows)
+
+    def add_range(self, sheet, a1_range, values):
+        self.cells.setdefault(self._key(sheet), []).append({'range': _quoted(sheet, a1_range), 'values': values})
+
+    def add_timestamp(self, sheet):
+        """Дата и время последнего обновления в первую строку последней колонки."""
+        from gspread.utils import rowcol_to_a1
+
+        formatted_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.add_range(sheet, rowcol_to_a1(1, sheet.col_count), [[formatted_time]])
+        return formatted_time
+
+    def _empty_sheets(self, spreadsheet, keys):
+        """Одним запросом проверяет, на каких листах ещё нет заголовка."""
+        keys = [key for key in keys if self.appends[key]['header'] is not None]
+        if not keys:
+            return set()
+        ranges = [_quoted(self.sheets[key], 'A1:Z1') for key in keys]
+        response = spreadsheet.values_batch_get(ranges)
+        return {key for key, value_range in zip(keys, response.get('valueRanges', [])) if not value_range.get('values')}
+
+    def flush(self):
+        by_spreadsheet = {}
+        for key in set(self.appends) | set(self.cells):
+            by_spreadsheet.setdefault(key[0], []).append(key)
+
+        requests_count = 0
+        for keys in by_spreadsheet.values():
+            spreadsheet = self.sheets[keys[0]].spreadsheet
+            append_keys = [key for key in keys if key in self.appends]
+            empty = self._empty_sheets(spreadsheet, append_keys)
+
+            for key in append_keys:
+                sheet, pending = self.sheets[key], self.appends[key]
+                rows = pending['rows']
+                if key in empty:
+                    print(f"Добавляем заголовки и данные на лист '{sheet.title}'")
+                    rows = [pending['header']] + rows
+                for chunk in batchify(rows, APPEND_CHUNK_ROWS):
+                    self.limiter.wait()
+                    spreadsheet.values_append(
+                        _quoted(sheet, 'A1'),
+                        params={'valueInputOption': 'USER_ENTERED', 'insertDataOption': 'INSERT_ROWS'},
+                        body={'values': chunk},
+                    )
+                    requests_count += 1
+
+            data = [item for key in keys for item in self.cells.get(key, [])]
+            if data:
+                self.limiter.wait()
+                spreadsheet.values_batch_update(body={'valueInputOption': 'USER_ENTERED', 'data': data})
+                requests_count += 1
+
+        self.appends.clear()
+        self.cells.clear()
+        self.sheets.clear()
+        return requests_count
+
+
+def read_sheet_df(sheet, columns):
+    """
+    Читает лист одним запросом и возвращает DataFrame только с нужными колонками.
+
+    Читаем неформатированные значения, чтобы числа приходили числами,
+    а не строками с локальными разделителями. Лишние колонки
+    (например, ячейка с датой последнего обновления) отбрасываются.
+    """
+    import numpy as np
+    import pandas as pd
+
+    values = sheet.get_all_values(
+        value_render_option='UNFORMATTED_VALUE',
+        date_time_render_option='FORMATTED_STRING',
+    )
+    if not values:
+        return pd.DataFrame(columns=columns)
+    header, body = values[0], values[1:]
+    positions = {name: i for i, name in enumerate(header) if name in columns}
+    missing = [c for c in columns if c not in positions]
+    if missing:
+        logging.info(f"⚠️ На листе '{sheet.title}' нет колонок: {missing}")
+    data = {
+        name: [row[i] if i < len(row) else None for row in body]
+        for name, i in positions.items()
+    }
+    df = pd.DataFrame(data, columns=list(positions))
+    return df.replace('', np.nan)
+
+
+def send_df_to_google(df, sheet, batcher=None):
+    """
+    Отправляет DataFrame на указанный лист Google Таблицы.
+
+    Параметры:
+    df (DataFrame): DataFrame, который нужно отправить.
+    sheet (gspread.models.Worksheet): Объект листа, на который будут добавлены данные.
+    batcher (SheetWriteBatcher): Общий накопитель записей. Если не передан,
+        данные отправляются сразу; если передан — при его flush().
+
+    Возвращаемое значение:
+    None
+    """
+    own_batcher = batcher is None
+    batcher = batcher or SheetWriteBatcher()
+    try:
+        batcher.add_rows(sheet, df.values.tolist(), header=df.columns.values.tolist())
+        formatted_time = batcher.add_timestamp(sheet)
+        if own_batcher:
+            batcher.flush()
+        print(f"Дата и время последнего обновления: {formatted_time}")
+            
+    except Exception as e:
+        print(f"An error occurred: {e}")
+
+def _normalize_cell(value):
+    """Приводит значение ячейки к строке, одинаковой для листа и DataFrame."""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return str(value).upper()
+    if isinstance(value, (int, float)):
+        if value != value:  # NaN
+            return ''
+        return repr(round(float(value), 6))
+    value = str(value).strip()
+    # Даты, которые таблица отображает как ДД.ММ.ГГГГ
+    if len(value) == 10 and value[2] == '.' and value[5] == '.':
+        value = f"{value[6:]}-{value[3:5]}-{value[:2]}"
+    try:
+        return repr(round(float(value.replace('\xa0', '').replace(' ', '').replace(',', '.')), 6))
+    except ValueError:
+        return value
+
+
+def _row_hash(values):
+    return hashlib.blake2b('\x1f'.join(values).encode('utf-8'), digest_size=8).digest()
+
+
+def refresh_df_in_google(df, sheet, key_cols, batcher=None):
+    """
+    Обновляет на листе только изменившиеся ячейки строк из DataFrame.
+
+    Строки сопоставляются по натуральному ключу key_cols, для каждой
+    сравнивается хэш значений. Изменённые ячейки и строки с новыми
+    ключами отправляются через SheetWriteBatcher.
+
+    Параметры:
+    df (DataFrame): Перезапрошенные данные за последние N дней.
+    sheet (gspread.models.Worksheet): Лист, на котором лежат данные.
+    key_cols (list): Колонки натурального ключа, например ['date', 'account', 'nm_id'].
+    batcher (SheetWriteBatcher): Общий накопитель записей, см. send_df_to_google.
+
+    Возвращаемое значение:
+    dict: количество изменённых строк, ячеек и добавленных строк.
+    """
+    from gspread.utils import rowcol_to_a1
+
+    existing = sheet.get_all_values(value_render_option='UNFORMATTED_VALUE', date_time_render_option='FORMATTED_STRING')
+    if len(existing) <= 1:
+        send_df_to_google(df, sheet, batcher)
+        return {'changed_rows': 0, 'changed_cells': 0, 'appended_rows': len(df)}
+
+    header = existing[0]
+    columns = [c for c in df.columns if c in header]
+    skipped = [c for c in df.columns if c not in header]
+    if skipped:
+        logging.info(f"⚠️ Колонок {skipped} нет на листе '{sheet.title}', они не обновляются")
+    positions = [header.index(c) for c in columns]
+    key_positions = [header.index(c) for c in key_cols]
+
+    # Индекс ключ -> номер строки на листе (при дублях берём последнюю)
+    row_by_key = {}
+    for row_num, row in enumerate(existing[1:], start=2):
+        key = tuple(_normalize_cell(row[i] if i < len(row) else '') for i in key_positions)
+        row_by_key[key] = row_num
+
+    own_batcher = batcher is None
+    batcher = batcher or SheetWriteBatcher()
+    updates = 0
+    appended = []
+    changed_cells = 0
+    for values in df[columns].itertuples(index=False, name=None):
+        new = [_normalize_cell(v) for v in values]
+        key = tuple(new[columns.index(c)] for c in key_cols)
+        row_num = row_by_key.get(key)
+        if row_num is None:
+            appended.append(list(values))
+            continue
+        sheet_row = existing[row_num - 1]
+        old = [_normalize_cell(sheet_row[i] if i < len(sheet_row) else '') for i in positions]
+        if _row_hash(old) == _row_hash(new):
+            continue
+        changed = [i for i, (o, n) in enumerate(zip(old, new)) if o != n]
+        changed_cells += len(changed)
+        # Пишем один диапазон на строку — от первой до последней изменённой колонки
+        first_col, last_col = min(positions[i] for i in changed), max(positions[i] for i in changed)
+        by_col = {positions[i]: v for i, v in enumerate(values)}
+        row_values = [by_col.get(col, sheet_row[col] if col < len(sheet_row) else '') for col in range(first_col, last_col + 1)]
+        batcher.add_range(sheet, f"{rowcol_to_a1(row_num, first_col + 1)}:{rowcol_to_a1(row_num, last_col + 1)}", [row_values])
+        updates += 1
+
+    if appended:
+        # Новые строки раскладываем по порядку колонок листа
+        width = max(positions) + 1
+        rows = []
+        for values in appended:
+            row = [''] * width
+            for position, value in zip(positions, values):
+                row[position] = value
+            rows.append(row)
+        batcher.add_rows(sheet, rows)
+
+    if updates or appended:
+        batcher.add_timestamp(sheet)
+    if own_batcher:
+        batcher.flush()
+    print(f"🔁 Обновлено строк: {updates} (ячеек: {changed_cells}), добавлено новых: {len(appended)}")
+    return {'changed_rows': updates, 'changed_cells': changed_cells, 'appended_rows': len(appended)}
@@ -0,0 +1,202 @@
+import os
+import json
+import time
+import logging
+from datetime import datetime
+
+# Внутридневные снимки рекламы и воронки: snapshots/<датасет>/<день>/.
+# Каждый снимок — <unix-время>.npz только с изменившимися ключами и приращениями
+# метрик относительно предыдущего снимка; keys.json — словарь ключей дня
+# (номер строки -> значения ключа), state.npz — текущие накопленные значения,
+# чтобы новый снимок не пересобирал день из всех приращений.
+SNAPSHOT_DIR = os.getenv('WB_SNAPSHOT_DIR', 'snapshots')
+
+SNAPSHOT_SPECS = {
+    'advert': {
+        'key': ['account', 'advertId', 'article_id'],
+        'metrics': ['views', 'clicks', 'sum', 'atbs', 'orders', 'sum_price', 'canceled'],
+    },
+    'funnel': {
+        'key': ['account', 'nm_id'],
+        'metrics': [
+            'open_count', 'cart_count', 'order_count', 'orders_sum', 'buyout_count', 'buyout_sum',
+            'cancel_count', 'cancel_sum', 'add_to_wish_list', 'stocks_wb', 'stocks_mp',
+        ],
+    },
+}
+
+
+def _day_dir(dataset, day, snapshot_dir):
+    return os.path.join(snapshot_dir, dataset, str(day)[:10])
+
+
+def _snapshot_times(path):
+    """Времена снимков дня по возрастанию."""
+    if not os.path.isdir(path):
+        return []
+    return sorted(int(name[:-4]) for name in os.listdir(path) if name[:-4].isdigit() and name.endswith('.npz'))
+
+
+def _load_keys(path):
+    keys_path = os.path.join(path, 'keys.json')
+    if not os.path.isfile(keys_path):
+        return []
+    with open(keys_path, 'r', encoding='utf-8') as f:
+        return [tuple(key) for key in json.load(f)]
+
+
+def _save_atomic(path, write):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        write(f)
+    os.replace(tmp_path, path)
+
+
+def _accumulate(path, metrics, n_keys, times):
+    """Складывает приращения снимков times в плотный массив (ключи x метрики)."""
+    import numpy as np
+
+    values = np.zeros((n_keys, len(metrics)), dtype=np.float64)
+    for ts in times:
+        with np.load(os.path.join(path, f"{ts}.npz")) as delta:
+            keys = delta['key']
+            for j, metric in enumerate(metrics):
+                values[:, j] += np.bincount(keys, weights=delta[metric], minlength=n_keys)
+    return values
+
+
+def _current_values(path, metrics, n_keys):
+    """Накопленные значения после последнего снимка: из state.npz или пересборкой, если он отстал."""
+    import numpy as np
+
+    times = _snapshot_times(path)
+    state_path = os.path.join(path, 'state.npz')
+    if os.path.isfile(state_path):
+        with np.load(state_path) as state:
+            if times and int(state['ts']) == times[-1]:
+                values = state['values']
+                return np.vstack([values, np.zeros((n_keys - len(values), len(metrics)))])
+    return _accumulate(path, metrics, n_keys, times)
+
+
+def take_snapshot(dataset, df, day=None, ts=None, snapshot_dir=SNAPSHOT_DIR):
+    """
+    Записывает внутридневной снимок датасета за день day.
+
+    Строки с одинаковым ключом суммируются. Ключи, которых нет в ответе,
+    считаются неизменившимися. Пишутся только ключи, у которых изменилась
+    хотя бы одна метрика. Возвращает число записанных ключей.
+    """
+    import numpy as np
+    import pandas as pd
+
+    spec = SNAPSHOT_SPECS[dataset]
+    key_cols, metrics = spec['key'], spec['metrics']
+    day = day or datetime.now().strftime("%Y-%m-%d")
+    ts = int(ts if ts is not None else time.time())
+    path = _day_dir(dataset, day, snapshot_dir)
+    os.makedirs(path, exist_ok=True)
+
+    frame = df[key_cols].astype(str)
+    for metric in metrics:
+        frame[metric] = pd.to_numeric(df[metric], errors='coerce').fillna(0) if metric in df else 0.0
+    frame = frame.groupby(key_cols, sort=False, as_index=False)[metrics].sum()
+
+    keys = _load_keys(path)
+    times = _snapshot_times(path)
+    if times and ts <= times[-1]:
+        raise ValueError(f"Снимок {dataset} за {day}: время {ts} не позже последнего снимка {times[-1]}")
+    known = {key: i for i, key in enumerate(keys)}
+    ids = np.empty(len(frame), dtype=np.int32)
+    for row, key in enumerate(frame[key_cols].itertuples(index=False, name=None)):
+        if key not in known:
+            known[key] = len(keys)
+            keys.append(key)
+        ids[row] = known[key]
+
+    values = _current_values(path, metrics, len(keys))
+    current = frame[metrics].to_numpy(dtype=np.float64)
+    delta = current - values[ids]
+    changed = (delta != 0).any(axis=1)
+    values[ids] = current
+
+    # Порядок записи: словарь ключей, приращения, затем кэш. Если процесс упадёт
+    # до обновления state.npz, его ts отстанет от последнего снимка и значения пересоберутся
+    _save_atomic(os.path.join(path, 'keys.json'), lambda f: f.write(json.dumps([list(key) for key in keys], ensure_ascii=False).encode('utf-8')))
+    _save_atomic(
+        os.path.join(path, f"{ts}.npz"),
+        lambda f: np.savez_compressed(f, key=ids[changed], **{metric: delta[changed, j] for j, metric in enumerate(metrics)}),
+    )
+    _save_atomic(os.path.join(path, 'state.npz'), lambda f: np.savez_compressed(f, ts=np.int64(ts), values=values))
+    logging.info(f"📸 Снимок {dataset} за {day}: изменилось {int(changed.sum())} из {len(frame)} ключей")
+    return int(changed.sum())
+
+
+def _to_timestamp(value, day):
+    """Время снимка: unix-время, 'ЧЧ:ММ' внутри дня day или полная дата-время."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if len(str(value)) <= 5:
+        value = f"{str(day)[:10]} {value}"
+    return int(datetime.fromisoformat(str(value)).timestamp())
+
+
+def _key_frame(keys, key_cols, ids):
+    import pandas as pd
+    return pd.DataFrame([keys[i] for i in ids], columns=key_cols)
+
+
+def value_at(dataset, day, at=None, snapshot_dir=SNAPSHOT_DIR):
+    """
+    Значения метрик на момент at (по последнему снимку не позже at).
+
+    at — unix-время, 'ЧЧ:ММ' или 'ГГГГ-ММ-ДД ЧЧ:ММ'; None — последний снимок дня.
+    """
+    import pandas as pd
+
+    spec = SNAPSHOT_SPECS[dataset]
+    path = _day_dir(dataset, day, snapshot_dir)
+    keys = _load_keys(path)
+    at = _to_timestamp(at, day)
+    times = [ts for ts in _snapshot_times(path) if at is None or ts <= at]
+    if not times:
+        return pd.DataFrame(columns=spec['key'] + spec['metrics'] + ['snapshot_at'])
+    values = _accumulate(path, spec['metrics'], len(keys), times)
+    df = _key_frame(keys, spec['key'], range(len(keys)))
+    df[spec['metrics']] = values
+    df['snapshot_at'] = datetime.fromtimestamp(times[-1]).strftime("%Y-%m-%d %H:%M:%S")
+    return df
+
+
+def increments(dataset, day, freq_seconds=3600, snapshot_dir=SNAPSHOT_DIR):
+    """
+    Приращения метрик по интервалам (по умолчанию по часам).
+
+    Снимок относится к интервалу, в который он сделан: приращение за час —
+    разница между последним снимком часа и последним снимком до него.
+    Первый снимок дня содержит значения с начала дня до момента снимка.
+    """
+    import numpy as np
+    import pandas as pd
+
+    spec = SNAPSHOT_SPECS[dataset]
+    metrics = spec['metrics']
+    path = _day_dir(dataset, day, snapshot_dir)
+    keys = _load_keys(path)
+    frames = []
+    for ts in _snapshot_times(path):
+        with np.load(os.path.join(path, f"{ts}.npz")) as delta:
+            frame = pd.DataFrame({metric: delta[metric] for metric in metrics})
+            frame['key'] = delta['key']
+        frame['period'] = ts - ts % freq_seconds
+        frames.append(frame)
+    if not frames:
+        return pd.DataFrame(columns=['period'] + spec['key'] + metrics)
+    grouped = pd.concat(frames, ignore_index=True).groupby(['period', 'key'], as_index=False)[metrics].sum()
+    grouped = grouped[(grouped[metrics] != 0).any(axis=1)]
+    df = _key_frame(keys, spec['key'], grouped['key'])
+    df.insert(0, 'period', [datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M") for ts in grouped['period']])
+    df[metrics] = grouped[metrics].to_numpy()
+    return df
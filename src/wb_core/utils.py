@@ -0,0 +1,69 @@
+import os
+from contextlib import contextmanager
+
+
+def batchify(data, batch_size):
+    """
+    Splits data into batches of a specified size.
+
+    Parameters:
+    - data: The list of items to be batched.
+    - batch_size: The size of each batch.
+
+    Returns:
+    - A generator yielding batches of data.
+    """
+    for i in range(0, len(data), batch_size):
+        yield data[i:i + batch_size]
+
+
+def records_to_columns(records):
+    """Переводит список словарей в колоночный вид {колонка: [значения]}."""
+    keys = dict.fromkeys(key for record in records for key in record)
+    return {key: [record.get(key) for record in records] for key in keys}
+
+
+def columns_to_frame(batches):
+    """Собирает DataFrame из колоночных батчей."""
+    import pandas as pd
+
+    frames = [pd.DataFrame(batch) for batch in batches if batch]
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+
+def parse_dates(series):
+    """
+    Даты из листов и API с точностью до дня: ГГГГ-ММ-ДД (в т.ч. с временем) и ДД.ММ.ГГГГ.
+
+    Форматы разбираются явно: с dayfirst=True pandas читает 2024-03-12 как 3 декабря.
+    """
+    import pandas as pd
+
+    text = series.astype(str).str[:10]
+    parsed = pd.to_datetime(text, errors='coerce', format='%Y-%m-%d')
+    rest = parsed.isna()
+    if rest.any():
+        parsed[rest] = pd.to_datetime(text[rest], errors='coerce', format='%d.%m.%Y')
+    return parsed
+
+
+@contextmanager
+def state_lock(path):
+    """
+    Блокировка файла состояния path на время чтения-изменения-записи.
+
+    flock на соседнем path.lock: работает между процессами (воркеры очереди)
+    и между потоками одного процесса — у каждого вызова свой дескриптор.
+    """
+    import fcntl
+
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.lock", 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)